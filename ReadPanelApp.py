@@ -8,22 +8,77 @@ For each panel a list of red, amber and green ensembl ids are collected in a dic
 @author: aled
 '''
 
-import requests
+import argparse
+from array import array
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
+from gene_index import build_index
+from panel_cache import PanelCache
+from panelapp_backends import BACKENDS
+from panelapp_client import PanelAppClient
+from panelapp_io import PanelRecordWriter, read_panel_records
+from panel_model import GeneTable, PanelGenes
+from run_report import Profiler, RunReport
+from snapshot_store import SnapshotStore, diff
 
 class PanelAPP_API():
 
-    def __init__(self):
-        # define the apis urls. both set to return json.
-        self.list_of_panels = "https://panelapp.genomicsengland.co.uk/WebServices/list_panels/?format=json"
-        # need to append the panel name on end
-        self.list_of_genes = "https://panelapp.genomicsengland.co.uk/WebServices/get_panel/%s/?format=json"
+    def __init__(self, workers=1, base_url="https://panelapp.genomicsengland.co.uk", cache_path=None, legacy_output=False, streaming=False,
+                 timeout=(10, 60), retries=5, rate=None, http_cache_dir=None, api="legacy", page_size=None, snapshot_dir=None,
+                 report=None, gene_index=False):
+        # timings of each phase and request for the run report. nothing is recorded unless a report is given
+        self.report = report or RunReport("ReadPanelApp.py", enabled=False)
 
-        # set up the dictionary to collate all the panels
+        # number of panels requested at the same time. 1 fetches the panels one after another
+        self.workers = workers
+
+        # all requests are made by one client so connections are pooled and reused rather than opened for every panel.
+        # the client also handles timeouts, retries, rate limiting and conditional requests (see panelapp_client.py)
+        # the pool needs a connection for each worker otherwise the workers queue for a connection
+        self.client = PanelAppClient(pool_size=max(self.workers, 10), timeout=timeout, retries=retries, rate=rate, cache_dir=http_cache_dir,
+                                     report=self.report)
+
+        # the web services read - the original WebServices endpoints or the paginated REST API (see panelapp_backends.py)
+        self.backend = BACKENDS[api](self.client, base_url, page_size)
+        # if the backend can return the genes of every panel at once it is used when more than this many panels need fetching.
+        # otherwise the panels are requested one at a time
+        self.bulk_threshold = 10
+
+        # optional on-disk cache of gene lists so only new or updated panels are downloaded
+        self.cache = None
+        if cache_path:
+            self.cache = PanelCache(cache_path)
+
+        # set up the dictionary to collate all the panels. each panel has an array of gene ids for each colour
         self.dict_of_panels = {}
+        # every gene seen in any panel, held once
+        self.genes = GeneTable()
+
+        # in streaming mode each panel response is decoded as it is downloaded and each panel is written to the output
+        # as soon as it is fetched, rather than keeping every panel in dict_of_panels until the end
+        self.streaming = streaming
+        # size of the chunks of a response decoded at a time when streaming
+        self.chunk_size = 65536
+        # the open output files, while writing
+        self.writer = None
+        self.legacy_files = None
         
         # output_file
         self.outputfilepath="/home/mokaguys/Documents/PanelApp/"
+        # also write the original pair of text files alongside the json lines file
+        self.legacy_output = legacy_output
+
+        # optional store of earlier harvests. each harvest is added and the changes since the previous harvest are written
+        self.snapshots = None
+        if snapshot_dir:
+            self.snapshots = SnapshotStore(snapshot_dir)
+
+        # also write an index from each gene to the panels containing it (see gene_index.py)
+        self.gene_index = gene_index
+
+        # in a pipelined harvest and import each panel written is also put on this PanelPipe, to be imported
+        # while the harvest continues (see pipeline.py)
+        self.pipe = None
 
         # timestamp
         self.now = datetime.now().strftime("%Y%m%d")
@@ -31,105 +86,273 @@ class PanelAPP_API():
     def get_list_of_panels(self):
         ''' Retrieve all the gene panels from the PanelAPP url. Create an dictionary key for each one made up of a tuple of the panel name and version number'''
 
-        # the response package retrieves the results of the url search
-        response = requests.get(self.list_of_panels)
-
-        # this is captured as a json object
-        json_results = response.json()
+        with self.report.phase("list panels"):
+            # loop through each panel returned by the web services
+            for panel_id, name, version in self.backend.list_panels():
+                # create a tuple of the name and version
+                # replace underscore from panel names to prevent issues splitting this string when importing to moka
+                toople = (str(panel_id), str(name.replace("_", "-")), str(version))
 
-        # loop through each panel within the json
-        for panel in json_results["result"]:
-            # create a tuple of the name and version
-            # replace underscore from panel names to prevent issues splitting this string when importing to moka
-            toople = (str(panel["Panel_Id"]), str(panel["Name"].replace("_", "-")), str(panel["CurrentVersion"]))
-
-            # create a dictionary key with this tuple and an empty dictionary as the value
-            self.dict_of_panels[toople] = {}
+                # create a dictionary key with this tuple and an empty dictionary as the value
+                self.dict_of_panels[toople] = {}
 
         # call next module
         self.get_genes_in_panel()
 
     def get_genes_in_panel(self):
-        '''This module loops through each panel and retrieves the genes within this panel as a json'''
-        # loop through dict
-        for panel in self.dict_of_panels:
-            # split the tuple
-            panelID = panel[0]
-
-            # the response package retrieves the results of the url search
-            response = requests.get(self.list_of_genes % (panelID))
-            
-            # this is captured as a json object
-            json_results = response.json()
-
-            # create some empty lists to hold the gene lists
-            red_list = []
-            amber_list = []
-            green_list = []
-            
-            red_symbol_list = []
-            amber_symbol_list = []
-            green_symbol_list = []
-            
-            # loop through each gene in the json
-            for gene in json_results["result"]["Genes"]:
-                ensemblid_list=[]
-                ensemblids=gene["EnsembleGeneIds"]
-                for ensemblid in ensemblids:
-                    ensemblid_list.append(str(ensemblid))                 
-                                        
-                symbol = str(gene["GeneSymbol"])
-
-                # some genes have multiple ensembl gene ids. combine these into a sql friendly string
-                ensemblid = "'" + '\',\''.join(ensemblid_list) + "'"  # plan is to use if gene in this string
-
-                # each gene is red amber or green based on the evidence. Using this assign each gene into relevant gene list
-                if gene["LevelOfConfidence"] == "HighEvidence":
-                    green_list.append(ensemblid)
-                    green_symbol_list.append(symbol)
-                if gene["LevelOfConfidence"] == "ModerateEvidence":
-                    amber_list.append(ensemblid)
-                    amber_symbol_list.append(symbol)
-                if gene["LevelOfConfidence"] == "LowEvidence":
-                    red_list.append(ensemblid)
-                    red_symbol_list.append(symbol)
-
-            # populate the dictionary for this panel with an entry for each gene list
-            #self.dict_of_panels[i]["Red"] = red_list
-            self.dict_of_panels[panel]["Amber"] = amber_list
-            self.dict_of_panels[panel]["Green"] = green_list
-            
-            # populate the dictionary for this panel with an entry for each gene list
-            #self.dict_of_panels[i]["red_symbols"] = red_symbol_list
-            self.dict_of_panels[panel]["Amber_symbols"] = amber_symbol_list
-            self.dict_of_panels[panel]["Green_symbols"] = green_symbol_list
-            
+        '''This module loops through each panel and retrieves the genes within this panel as a json.
+        If more than one worker is set the panels are fetched concurrently'''
+        # sort the panels so they are always fetched and merged in the same order
+        panels = sorted(self.dict_of_panels)
+
+        # take any panels with an unchanged version from the cache. only the remaining panels need fetching
+        to_fetch = panels
+        cached = {}
+        if self.cache:
+            with self.report.phase("read cache"):
+                # first remove any panels which have been updated or are no longer in panelapp
+                self.cache.evict_stale([(panel[0], panel[2]) for panel in panels])
+                to_fetch = []
+                for panel in panels:
+                    gene_lists = self.cache.get(panel[0], panel[2])
+                    if gene_lists is None:
+                        to_fetch.append(panel)
+                    else:
+                        cached[panel] = self.from_gene_lists(gene_lists)
+
+        # read the genes of every panel at once if the backend can, rather than making a request for each panel.
+        # any panels not returned are requested on their own
+        bulk = {}
+        if self.backend.supports_bulk and len(to_fetch) > self.bulk_threshold:
+            with self.report.phase("fetch genes in bulk"):
+                bulk = self.fetch_bulk_genes(to_fetch)
+            to_fetch = [panel for panel in to_fetch if panel not in bulk]
+
+        pool = None
+        if self.workers > 1:
+            # fetch the panels using a pool of threads - imap returns the results in the same order as the panels, as they are ready
+            pool = ThreadPool(self.workers)
+            results = pool.imap(self.fetch_panel_genes, to_fetch)
+        else:
+            results = (self.fetch_panel_genes(panel) for panel in to_fetch)
+
+        # go through the panels in order, taking the genes from the cache or the fetched results.
+        # when streaming this includes writing the output
+        with self.report.phase("fetch panels"):
+            if self.streaming:
+                self.open_output()
+            fetched = False
+            try:
+                for panel in panels:
+                    if panel in cached:
+                        panel_genes = cached.pop(panel)
+                    else:
+                        panel_genes = bulk.pop(panel) if panel in bulk else next(results)
+                        if self.cache:
+                            self.cache.put(panel[0], panel[2], self.to_gene_lists(panel_genes))
+                    if self.streaming:
+                        # write the panel straight away, it isn't kept
+                        self.write_panel(panel, panel_genes)
+                    else:
+                        # populate the dictionary with the genes for each panel
+                        self.dict_of_panels[panel] = panel_genes
+                fetched = True
+            finally:
+                if pool:
+                    if fetched:
+                        pool.close()
+                    else:
+                        # after an error (eg the importer of a pipelined run failing) the panels not yet fetched are abandoned
+                        pool.terminate()
+                    pool.join()
+                if self.streaming:
+                    self.close_output()
+
+        if self.cache:
+            with self.report.phase("save cache"):
+                self.cache.save()
+            print self.cache.summary()
+        print self.client.summary()
+
         # call module to write output file 
-        self.write_output()
-            
+        if not self.streaming:
+            self.write_output()
+
+        if self.snapshots:
+            self.write_changes()
+
+        if self.gene_index:
+            self.write_gene_index()
+
+    def fetch_panel_genes(self, panel):
+        '''Retrieve the genes for a single panel, returning a dictionary containing an array of the ids of the amber genes and of the green genes'''
+        if self.streaming:
+            # each gene is decoded as the response is downloaded. if the response is cut short the panel is started again
+            return self.client.retry(lambda: self.classify_genes(self.backend.panel_genes(panel[0], True, self.chunk_size)))
+        return self.classify_genes(self.backend.panel_genes(panel[0]))
+
+    def fetch_bulk_genes(self, panels):
+        '''Retrieve the genes for a list of panels from the backend's bulk endpoints, returning a dictionary of panel: the dictionary
+        of gene id arrays for the panel. A panel with a different version in the bulk results (ie updated since the panels were
+        listed) is left out so it is requested on its own'''
+        # panel id: panel tuple
+        wanted = dict((panel[0], panel) for panel in panels)
+        # every panel starts with no genes, as a panel with no amber or green genes isn't in the results
+        panel_genes = dict((panel, {"Amber": array("l"), "Green": array("l")}) for panel in panels)
+        updated = set()
+        for panel_id, version, colour, symbol, ensembl_ids in self.backend.bulk_genes():
+            panel = wanted.get(str(panel_id))
+            # skip panels which were taken from the cache
+            if panel is None:
+                continue
+            if str(version) != panel[2]:
+                updated.add(panel)
+                continue
+            panel_genes[panel][colour].append(self.genes.add(symbol, ensembl_ids))
+        for panel in updated:
+            del panel_genes[panel]
+        if self.backend.sort_genes:
+            for genes in panel_genes.values():
+                for colour in genes:
+                    genes[colour] = self.sort_genes(genes[colour])
+        return panel_genes
+
+    def classify_genes(self, genes):
+        '''Sort the (colour, symbol, ensembl ids) of the genes of a panel by colour, returning a dictionary containing an array of the
+        ids of the amber genes and of the green genes'''
+        # create some empty arrays to hold the gene ids
+        panel_genes = {"Amber": array("l"), "Green": array("l")}
+
+        # loop through each gene, assigning it to the relevant gene list
+        for colour, symbol, ensembl_ids in genes:
+            panel_genes[colour].append(self.genes.add(symbol, ensembl_ids))
+        if self.backend.sort_genes:
+            for colour in panel_genes:
+                panel_genes[colour] = self.sort_genes(panel_genes[colour])
+        return panel_genes
+
+    def sort_genes(self, genes):
+        '''Sort an array of gene ids by symbol then ensembl ids'''
+        return array("l", sorted(genes, key=lambda gene: (self.genes.symbols[gene], self.genes.ensembl_ids[gene])))
+
+    def to_gene_lists(self, panel_genes):
+        '''Convert the genes of a panel to the dictionary of gene lists stored in the cache'''
+        gene_lists = {}
+        for colour, genes in panel_genes.items():
+            gene_lists[colour] = self.genes.ensembl_ids_of(genes)
+            gene_lists[colour + "_symbols"] = self.genes.symbols_of(genes)
+        return gene_lists
+
+    def from_gene_lists(self, gene_lists):
+        '''Add the genes from a dictionary of gene lists read from the cache to the gene table'''
+        return dict((colour, self.genes.add_genes(gene_lists[colour + "_symbols"], gene_lists[colour])) for colour in ("Amber", "Green"))
+
     def write_output(self):
-        #open two files, one to capture all ensembl ids for each panel and one to capture a list of symbols.
-        outputfile = open(self.outputfilepath + self.now + "_PanelAppOut.txt",'w')
-        symbols_outputfile = open(self.outputfilepath + self.now + "_PanelAppOut_symbols.txt", 'w')
-        # for each panel
-        for panel in self.dict_of_panels:
-            # for each colour
-            for symbol in self.dict_of_panels[panel]:
-                # if it's a gene symbol panel  
-                if "symbols" in symbol:
-                    # if there are symbols for this panel
-                    if len(self.dict_of_panels[panel][symbol]) > 0:
-                        # write line so looks like panelhash_panelname_version_colour_symbols:['list','of','gene','symbols']
-                        # eg. 553f968cbb5a1616e5ed45cc_Classical tuberous sclerosis_1.0_Green_symbols:['TSC1', 'TSC2']
-                        symbols_outputfile.write(str(panel[0]) + "_" + str(panel[1]) + "_" + str(panel[2]) + "_" + symbol + ":" + str(self.dict_of_panels[panel][symbol]) + "\n")
-                else:
-                    #repeat for ensembl ids
-                    if len(self.dict_of_panels[panel][symbol]) > 0:
-                        outputfile.write(str(panel[0]) + "_" + str(panel[1]) + "_" + str(panel[2]) + "_" + symbol + ":" + str(self.dict_of_panels[panel][symbol]) + "\n")
-        outputfile.close()
-        symbols_outputfile.close()
+        '''Write a json lines file with a record for the genes of each colour in each panel'''
+        with self.report.phase("write output"):
+            self.open_output()
+            try:
+                # for each panel (sorted so the output is the same however the panels were fetched)
+                for panel in sorted(self.dict_of_panels):
+                    self.write_panel(panel, self.dict_of_panels[panel])
+            finally:
+                self.close_output()
+
+    def open_output(self):
+        '''Open the output files'''
+        self.writer = PanelRecordWriter(self.outputfilepath + self.now + "_PanelAppOut.jsonl")
+        if self.legacy_output:
+            #open two files, one to capture all ensembl ids for each panel and one to capture a list of symbols.
+            self.legacy_files = (open(self.outputfilepath + self.now + "_PanelAppOut.txt",'w'), open(self.outputfilepath + self.now + "_PanelAppOut_symbols.txt", 'w'))
+
+    def write_panel(self, panel, panel_genes):
+        '''Write the genes of a panel to the output files'''
+        # for each colour
+        for colour in ("Amber", "Green"):
+            # if there are genes for this panel
+            if len(panel_genes[colour]) > 0:
+                record = PanelGenes(panel[0], panel[1], panel[2], colour, panel_genes[colour], self.genes)
+                self.writer.write(record)
+                if self.pipe:
+                    self.pipe.put(record)
+        if self.legacy_output:
+            self.write_legacy_panel(panel, panel_genes)
+
+    def close_output(self):
+        '''Close the output files'''
+        self.writer.close()
+        if self.legacy_files:
+            for output in self.legacy_files:
+                output.close()
+            self.legacy_files = None
+
+    def write_changes(self):
+        '''Add the output to the snapshot store and write the changes since the previous snapshot to a change feed'''
+        with self.report.phase("snapshots"):
+            snapshot = self.snapshots.add(self.now, read_panel_records(self.outputfilepath + self.now + "_PanelAppOut.jsonl"))
+            previous = self.snapshots.previous(self.now)
+            if previous is None:
+                print "snapshot %s added. there are no earlier snapshots to compare it with" % self.now
+                return
+            feed = diff(self.snapshots.load(previous), snapshot)
+            feed.write(self.outputfilepath + self.now + "_PanelAppChanges.jsonl")
+        print feed.summary()
+
+    def write_gene_index(self):
+        '''Write an index from each gene in the output to the panels containing it'''
+        with self.report.phase("gene index"):
+            build_index(read_panel_records(self.outputfilepath + self.now + "_PanelAppOut.jsonl"),
+                        self.outputfilepath + self.now + "_PanelAppGenes.idx")
+
+    def write_legacy_panel(self, panel, panel_genes):
+        '''Write the genes of a panel to the original pair of text files'''
+        outputfile, symbols_outputfile = self.legacy_files
+        # for each colour
+        for colour in ("Amber", "Green"):
+            # if there are genes for this panel
+            if len(panel_genes[colour]) > 0:
+                # write line so looks like panelhash_panelname_version_colour_symbols:['list','of','gene','symbols']
+                # eg. 553f968cbb5a1616e5ed45cc_Classical tuberous sclerosis_1.0_Green_symbols:['TSC1', 'TSC2']
+                symbols_outputfile.write(str(panel[0]) + "_" + str(panel[1]) + "_" + str(panel[2]) + "_" + colour + "_symbols:" + str(self.genes.symbols_of(panel_genes[colour])) + "\n")
+                #repeat for ensembl ids
+                # combine each gene's ensembl ids into a sql friendly string
+                ensemblids = ["'" + '\',\''.join(gene) + "'" for gene in self.genes.ensembl_ids_of(panel_genes[colour])]
+                outputfile.write(str(panel[0]) + "_" + str(panel[1]) + "_" + str(panel[2]) + "_" + colour + ":" + str(ensemblids) + "\n")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Harvest all gene panels from the PanelApp API")
+    parser.add_argument("--workers", type=int, default=1, help="number of panels to fetch concurrently (default: 1)")
+    parser.add_argument("--cache", help="path to a cache file. only panels that are new or have a new version are downloaded")
+    parser.add_argument("--legacy-output", action="store_true", help="also write the original PanelAppOut.txt and PanelAppOut_symbols.txt files")
+    parser.add_argument("--stream", action="store_true", help="decode each panel as it is downloaded and write it straight to the output, so memory use doesn't grow with the number of panels")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for a response before retrying (default: 60)")
+    parser.add_argument("--retries", type=int, default=5, help="number of times a failed request is retried (default: 5)")
+    parser.add_argument("--rate-limit", type=float, help="the most requests to make a second")
+    parser.add_argument("--http-cache", help="directory to save responses in. they are only downloaded again if they have changed")
+    parser.add_argument("--api", choices=sorted(BACKENDS), default="legacy", help="the web services to read - the original WebServices (legacy) or the paginated REST API (v1). default: legacy")
+    parser.add_argument("--page-size", type=int, help="results to ask for in each page of the REST API (default: the server's page size)")
+    parser.add_argument("--snapshots", help="directory of earlier harvests. the harvest is added and the changes since the previous harvest are written to a PanelAppChanges.jsonl file")
+    parser.add_argument("--gene-index", action="store_true", help="also write a PanelAppGenes.idx index from each gene to the panels containing it, to be queried with gene_index.py")
+    parser.add_argument("--run-report", help="time each phase, request and download and write a json run report to this file")
+    parser.add_argument("--profile", help="profile the harvest and write the functions taking the most time to this file")
+    parser.add_argument("--profiler", choices=["cprofile", "pyinstrument"], default="cprofile", help="the profiler used by --profile (default: cprofile)")
+    args = parser.parse_args()
+
+    report = RunReport("ReadPanelApp.py", enabled=bool(args.run_report))
+    profiler = Profiler(args.profile, args.profiler) if args.profile else None
+    if profiler:
+        profiler.start()
+
     # create object
-    a = PanelAPP_API()
-    a.get_list_of_panels()
+    a = PanelAPP_API(workers=args.workers, cache_path=args.cache, legacy_output=args.legacy_output, streaming=args.stream,
+                     timeout=(10, args.timeout), retries=args.retries, rate=args.rate_limit, http_cache_dir=args.http_cache,
+                     api=args.api, page_size=args.page_size, snapshot_dir=args.snapshots, report=report,
+                     gene_index=args.gene_index)
+    try:
+        a.get_list_of_panels()
+    finally:
+        if profiler:
+            profiler.stop()
+    if args.run_report:
+        report.write(args.run_report)
+        print report.summary()
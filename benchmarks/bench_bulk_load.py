@@ -0,0 +1,113 @@
+'''
+Benchmark the bulk load (insert_to_moka.py --bulk) against the planned import, and check both make exactly the same changes.
+
+Two harvests are made from the panels of a mock PanelApp, the second after some panels have had their version bumped and
+genes changed, and some panels have been added and removed. Each harvest is imported in turn into two SQLite stand-ins for
+Moka, one with parse_PanelAPP_API_result and one with bulk_load. Before the second import both stand-ins are given the
+awkward cases the importer handles: an ensembl id with more than one row in the translation table (the row first by HGNCID and
+symbol is used, which here isn't the row inserted first), and
+a new panel already in the item table in a different case, as if an earlier import stopped part way through.
+
+After each import every row of the Item, NGSPanel and NGSPanelGenes tables (including the keys, but not the check dates) must be
+the same in both stand-ins, as must the change set and the check of the imported genes.
+
+The stand-ins are in this process, so the time of each import is mostly the work done, not waiting on the network. The
+number of statements each import runs (each a round trip to Moka) is also shown. The bulk load runs the same number of
+statements however many panels there are.
+
+run from the repository root:
+    python -m benchmarks.bench_bulk_load --panels 400 --genes 200
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from insert_to_moka import insert_PanelApp
+from benchmarks.bench_snapshots import change_panels, harvest, write
+from benchmarks.mock_panelapp import MockPanelApp
+from benchmarks.moka_sqlite import add_translations, connect_moka
+from benchmarks.suite import new_moka
+
+
+def tables(cnxn):
+    '''Every row of the tables written by an import, except the check dates'''
+    return (cnxn.execute("select ItemID, Item, ItemCategoryIndex1ID from Item order by ItemID").fetchall(),
+            cnxn.execute("select NGSPanelID, Category, SubCategory, Panel, PanelCode, Active, Checker1, PanelType from NGSPanel order by NGSPanelID").fetchall(),
+            cnxn.execute("select NGSPanelGeneID, NGSPanelID, HGNCID, Symbol, Checker from NGSPanelGenes order by NGSPanelGeneID").fetchall())
+
+
+def import_result(path, api_result, bulk):
+    '''Import an API result into the stand-in at path, returning the seconds taken, the number of statements run, the ChangeSet
+    and the Reconciliation'''
+    cnxn = connect_moka(path)
+    start = time.time()
+    moka = insert_PanelApp(cnxn, connect=lambda: connect_moka(path))
+    moka.API_result = api_result
+    moka.load_translations()
+    moka.check_item_category_table()
+    if bulk:
+        moka.load_versions()
+        changes = moka.bulk_load()
+    else:
+        moka.get_list_of_versions()
+        moka.all_existing_panels()
+        changes = moka.parse_PanelAPP_API_result()
+    seconds = time.time() - start
+    cnxn.close()
+    return seconds, sum(count for count, statement_seconds in moka.queries.stats.values()), changes, moka.reconciliation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=400)
+    parser.add_argument("--genes", type=int, default=200)
+    parser.add_argument("--changed", type=float, default=0.1, help="proportion of panels changed before the second harvest (default: 0.1)")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        mock = MockPanelApp(panels=args.panels, genes=args.genes)
+        first = os.path.join(tmp, "first_PanelAppOut.jsonl")
+        write(harvest(mock), first)
+        change_panels(mock, args.changed)
+        records = harvest(mock)
+        second = os.path.join(tmp, "second_PanelAppOut.jsonl")
+        write(records, second)
+        planned = os.path.join(tmp, "planned.db")
+        bulk = os.path.join(tmp, "bulk.db")
+        for path in (planned, bulk):
+            new_moka(path, args.genes)
+
+        print "%d panels x %d genes, %d panel colours" % (args.panels, args.genes, len(records))
+        print "%-20s %10s %10s %18s %15s" % ("import", "planned s", "bulk s", "planned statements", "bulk statements")
+        for name, api_result in (("first import", first), ("incremental import", second)):
+            if api_result == second:
+                # the awkward cases, added to both stand-ins
+                new_panel = [record for record in records if record.panel_hash.startswith("new")][0]
+                for path in (planned, bulk):
+                    cnxn = connect_moka(path)
+                    add_translations(cnxn, [("HGNC:%d" % i, "DUPLICATE%d" % i, "ENSG%011d" % i) for i in range(5)])
+                    cnxn.execute("insert into Item(Item, ItemCategoryIndex1ID) values (?, 48)", (new_panel.panel_hash + "_" + new_panel.colour.lower(),))
+                    cnxn.commit()
+                    cnxn.close()
+            planned_seconds, planned_statements, planned_changes, planned_check = import_result(planned, api_result, False)
+            bulk_seconds, bulk_statements, bulk_changes, bulk_check = import_result(bulk, api_result, True)
+            print "%-20s %10.3f %10.3f %18d %15d" % (name, planned_seconds, bulk_seconds, planned_statements, bulk_statements)
+            if tables(connect_moka(planned)) != tables(connect_moka(bulk)):
+                raise Exception("the bulk load of the %s doesn't give the same tables as the planned import" % name)
+            if bulk_changes.report() != planned_changes.report() or [change.ngspanel_key for change in bulk_changes.panels] != [
+                    change.ngspanel_key for change in planned_changes.panels]:
+                raise Exception("the bulk load of the %s doesn't give the same change set as the planned import" % name)
+            if bulk_check.discrepancies != planned_check.discrepancies:
+                raise Exception("the check of the genes of the %s differs between the bulk load and the planned import" % name)
+            print "    " + bulk_changes.report().splitlines()[0]
+        print "the bulk load gives the same tables, change sets and checks as the planned import"
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+'''
+Check the HTTP client against a mock PanelApp which injects faults, and measure the saving from conditional requests.
+
+- a harvest from a server with no faults gives the expected output
+- a harvest from a server where a proportion of responses fail (500, 503, 429, dropped connections, responses cut
+  short and responses slower than the timeout) must retry its way to identical output, with and without streaming
+- a second harvest using the same http cache directory gets 304 Not Modified responses and must give identical output.
+  This is checked for harvests which read the whole of each response, and for streaming harvests from an empty cache
+- a harvest with a rate limit must not make more requests a second than the limit
+
+run from the repository root:
+    python -m benchmarks.bench_client --panels 100 --fault-rate 0.2
+'''
+
+import argparse
+import filecmp
+import os
+import shutil
+import tempfile
+import time
+
+from ReadPanelApp import PanelAPP_API
+from benchmarks.mock_panelapp import MockPanelApp
+
+
+def harvest(url, outputdir, workers=1, streaming=False, timeout=(10, 60), rate=None, http_cache_dir=None):
+    '''Run a harvest, returning the seconds taken and the client'''
+    os.mkdir(outputdir)
+    api = PanelAPP_API(workers=workers, base_url=url, streaming=streaming, timeout=timeout, retries=10, rate=rate,
+                       http_cache_dir=http_cache_dir)
+    # don't wait long between retries, the mock's faults are random rather than a sign of an overloaded server
+    api.client.backoff = 0.01
+    api.outputfilepath = outputdir + os.sep
+    start = time.time()
+    api.get_list_of_panels()
+    return time.time() - start, api.client
+
+
+def same_output(expected, outputdir):
+    '''Raise an exception unless outputdir contains the same files as expected'''
+    for name in os.listdir(expected):
+        if not filecmp.cmp(os.path.join(expected, name), os.path.join(outputdir, name), shallow=False):
+            raise Exception("%s differs from the harvest without faults" % os.path.join(outputdir, name))
+
+
+def report(name, seconds, client, mock):
+    print "%-32s %8.2f %9s %8s %8s %13s" % (name, seconds, mock.requests_served, client.retried, client.not_modified,
+                                            sum(mock.faults_injected.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=100)
+    parser.add_argument("--genes", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--fault-rate", type=float, default=0.2, help="proportion of responses with a fault (default: 0.2)")
+    parser.add_argument("--rate-limit", type=float, default=50, help="requests a second for the rate limited harvest (default: 50)")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        print "%-32s %8s %9s %8s %8s %13s" % ("harvest", "seconds", "requests", "retries", "304s", "faults")
+        mock = MockPanelApp(panels=args.panels, genes=args.genes).start()
+        try:
+            expected = os.path.join(tmp, "expected")
+            seconds, client = harvest(mock.url, expected, workers=args.workers)
+            report("no faults", seconds, client, mock)
+
+            # the second harvest with the same cache only gets 304s. the streaming harvests start with their own empty cache,
+            # so every response they get a 304 for was cached by a streaming harvest
+            for run, streaming, cache, filled in (("first", False, "http_cache", False), ("second", False, "http_cache", True),
+                                                  ("third, streaming", True, "http_cache", True),
+                                                  ("streaming, empty", True, "stream_cache", False), ("streaming, second", True, "stream_cache", True)):
+                mock.requests_served = mock.not_modified = 0
+                outputdir = os.path.join(tmp, "cache_%s" % run.replace(", ", "_"))
+                seconds, client = harvest(mock.url, outputdir, workers=args.workers, streaming=streaming, http_cache_dir=os.path.join(tmp, cache))
+                report("http cache, %s run" % run, seconds, client, mock)
+                same_output(expected, outputdir)
+                if filled and mock.not_modified != mock.requests_served:
+                    raise Exception("expected only 304 responses with a full http cache, got %s of %s" % (mock.not_modified, mock.requests_served))
+
+            mock.requests_served = 0
+            outputdir = os.path.join(tmp, "rate_limited")
+            seconds, client = harvest(mock.url, outputdir, workers=args.workers, rate=args.rate_limit)
+            report("rate limit %g/s" % args.rate_limit, seconds, client, mock)
+            same_output(expected, outputdir)
+            # the first request isn't delayed
+            if (mock.requests_served - 1) / seconds > args.rate_limit:
+                raise Exception("%s requests in %.2f seconds exceeds the rate limit" % (mock.requests_served, seconds))
+        finally:
+            mock.stop()
+
+        # responses slower than the read timeout are retried
+        mock = MockPanelApp(panels=args.panels, genes=args.genes, fault_rate=args.fault_rate, slow_seconds=1.0).start()
+        try:
+            for streaming in (False, True):
+                mock.requests_served = 0
+                mock.faults_injected = dict((fault, 0) for fault in mock.faults)
+                outputdir = os.path.join(tmp, "faults_%s" % streaming)
+                seconds, client = harvest(mock.url, outputdir, workers=args.workers, streaming=streaming, timeout=(1, 0.5))
+                report("faults%s" % (", streaming" if streaming else ""), seconds, client, mock)
+                same_output(expected, outputdir)
+            print "faults injected in the last run: %s" % ", ".join("%s %s" % item for item in sorted(mock.faults_injected.items()))
+        finally:
+            mock.stop()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+'''
+Benchmark a full harvest against a local mock PanelApp server with an increasing number of workers.
+
+run from the repository root:
+    python -m benchmarks.bench_fetch --panels 200 --genes 50 --latency 0.02
+'''
+
+import argparse
+import filecmp
+import os
+import shutil
+import tempfile
+import time
+
+from ReadPanelApp import PanelAPP_API
+from benchmarks.mock_panelapp import MockPanelApp
+
+
+def harvest(url, workers, outputdir):
+    '''Run a full harvest into outputdir, returning the wall clock time taken'''
+    api = PanelAPP_API(workers=workers, base_url=url)
+    api.outputfilepath = outputdir + os.sep
+    start = time.time()
+    api.get_list_of_panels()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=200)
+    parser.add_argument("--genes", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    mock = MockPanelApp(panels=args.panels, genes=args.genes, latency=args.latency).start()
+    tmp = tempfile.mkdtemp()
+    try:
+        print "%d panels x %d genes, %.3fs latency" % (args.panels, args.genes, args.latency)
+        print "%8s %10s %10s" % ("workers", "seconds", "speedup")
+        baseline = None
+        first_output = None
+        for workers in args.workers:
+            outputdir = os.path.join(tmp, str(workers))
+            os.mkdir(outputdir)
+            seconds = harvest(mock.url, workers, outputdir)
+            baseline = baseline or seconds
+            print "%8d %10.2f %9.1fx" % (workers, seconds, baseline / seconds)
+
+            # the output must not depend on the number of workers
+            first_output = first_output or outputdir
+            for name in os.listdir(first_output):
+                if not filecmp.cmp(os.path.join(first_output, name), os.path.join(outputdir, name), shallow=False):
+                    raise Exception("%s differs between %s and %s workers" % (name, args.workers[0], workers))
+    finally:
+        mock.stop()
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
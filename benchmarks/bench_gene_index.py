@@ -0,0 +1,109 @@
+'''
+Benchmark building, opening and querying the gene index, and check every query against a scan of the harvest.
+
+The index is built from the panels of a mock PanelApp, with some rare genes added to a few panels each. (Each gene of the
+mock is in many panels so its posting list is stored as a bitmap. The rare genes are stored as arrays.) Then the panels
+containing each gene (by symbol and by ensembl id), and containing any and all of random sets of genes, are looked up in
+the index and compared with a scan of every panel.
+
+run from the repository root:
+    python -m benchmarks.bench_gene_index --panels 400 --genes 300
+'''
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from gene_index import GeneIndex, build_index
+from benchmarks.bench_snapshots import harvest
+from benchmarks.mock_panelapp import MockPanelApp
+
+
+def scan(records, genes, match):
+    '''The panel colours containing any (match=any) or all (match=all) of the genes, found by checking every panel'''
+    genes = [gene.upper() for gene in genes]
+    found = []
+    for record in records:
+        keys = set(record.symbols)
+        for ensembl_ids in record.ensembl_ids:
+            keys.update(ensembl_ids)
+        if match(gene in keys for gene in genes):
+            found.append((record.panel_hash, record.panel_name, record.version, record.colour))
+    return found
+
+
+def time_queries(function, queries):
+    '''The mean milliseconds taken by function for each of the queries'''
+    start = time.time()
+    for query in queries:
+        function(query)
+    return (time.time() - start) * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=400)
+    parser.add_argument("--genes", type=int, default=300)
+    parser.add_argument("--query-genes", type=int, default=200, help="genes in each multi-gene query (default: 200)")
+    parser.add_argument("--queries", type=int, default=200, help="multi-gene queries of each kind (default: 200)")
+    parser.add_argument("--rare-genes", type=int, default=500, help="genes added to only a few panels (default: 500)")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        mock = MockPanelApp(panels=args.panels, genes=args.genes)
+        records = harvest(mock)
+        rand = random.Random(3)
+        for i in range(args.rare_genes):
+            for record in rand.sample(records, rand.randint(1, 3)):
+                record.symbols.append("RARE%d" % i)
+                record.ensembl_ids.append(["ENSGR%010d" % i])
+        path = os.path.join(tmp, "PanelAppGenes.idx")
+        start = time.time()
+        build_index(records, path)
+        build_seconds = time.time() - start
+        start = time.time()
+        index = GeneIndex(path)
+        open_ms = (time.time() - start) * 1000
+
+        symbols = sorted(set(symbol for record in records for symbol in record.symbols))
+        ensembl_ids = sorted(set(ensemblid for record in records for gene in record.ensembl_ids for ensemblid in gene))
+        print "%d panel colours, %d genes, %d ensembl ids" % (len(records), len(symbols), len(ensembl_ids))
+        print "built in %.3f seconds, %.0f KB, opened in %.2f ms" % (build_seconds, os.path.getsize(path) / 1024.0, open_ms)
+
+        # every gene by symbol and by ensembl id, including a lower case symbol and a gene that isn't in any panel
+        singles = symbols + ensembl_ids + [symbols[0].lower(), "NOTAGENE"]
+        multis = [rand.sample(symbols + ensembl_ids, min(args.query_genes, len(symbols))) for i in range(args.queries)]
+        # most sets of many genes aren't all in one panel, so intersections are also made from the genes of a panel
+        pairs = [rand.sample(rand.choice(records).symbols, 2) for i in range(args.queries)]
+
+        for gene in singles:
+            if index.lookup(gene) != scan(records, [gene], any):
+                raise Exception("the panels containing %s don't match a scan of the harvest" % gene)
+        for genes in multis:
+            if index.union(genes) != scan(records, genes, any) or index.intersection(genes) != scan(records, genes, all):
+                raise Exception("the panels containing any or all of %s don't match a scan of the harvest" % genes)
+        for genes in pairs:
+            if index.intersection(genes) != scan(records, genes, all):
+                raise Exception("the panels containing all of %s don't match a scan of the harvest" % genes)
+        print "every query matches a scan of the harvest"
+
+        print "%-36s %10s %10s" % ("query", "index ms", "scan ms")
+        for name, function, queries, match in (
+                ("one gene", lambda genes: index.lookup(genes[0]), [[gene] for gene in singles], any),
+                ("any of %d genes" % args.query_genes, index.union, multis, any),
+                ("all of %d genes" % args.query_genes, index.intersection, multis, all),
+                ("all of 2 genes in a panel", index.intersection, pairs, all)):
+            index_ms = time_queries(function, queries)
+            scan_ms = time_queries(lambda genes: scan(records, genes, match), queries[:20])
+            print "%-36s %10.4f %10.2f" % (name, index_ms, scan_ms)
+        index.close()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
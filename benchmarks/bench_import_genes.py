@@ -0,0 +1,91 @@
+'''
+Benchmark inserting panel genes into an SQLite moka stand-in.
+
+Compares a statement (and commit) per gene, as add_genes_to_NGSPanelGenes used to do, with the
+batched lookup and insert used now.
+
+run from the repository root:
+    python -m benchmarks.bench_import_genes --panels 50 --genes 500
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from insert_to_moka import insert_PanelApp
+from benchmarks.moka_sqlite import create_moka, add_translations, synthetic_translations
+
+
+def setup(path, panels, genes):
+    '''Create a moka stand-in and an insert_PanelApp object with a gene list for each panel'''
+    cnxn = create_moka(path)
+    add_translations(cnxn, synthetic_translations(genes * 4))
+    moka = insert_PanelApp(cnxn)
+    gene_lists = []
+    for panel in range(panels):
+        # each panel has a different selection of genes, one id per gene, in the PanelAppOut.txt format
+        ids = range(panel, panel + genes * 3, 3)
+        gene_lists.append(("Panel %d" % panel, str(["'ENSG%011d'" % i for i in ids]), ["GENE%d" % i for i in ids]))
+    return moka, gene_lists
+
+
+def add_panel(moka, name, symbols):
+    '''Insert an NGSPanel row and set the per panel variables used by add_genes_to_NGSPanelGenes'''
+    moka.panel_name_colour = name
+    moka.panel_hash_colour = name
+    moka.API_symbols[name] = moka.genes.add_genes(symbols, [])
+    moka.inserted_panel_key = moka.queries.insert_return_key("insert_panels", (None, None, name, moka.moka_user))
+
+
+def row_by_row(moka, list_of_genes):
+    '''One select, one insert and one commit per gene'''
+    cursor = moka.cnxn.cursor()
+    for ensbl_id in list_of_genes.replace("[", "").replace("]", "").replace('"', "").replace(" ", "").split(","):
+        gene_info = cursor.execute("select HGNCID,PanelApp_Symbol from dbo.GenesHGNC_current_translation where EnsemblID_PanelApp = %s" % ensbl_id).fetchall()
+        if gene_info:
+            cursor.execute("insert into NGSPanelGenes(NGSPanelID,HGNCID,symbol,checker,checkdate) values (%s,'%s','%s',%s,CURRENT_TIMESTAMP)" % (moka.inserted_panel_key, gene_info[0][0], gene_info[0][1], moka.moka_user))
+            moka.cnxn.commit()
+    moka.check_for_missing_genes()
+
+
+def run(path, panels, genes, batched):
+    '''Import all the panels, returning the time taken and the number of genes inserted'''
+    moka, gene_lists = setup(path, panels, genes)
+    start = time.time()
+    for name, list_of_genes, symbols in gene_lists:
+        add_panel(moka, name, symbols)
+        if batched:
+            moka.add_genes_to_NGSPanelGenes(list_of_genes)
+        else:
+            row_by_row(moka, list_of_genes)
+    seconds = time.time() - start
+    inserted = moka.cnxn.execute("select count(*) from NGSPanelGenes").fetchone()[0]
+    moka.cnxn.close()
+    return seconds, inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=50)
+    parser.add_argument("--genes", type=int, default=500)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        print "%d panels x %d genes" % (args.panels, args.genes)
+        results = {}
+        for label, batched in (("row by row", False), ("batched", True)):
+            # use a database on disk so the cost of each commit is included
+            results[label] = run(os.path.join(tmp, label + ".db"), args.panels, args.genes, batched)
+            print "%12s %8.2fs %8d genes inserted" % (label, results[label][0], results[label][1])
+        if results["row by row"][1] != results["batched"][1]:
+            raise Exception("the batched import inserted a different number of genes")
+        print "speedup %.1fx" % (results["row by row"][0] / results["batched"][0])
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+'''
+Check and time a harvest of two PanelApp instances at the same time, served by two local mock servers.
+
+The two mocks are made from the same seed so many of their panel ids are the same, as can happen between PanelApp instances.
+One is read through the original WebServices and the other, slower and rate limited, through the REST API. The merged
+result must hold every panel of both with the ids of the second namespaced, and its import into an SQLite stand-in for
+Moka must have every panel of both. The sources are harvested at the same time, so the whole harvest should take about as
+long as the slowest source rather than the sum of the sources. If a source fails, its error must be raised and nothing
+merged.
+
+run from the repository root:
+    python -m benchmarks.bench_multi_source --panels 200 --genes 50 --latency 0.02
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from insert_to_moka import insert_PanelApp
+from panelapp_client import RequestFailed
+from multi_source import NAMESPACE_SEPARATOR, MultiSourceHarvester, Source
+from benchmarks.bench_v1 import panels_in
+from benchmarks.mock_panelapp import MockPanelApp
+from benchmarks.moka_sqlite import connect_moka
+from benchmarks.suite import new_moka
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=200)
+    parser.add_argument("--genes", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response of the first mock. the second is twice as slow")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    england = MockPanelApp(panels=args.panels, genes=args.genes, latency=args.latency).start()
+    australia = MockPanelApp(panels=args.panels / 2, genes=args.genes, latency=args.latency * 2).start()
+    try:
+        sources = [Source("england", namespace="", base_url=england.url, workers=4),
+                   Source("australia", base_url=australia.url, api="v1", workers=2, rate_limit=50, page_size=20)]
+        harvester = MultiSourceHarvester(sources, tmp, reports=True)
+        harvester.harvest()
+        print harvester.summary()
+        for source in sources:
+            print "%s: %s" % (source.name, harvester.reports[source.name].summary().splitlines()[2])
+
+        # every panel of each source must be in the merged result, with the australian ids namespaced
+        merged = panels_in(harvester.output)
+        expected = panels_in(sources[0].output)
+        for (panel_hash, colour), panel in panels_in(sources[1].output).items():
+            expected[("australia" + NAMESPACE_SEPARATOR + panel_hash, colour)] = panel
+        if merged != expected:
+            raise Exception("the merged result doesn't hold the panels of both sources")
+        shared = set(panel_hash for panel_hash, colour in panels_in(sources[0].output)) & set(panel_hash for panel_hash, colour in panels_in(sources[1].output))
+        print "%d panel colours merged, %d panel ids used by both instances" % (len(merged), len(shared))
+
+        # the slowest source should take most of the time
+        slowest = max(source.seconds for source in sources)
+        print "harvested in %.2fs, the slowest source took %.2fs and the sources took %.2fs in total" % (
+            harvester.seconds, slowest, sum(source.seconds for source in sources))
+        if harvester.seconds >= sum(source.seconds for source in sources):
+            raise Exception("the sources weren't harvested at the same time")
+
+        # the merged result imports like a harvest of one instance
+        path = os.path.join(tmp, "moka.db")
+        new_moka(path, args.genes)
+        cnxn = connect_moka(path)
+        moka = insert_PanelApp(cnxn, connect=lambda: connect_moka(path))
+        moka.API_result = harvester.output
+        moka.load_translations()
+        moka.check_item_category_table()
+        moka.get_list_of_versions()
+        moka.all_existing_panels()
+        start = time.time()
+        changes = moka.parse_PanelAPP_API_result()
+        imported = cnxn.execute("select count(*) from NGSPanel where Active = 1").fetchone()[0]
+        if imported != len(merged) or len(changes.new_panels) != len(merged):
+            raise Exception("%d of the %d merged panel colours were imported" % (imported, len(merged)))
+        print "imported %d panel colours from both instances in %.2fs" % (imported, time.time() - start)
+
+        # a source failing must raise its error without merging the sources which succeeded
+        failing = MockPanelApp(panels=args.panels, genes=args.genes, fault_rate=0.05, faults=["error"]).start()
+        try:
+            failed = os.path.join(tmp, "failed")
+            harvester = MultiSourceHarvester([Source("england", base_url=england.url, workers=4),
+                                              Source("failing", base_url=failing.url, workers=4, retries=0)], failed)
+            try:
+                harvester.harvest()
+            except RequestFailed as e:
+                print "a source failing: raised %s: %s" % (type(e).__name__, e)
+            else:
+                raise Exception("a source failing didn't raise its error")
+            if os.path.exists(harvester.output):
+                raise Exception("the sources were merged although one failed")
+        finally:
+            failing.stop()
+    finally:
+        england.stop()
+        australia.stop()
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
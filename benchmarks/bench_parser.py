@@ -0,0 +1,113 @@
+'''
+Benchmark parsing the legacy PanelAppOut text files.
+
+The files in API_results/ are repeated (with a different panel hash each time) to make a larger harvest.
+They are parsed with the split and replace calls the importer originally used, and with the single pass
+tokenizer in panelapp_io. Each parser runs in its own process so the peak memory of each can be reported.
+
+run from the repository root:
+    python -m benchmarks.bench_parser --scale 50
+'''
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from panelapp_io import read_legacy_panel_records, read_api_versions
+
+API_RESULTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "API_results")
+
+
+def make_files(directory, scale):
+    '''Write ensembl and symbols files made of the API_results files repeated scale times. Returns the paths and number of lines'''
+    paths = []
+    lines = 0
+    for name in ("PanelAppOut.txt", "PanelAppOut_symbols.txt"):
+        with open(os.path.join(API_RESULTS, name)) as source:
+            content = source.readlines()
+        path = os.path.join(directory, name)
+        with open(path, 'w') as output:
+            for i in range(scale):
+                for line in content:
+                    # make each copy of a panel unique by changing the last characters of the hash
+                    output.write(line[:20] + "%04x" % i + line[24:])
+                    lines += 1
+        paths.append(path)
+    return paths[0], paths[1], lines
+
+
+def original(ensembl_path, symbols_path):
+    '''The parsing done by get_list_of_versions, parse_PanelAPP_API_result and populate_api_symbols_dict before the shared parser'''
+    with open(ensembl_path, 'r') as API_output:
+        API_list = API_output.readlines()
+    versions = set()
+    for panel in API_list:
+        versions.add(panel.split(':')[0].split('_')[2])
+    for panel in API_list:
+        split1 = panel.split(':')
+        names = split1[0].split('_')
+        panel_hash_colour = names[0] + "_" + names[3]
+        genes = []
+        for gene in split1[1].split(","):
+            gene = gene.replace("\"", "").replace("[", "").replace("]", "").replace(" ", "").rstrip()
+            if len(gene) > 5:
+                genes.append(gene.replace("u", "").replace("'", ""))
+    API_symbols = {}
+    with open(symbols_path, 'r') as API_symbol_file:
+        for line in API_symbol_file.readlines():
+            splitline = line.split(':')
+            names = splitline[0].split('_')
+            panel_hash_colour = names[0] + "_" + names[3]
+            API_symbols[panel_hash_colour] = []
+            for gene in splitline[1].split(','):
+                gene = gene.replace("[", "").replace("'", "").replace("[", "").replace("'", "").replace("]", "").replace(" ", "").replace("\n", "").rstrip()
+                API_symbols[panel_hash_colour].append(gene)
+
+
+def tokenizer(ensembl_path, symbols_path):
+    '''The shared parser. The records are used one at a time, as the importer does'''
+    versions = read_api_versions(ensembl_path, symbols_path)
+    for record in read_legacy_panel_records(ensembl_path, symbols_path):
+        pass
+
+
+PARSERS = {"original": original, "tokenizer": tokenizer}
+
+
+def run_parser(name, ensembl_path, symbols_path):
+    '''Run a parser in this process, printing the seconds taken and the peak memory in KB'''
+    start = time.time()
+    PARSERS[name](ensembl_path, symbols_path)
+    print time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=50, help="number of copies of the API_results files")
+    parser.add_argument("--run", nargs=3, metavar=("PARSER", "ENSEMBL_FILE", "SYMBOLS_FILE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_parser(*args.run)
+        return
+
+    tmp = tempfile.mkdtemp()
+    try:
+        ensembl_path, symbols_path, lines = make_files(tmp, args.scale)
+        print "%d lines (%.1f MB)" % (lines, (os.path.getsize(ensembl_path) + os.path.getsize(symbols_path)) / 1e6)
+        print "%10s %14s %14s" % ("parser", "lines/sec", "peak MB")
+        for name in ("original", "tokenizer"):
+            output = subprocess.check_output([sys.executable, "-m", "benchmarks.bench_parser", "--run", name, ensembl_path, symbols_path])
+            seconds, peak_kb = output.split()
+            print "%10s %14d %14.1f" % (name, lines / float(seconds), int(peak_kb) / 1024.0)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+'''
+Benchmark the pipelined harvest and import against running the two stages one after the other, and check it shuts down
+cleanly when either side fails.
+
+- staged: a full harvest of a mock PanelApp, then an import of the harvest into an SQLite stand-in for Moka
+- pipelined: the same harvest and import with pipeline.py, into another stand-in. Both stand-ins must end up the same,
+  and the pipelined run should take about as long as the slower of the two stages rather than their sum. The mock's
+  latency imitates the real service, where a harvest mostly waits on the network (the mock runs in this process, so with
+  little latency the harvest is limited by the cpu the mock and the importer share)
+- the import failing part way through must stop the harvest before it fetches every panel and raise the import's error
+- the harvest failing must stop the import and raise the harvest's error
+
+run from the repository root:
+    python -m benchmarks.bench_pipeline --panels 400 --genes 200 --latency 0.05 --workers 4
+'''
+
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+import time
+
+from insert_to_moka import insert_PanelApp
+from panelapp_client import RequestFailed
+from pipeline import run_pipeline
+from ReadPanelApp import PanelAPP_API
+from benchmarks.bench_snapshots import dump
+from benchmarks.mock_panelapp import MockPanelApp
+from benchmarks.moka_sqlite import connect_moka
+from benchmarks.suite import new_moka
+
+
+def moka(path, genes):
+    '''Create an empty stand-in Moka, returning a connection to it'''
+    new_moka(path, genes)
+    return connect_moka(path)
+
+
+def harvester(url, outputdir, workers, retries=5):
+    '''A harvester writing its output to a new directory'''
+    os.mkdir(outputdir)
+    api = PanelAPP_API(workers=workers, base_url=url, retries=retries)
+    api.client.backoff = 0.01
+    api.outputfilepath = outputdir + os.sep
+    return api
+
+
+def importer(cnxn, path):
+    '''An importer into the stand-in Moka at path'''
+    return insert_PanelApp(cnxn, connect=lambda: connect_moka(path))
+
+
+def staged(url, tmp, workers, genes):
+    '''Harvest then import, returning the seconds taken by each stage and the connection to the stand-in'''
+    path = os.path.join(tmp, "staged.db")
+    cnxn = moka(path, genes)
+    api = harvester(url, os.path.join(tmp, "staged"), workers)
+    start = time.time()
+    api.get_list_of_panels()
+    harvest_seconds = time.time() - start
+    start = time.time()
+    importing = importer(cnxn, path)
+    importing.API_result = glob.glob(os.path.join(tmp, "staged", "*_PanelAppOut.jsonl"))[0]
+    importing.load_translations()
+    importing.check_item_category_table()
+    importing.get_list_of_versions()
+    importing.all_existing_panels()
+    importing.parse_PanelAPP_API_result()
+    return harvest_seconds, time.time() - start, cnxn
+
+
+def expect_error(error_type, function, *args):
+    '''Run function, raising an exception unless it raises an error_type'''
+    try:
+        function(*args)
+    except error_type as e:
+        return e
+    raise Exception("expected %s to be raised" % error_type.__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=400)
+    parser.add_argument("--genes", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response (default: 0.05)")
+    parser.add_argument("--workers", type=int, default=4, help="workers for the harvests (default: 4)")
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        mock = MockPanelApp(panels=args.panels, genes=args.genes, latency=args.latency).start()
+        try:
+            harvest_seconds, import_seconds, staged_cnxn = staged(mock.url, tmp, args.workers, args.genes)
+
+            path = os.path.join(tmp, "pipelined.db")
+            cnxn = moka(path, args.genes)
+            start = time.time()
+            changes, pipe = run_pipeline(harvester(mock.url, os.path.join(tmp, "pipelined"), args.workers), importer(cnxn, path),
+                                         args.queue_size, args.batch_size)
+            pipelined_seconds = time.time() - start
+            print "%d panels x %d genes, %.3fs latency, %d workers" % (args.panels, args.genes, args.latency, args.workers)
+            print "staged:    harvest %.2fs + import %.2fs = %.2fs" % (harvest_seconds, import_seconds, harvest_seconds + import_seconds)
+            print "pipelined: %.2fs (the slower stage took %.2fs)" % (pipelined_seconds, max(harvest_seconds, import_seconds))
+            print pipe.summary()
+            if dump(cnxn) != dump(staged_cnxn):
+                raise Exception("the pipelined import doesn't give the same panels as the staged import")
+            if not changes.panels:
+                raise Exception("the pipelined import didn't insert any panels")
+
+            # the import fails on its first batch. the harvest must stop well before every panel is fetched
+            path = os.path.join(tmp, "broken.db")
+            cnxn = moka(path, args.genes)
+            cnxn.execute("drop table NGSPanelGenes")
+            cnxn.commit()
+            mock.requests_served = 0
+            error = expect_error(Exception, run_pipeline, harvester(mock.url, os.path.join(tmp, "broken"), args.workers),
+                                 importer(cnxn, path), args.queue_size, args.batch_size)
+            if "NGSPanelGenes" not in str(error):
+                raise Exception("the import's error wasn't raised: %s" % error)
+            if mock.requests_served > args.panels / 2:
+                raise Exception("the harvest continued after the import failed (%d requests)" % mock.requests_served)
+            print "import failing: stopped after %d of %d requests, raising: %s" % (mock.requests_served, args.panels + 1, error)
+        finally:
+            mock.stop()
+
+        # the harvest fails part way through. the import must stop and the harvest's error be raised
+        failing = MockPanelApp(panels=args.panels, genes=args.genes, fault_rate=0.05, faults=["error"]).start()
+        try:
+            path = os.path.join(tmp, "failing.db")
+            cnxn = moka(path, args.genes)
+            error = expect_error(RequestFailed, run_pipeline, harvester(failing.url, os.path.join(tmp, "failing"), args.workers, retries=0),
+                                 importer(cnxn, path), args.queue_size, args.batch_size)
+            print "harvest failing: raised %s: %s" % (type(error).__name__, error)
+        finally:
+            failing.stop()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+'''
+Benchmark the snapshot store and change feed, and check the change feed is correct.
+
+Two harvests are made from the panels of a mock PanelApp, the second after some panels have had their version bumped and
+genes promoted, demoted, added and dropped, and some panels have been added and removed. Both are added to a snapshot
+store and diffed. The change feed applied to the first harvest must give the second.
+
+Then both harvests are imported into a SQLite stand-in for Moka one after the other, and the first harvest followed by
+the change feed is imported into another. Both databases must end up the same.
+
+run from the repository root:
+    python -m benchmarks.bench_snapshots --panels 400 --genes 200
+'''
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from insert_to_moka import insert_PanelApp
+from panelapp_io import PanelRecord, PanelRecordWriter, read_panel_records
+from snapshot_store import SnapshotStore, diff
+from benchmarks.mock_panelapp import CONFIDENCE_LEVELS, MockPanelApp
+from benchmarks.moka_sqlite import add_translations, connect_moka, create_moka, synthetic_translations
+
+# colour of the genes at each LevelOfConfidence. red genes aren't harvested
+COLOURS = {"HighEvidence": "Green", "ModerateEvidence": "Amber"}
+
+
+def harvest(mock):
+    '''The PanelRecords a harvest of the mock's panels would write, without making any requests'''
+    records = []
+    for panel_id, panel in sorted(mock.panels.items()):
+        for colour in ("Amber", "Green"):
+            genes = [gene for gene in panel["Genes"] if COLOURS.get(gene["LevelOfConfidence"]) == colour]
+            if genes:
+                records.append(PanelRecord(panel_id, panel["Name"], panel["CurrentVersion"], colour,
+                                           [gene["EnsembleGeneIds"] for gene in genes], [gene["GeneSymbol"] for gene in genes]))
+    return records
+
+
+def change_panels(mock, proportion, seed=2):
+    '''Bump the version of a proportion of the panels, changing some of their genes, and add and remove some panels'''
+    rand = random.Random(seed)
+    panel_ids = sorted(mock.panels)
+    for panel_id in rand.sample(panel_ids, int(len(panel_ids) * proportion)):
+        panel = mock.panels[panel_id]
+        major, minor = panel["CurrentVersion"].split(".")
+        panel["CurrentVersion"] = "%s.%d" % (major, int(minor) + 1)
+        for gene in rand.sample(panel["Genes"], min(5, len(panel["Genes"]))):
+            # promote, demote or drop the gene
+            gene["LevelOfConfidence"] = rand.choice(CONFIDENCE_LEVELS)
+        new_gene = {"GeneSymbol": "NEWGENE%d" % rand.randint(0, 10 ** 6), "EnsembleGeneIds": ["ENSG9%010d" % rand.randint(0, 10 ** 6)],
+                    "LevelOfConfidence": "HighEvidence"}
+        panel["Genes"].append(new_gene)
+    for panel_id in panel_ids[:2]:
+        del mock.panels[panel_id]
+    for i in range(3):
+        mock.panels["new%021d" % i] = {"Name": "New panel %d" % i, "CurrentVersion": "0.1",
+                                       "Genes": rand.sample(mock.panels[panel_ids[-1]]["Genes"], 10)}
+
+
+def write(records, path):
+    with PanelRecordWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+
+
+def apply_feed(records, feed_path):
+    '''Apply a change feed to a list of PanelRecords, returning the to_dict of each resulting record'''
+    panels = dict(((record.panel_hash, record.colour), record.to_dict()) for record in records)
+    with open(feed_path, 'r') as feed_file:
+        # skip the header
+        feed_file.readline()
+        for line in feed_file:
+            content = json.loads(line)
+            key = (str(content["panel_hash"]), str(content["colour"]))
+            if content["change"] == "removed":
+                del panels[key]
+            else:
+                panels[key] = PanelRecord.from_dict(content).to_dict()
+    return [panels[key] for key in sorted(panels)]
+
+
+def dump(cnxn):
+    '''The panels and genes in a stand-in Moka database'''
+    return (cnxn.execute("select n.Panel, n.Active, i.Item, v.Item from NGSPanel n join Item i on i.ItemID = n.Category "
+                         "join Item v on v.ItemID = n.SubCategory order by n.Panel, n.Active").fetchall(),
+            cnxn.execute("select n.Panel, g.HGNCID, g.Symbol from NGSPanelGenes g join NGSPanel n on n.NGSPanelID = g.NGSPanelID "
+                         "order by 1, 2, 3").fetchall())
+
+
+def import_results(paths, tmp, name, translations):
+    '''Import each API result in turn into a new stand-in Moka, returning the seconds taken by each import and the connection'''
+    path = os.path.join(tmp, name + ".db")
+    cnxn = create_moka(path)
+    add_translations(cnxn, translations)
+    cnxn.execute("insert into ItemCategory (ItemCategory) values ('NGS Panel')")
+    cnxn.commit()
+    seconds = []
+    for api_result in paths:
+        start = time.time()
+        moka = insert_PanelApp(cnxn, connect=lambda: connect_moka(path))
+        moka.API_result = api_result
+        moka.load_translations()
+        moka.check_item_category_table()
+        moka.get_list_of_versions()
+        moka.all_existing_panels()
+        moka.parse_PanelAPP_API_result()
+        seconds.append(time.time() - start)
+    return seconds, cnxn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=400)
+    parser.add_argument("--genes", type=int, default=200)
+    parser.add_argument("--changed", type=float, default=0.05, help="proportion of panels changed between the harvests (default: 0.05)")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        mock = MockPanelApp(panels=args.panels, genes=args.genes)
+        old_records = harvest(mock)
+        change_panels(mock, args.changed)
+        new_records = harvest(mock)
+        paths = [os.path.join(tmp, name + "_PanelAppOut.jsonl") for name in ("20180828", "20180904")]
+        write(old_records, paths[0])
+        write(new_records, paths[1])
+
+        store = SnapshotStore(os.path.join(tmp, "snapshots"))
+        store.add("20180828", read_panel_records(paths[0]))
+        store.add("20180904", read_panel_records(paths[1]))
+        start = time.time()
+        feed = diff(store.load("20180828"), store.load("20180904"))
+        seconds = time.time() - start
+        feed_path = os.path.join(tmp, "20180904_PanelAppChanges.jsonl")
+        feed.write(feed_path)
+
+        print "%d panels, %d gene entries in each harvest" % (len(mock.panels), sum(len(record.symbols) for record in new_records))
+        print "PanelAppOut.jsonl %.0f KB, snapshot %.0f KB, change feed %.0f KB" % (
+            os.path.getsize(paths[1]) / 1024.0, os.path.getsize(store.path("20180904")) / 1024.0, os.path.getsize(feed_path) / 1024.0)
+        print feed.summary()
+        print "loading both snapshots and diffing took %.3f seconds" % seconds
+
+        if apply_feed(old_records, feed_path) != [record.to_dict() for record in new_records]:
+            raise Exception("the change feed applied to the first harvest doesn't give the second")
+
+        translations = synthetic_translations(args.genes * 4)
+        full_seconds, full = import_results(paths, tmp, "full", translations)
+        feed_seconds, changes = import_results([paths[0], feed_path], tmp, "feed", translations)
+        print "second import: full harvest %.2f seconds, change feed %.2f seconds" % (full_seconds[1], feed_seconds[1])
+        if dump(full) != dump(changes):
+            raise Exception("importing the change feed doesn't give the same panels as importing the full harvest")
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+'''
+Benchmark the peak memory of a harvest, with and without streaming, as the number of panels grows.
+
+A mock PanelApp server runs in this process and each harvest runs in its own process, so the peak memory
+reported is that of the harvest alone. Without streaming every panel is kept until the output is written, so
+peak memory grows with the number of panels. With streaming it should stay flat.
+Both modes must write the same output.
+
+run from the repository root:
+    python -m benchmarks.bench_stream --panels 100 400 1600 --genes 300
+'''
+
+import argparse
+import filecmp
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from ReadPanelApp import PanelAPP_API
+from benchmarks.mock_panelapp import MockPanelApp
+
+
+def peak_memory_kb():
+    '''The peak memory of this process in KB. ru_maxrss is kept across exec on linux, so would include the memory of the parent
+    (with its mock server) at the time of the fork. VmHWM is reset by exec so is used where available'''
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_harvest(url, streaming, outputdir):
+    '''Run a harvest in this process, printing the seconds taken and the peak memory in KB'''
+    api = PanelAPP_API(base_url=url, streaming=streaming == "stream")
+    api.outputfilepath = outputdir + os.sep
+    start = time.time()
+    api.get_list_of_panels()
+    print time.time() - start, peak_memory_kb()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, nargs="+", default=[100, 400, 1600])
+    parser.add_argument("--genes", type=int, default=300)
+    parser.add_argument("--run", nargs=3, metavar=("URL", "MODE", "OUTPUT_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_harvest(*args.run)
+        return
+
+    tmp = tempfile.mkdtemp()
+    try:
+        print "%d genes per panel" % args.genes
+        print "%8s %10s %10s %10s" % ("panels", "mode", "seconds", "peak MB")
+        for panels in args.panels:
+            mock = MockPanelApp(panels=panels, genes=args.genes).start()
+            try:
+                outputs = []
+                for mode in ("json", "stream"):
+                    outputdir = os.path.join(tmp, "%d_%s" % (panels, mode))
+                    os.mkdir(outputdir)
+                    output = subprocess.check_output([sys.executable, "-m", "benchmarks.bench_stream", "--run", mock.url, mode, outputdir])
+                    seconds, peak_kb = output.split()[-2:]
+                    print "%8d %10s %10.2f %10.1f" % (panels, mode, float(seconds), int(peak_kb) / 1024.0)
+                    outputs.append(outputdir)
+            finally:
+                mock.stop()
+
+            # streaming must not change the output
+            for name in os.listdir(outputs[0]):
+                if not filecmp.cmp(os.path.join(outputs[0], name), os.path.join(outputs[1], name), shallow=False):
+                    raise Exception("%s differs when streaming" % name)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
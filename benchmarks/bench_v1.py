@@ -0,0 +1,98 @@
+'''
+Check and benchmark the harvest from the paginated REST API (/api/v1/).
+
+First the recorded responses in benchmarks/fixtures/panelapp_v1 are served locally and harvested reading the genes of every
+panel at once (bulk), reading each panel, and reading each panel while streaming. Each must give the expected output.
+
+Then a mock PanelApp with many panels is harvested from the WebServices, and from the REST API reading each panel and in bulk.
+The number of requests and the time taken are compared. All three must give the same panels and genes (the REST API
+harvest sorts the genes of each panel so the order of the genes isn't compared).
+
+run from the repository root:
+    python -m benchmarks.bench_v1 --panels 300 --genes 50 --latency 0.02
+'''
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from ReadPanelApp import PanelAPP_API
+from benchmarks.fixture_server import EXPECTED_OUTPUT, V1_FIXTURES, V1_FIXTURES_PAGE_SIZE, FixtureServer
+from benchmarks.mock_panelapp import MockPanelApp
+
+
+def harvest(url, outputdir, api, workers=1, bulk=True, streaming=False, page_size=None):
+    '''Run a harvest, returning the seconds taken and the path of the output'''
+    os.mkdir(outputdir)
+    panelapp = PanelAPP_API(workers=workers, base_url=url, api=api, streaming=streaming, page_size=page_size)
+    if not bulk:
+        panelapp.bulk_threshold = float("inf")
+    panelapp.outputfilepath = outputdir + os.sep
+    start = time.time()
+    panelapp.get_list_of_panels()
+    return time.time() - start, glob.glob(os.path.join(outputdir, "*_PanelAppOut.jsonl"))[0]
+
+
+def panels_in(path):
+    '''The panels in a harvest output, with the genes of each panel sorted'''
+    panels = {}
+    with open(path, 'r') as output:
+        for line in list(output)[1:]:
+            record = json.loads(line)
+            panels[(record["panel_hash"], record["colour"])] = (record["panel_name"], record["version"],
+                                                                sorted(zip(record["symbols"], map(tuple, record["ensembl_ids"]))))
+    return panels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=300)
+    parser.add_argument("--genes", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument("--workers", type=int, default=4, help="workers for the harvests which read each panel")
+    parser.add_argument("--page-size", type=int, default=100, help="results in each page of the REST API")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(V1_FIXTURES, EXPECTED_OUTPUT), 'r') as expected_file:
+            expected = expected_file.read()
+        fixtures = FixtureServer().start()
+        try:
+            for name, kwargs in (("bulk", {}), ("per panel", {"bulk": False, "workers": 2}),
+                                 ("per panel, streaming", {"bulk": False, "streaming": True})):
+                seconds, output = harvest(fixtures.url, os.path.join(tmp, "fixtures_" + name), "v1",
+                                          page_size=V1_FIXTURES_PAGE_SIZE, **kwargs)
+                with open(output, 'r') as output_file:
+                    if output_file.read() != expected:
+                        raise Exception("harvest of the recorded responses (%s) doesn't match %s" % (name, EXPECTED_OUTPUT))
+            print "recorded responses: bulk, per panel and streaming harvests match %s" % EXPECTED_OUTPUT
+        finally:
+            fixtures.stop()
+
+        mock = MockPanelApp(panels=args.panels, genes=args.genes, latency=args.latency).start()
+        try:
+            print "%d panels x %d genes, %.3fs latency, %d results a page" % (args.panels, args.genes, args.latency, args.page_size)
+            print "%-28s %10s %10s" % ("harvest", "requests", "seconds")
+            outputs = []
+            for name, api, kwargs in (("WebServices, %d workers" % args.workers, "legacy", {"workers": args.workers}),
+                                      ("v1 per panel, %d workers" % args.workers, "v1", {"workers": args.workers, "bulk": False}),
+                                      ("v1 bulk", "v1", {})):
+                mock.requests_served = 0
+                seconds, output = harvest(mock.url, os.path.join(tmp, name), api, page_size=args.page_size, **kwargs)
+                print "%-28s %10d %10.2f" % (name, mock.requests_served, seconds)
+                outputs.append(panels_in(output))
+            if outputs[1] != outputs[0] or outputs[2] != outputs[0]:
+                raise Exception("the REST API harvests don't match the WebServices harvest")
+        finally:
+            mock.stop()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+'''
+Micro-benchmark of deciding which panels in an API result are newer than the versions in Moka.
+
+Compares looping over every stored version of a panel, splitting the version strings for each comparison
+(as parse_PanelAPP_API_result used to), with a single lookup in an index of the highest PanelVersion of each panel.
+Both must make the same decision for every panel.
+
+First the doctests of panel_model are run, which check PanelVersion orders versions by release (eg 1.102 is after 1.2 and
+1.10 after 1.9). The script fails if any of them fail.
+
+The index is built once per import by all_existing_panels, so building it and comparing every panel once takes about as
+long as the original loop. The index fixes the ordering of versions and makes each later comparison a single lookup, rather
+than making a single pass faster.
+
+run from the repository root:
+    python -m benchmarks.bench_versions --panels 5000
+'''
+
+import argparse
+import doctest
+import random
+import time
+
+import panel_model
+from panel_model import PanelVersion
+
+
+def original_is_newer(version, db_versions):
+    '''The version comparison from parse_PanelAPP_API_result before the version index'''
+    max_version = "-1.0"
+    for db_version in db_versions:
+        db_major_version = int(db_version.split(".")[0])
+        db_minor_version = int(db_version.split(".")[1])
+        max_major_version = int(max_version.split(".")[0])
+        max_minor_version = int(max_version.split(".")[1])
+        if db_major_version > max_major_version:
+            max_version = db_version
+        elif db_major_version == max_major_version and db_minor_version > max_minor_version:
+            max_version = db_version
+    return max_version == "-1.0" or int(version.split(".")[0]) > int(str(max_version).split(".")[0]) or int(version.split(".")[0]) == int(str(max_version).split(".")[0]) and int(version.split(".")[1]) > int(str(max_version).split(".")[1])
+
+
+def make_data(panels, seed=1):
+    '''Stored versions for each panel and an API version for each panel, including versions that compare wrongly as decimals'''
+    rand = random.Random(seed)
+    tricky = ["1.2", "1.102", "1.11", "1.9", "1.10", "0.99", "1.0", "2.0", "0.8"]
+    db_versions = {}
+    api = []
+    for i in range(panels):
+        key = "PANEL%05d_GREEN" % i
+        # some panels are new, not yet in moka
+        if i % 10:
+            db_versions[key] = [rand.choice(tricky) for j in range(rand.randint(1, 6))] + ["%d.%d" % (rand.randint(0, 2), rand.randint(0, 200))]
+        api.append((key, rand.choice(tricky + ["%d.%d" % (rand.randint(0, 2), rand.randint(0, 200))])))
+    return db_versions, api
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=5000)
+    args = parser.parse_args()
+
+    failures, tests = doctest.testmod(panel_model)
+    if failures:
+        raise Exception("%d of the %d panel_model doctests failed" % (failures, tests))
+    print "%d panel_model doctests passed" % tests
+
+    db_versions, api = make_data(args.panels)
+
+    start = time.time()
+    original = [original_is_newer(version, db_versions.get(key, [])) for key, version in api]
+    original_seconds = time.time() - start
+
+    # build the index, as all_existing_panels does
+    start = time.time()
+    max_version_in_db = {}
+    for key, versions in db_versions.items():
+        for version in versions:
+            version = PanelVersion(version)
+            if key not in max_version_in_db or version > max_version_in_db[key]:
+                max_version_in_db[key] = version
+    build_seconds = time.time() - start
+
+    start = time.time()
+    indexed = []
+    for key, version in api:
+        max_version = max_version_in_db.get(key)
+        indexed.append(max_version is None or PanelVersion(version) > max_version)
+    indexed_seconds = time.time() - start
+
+    if original != indexed:
+        raise Exception("the version index disagrees with the original comparison")
+
+    print "%d panels, %d stored versions, %d newer in the API" % (len(api), sum(len(v) for v in db_versions.values()), sum(indexed))
+    print "original comparison  %8.1f ms" % (original_seconds * 1000)
+    print "build version index  %8.1f ms" % (build_seconds * 1000)
+    print "indexed comparison   %8.1f ms (%.2f us per panel)" % (indexed_seconds * 1000, indexed_seconds * 1e6 / len(api))
+    print "build and compare    %8.1f ms" % ((build_seconds + indexed_seconds) * 1000)
+
+
+if __name__ == "__main__":
+    main()
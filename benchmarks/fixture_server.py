@@ -0,0 +1,166 @@
+'''
+Recorded PanelApp responses, and a local server to replay them.
+
+Each response is saved as a file in a directory, named from the path and query of its url. The address of the server the
+responses were recorded from is replaced with {base_url} (eg in the next link of a page), and the address of the local
+server is put back when they are replayed. A url which wasn't recorded gets a 404.
+
+benchmarks/fixtures/panelapp_v1 holds the REST API responses for a few panels, paged 2 results at a time, and the
+harvest output expected from them (expected_PanelAppOut.jsonl). To record a new set of responses, and the output of a
+harvest from them:
+    python -m benchmarks.fixture_server record https://panelapp.genomicsengland.co.uk --page-size 100 DIRECTORY
+and to serve them:
+    python -m benchmarks.fixture_server serve DIRECTORY
+'''
+
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler
+
+from ReadPanelApp import PanelAPP_API
+from panelapp_client import PanelAppClient
+from benchmarks.mock_panelapp import ThreadedHTTPServer
+
+# the recorded responses of the REST API, and the harvest output expected from them
+V1_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "panelapp_v1")
+EXPECTED_OUTPUT = "expected_PanelAppOut.jsonl"
+# the page size the responses were recorded with
+V1_FIXTURES_PAGE_SIZE = 2
+
+
+def fixture_name(url):
+    '''The file name a response is saved as, from the path and query of its url. The query parameters are sorted'''
+    url = urlparse.urlparse(url)
+    name = "_".join(part for part in url.path.split("/") if part)
+    query = sorted(urlparse.parse_qsl(url.query))
+    if query:
+        name += "-" + "-".join("%s=%s" % item for item in query)
+    return name + ".json"
+
+
+class RecordingClient(PanelAppClient):
+    '''A PanelAppClient which saves every response it downloads'''
+
+    def __init__(self, directory, base_url, **kwargs):
+        PanelAppClient.__init__(self, **kwargs)
+        self.directory = directory
+        self.base_url = base_url
+
+    def iter_content(self, url, chunk_size):
+        chunks = []
+        for chunk in PanelAppClient.iter_content(self, url, chunk_size):
+            chunks.append(chunk)
+            yield chunk
+        # only save complete responses
+        with open(os.path.join(self.directory, fixture_name(url)), 'w') as fixture:
+            fixture.write("".join(chunks).replace(self.base_url, "{base_url}"))
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    '''Serves the recorded responses in the server's directory'''
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = os.path.join(self.server.directory, fixture_name(self.path))
+        status = 200
+        if os.path.exists(path):
+            with open(path, 'r') as fixture:
+                body = fixture.read().replace("{base_url}", self.server.url)
+        else:
+            status = 404
+            body = '{"detail": "Not found."}'
+        with self.server.lock:
+            self.server.requests_served += 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer():
+    '''Serves a directory of recorded responses over HTTP on localhost'''
+
+    def __init__(self, directory=V1_FIXTURES):
+        self.directory = directory
+        self.server = None
+        self.url = None
+
+    @property
+    def requests_served(self):
+        return self.server.requests_served
+
+    def start(self, port=0):
+        '''Start serving in a background thread'''
+        self.server = ThreadedHTTPServer(("127.0.0.1", port), FixtureHandler)
+        self.server.directory = self.directory
+        self.server.requests_served = 0
+        self.server.lock = threading.Lock()
+        self.url = self.server.url = "http://127.0.0.1:%s" % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def record(base_url, directory, page_size=None):
+    '''Run a harvest from the REST API at base_url, once reading the genes of every panel at once and once reading each panel,
+    saving every response and the output in directory'''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    output = tempfile.mkdtemp()
+    try:
+        outputs = []
+        for bulk_threshold in (0, float("inf")):
+            api = PanelAPP_API(base_url=base_url, api="v1", page_size=page_size)
+            # the backend makes the requests, so give it the recording client
+            api.client = api.backend.client = RecordingClient(directory, base_url)
+            api.bulk_threshold = bulk_threshold
+            api.outputfilepath = os.path.join(output, str(bulk_threshold)) + os.sep
+            os.mkdir(api.outputfilepath)
+            api.get_list_of_panels()
+            outputs.append(glob.glob(api.outputfilepath + "*_PanelAppOut.jsonl")[0])
+        # a panel updated during the recording would make the outputs differ
+        if open(outputs[0]).read() != open(outputs[1]).read():
+            raise Exception("the panels changed while recording, record them again")
+        shutil.copy(outputs[0], os.path.join(directory, EXPECTED_OUTPUT))
+    finally:
+        shutil.rmtree(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    record_parser = subparsers.add_parser("record", help="record the responses of a harvest from the REST API")
+    record_parser.add_argument("base_url")
+    record_parser.add_argument("directory")
+    record_parser.add_argument("--page-size", type=int)
+    serve_parser = subparsers.add_parser("serve", help="serve recorded responses")
+    serve_parser.add_argument("directory", nargs="?", default=V1_FIXTURES)
+    serve_parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.base_url, args.directory, args.page_size)
+    else:
+        server = FixtureServer(args.directory).start(args.port)
+        print "serving %s at %s" % (args.directory, server.url)
+        while True:
+            time.sleep(60)
+
+
+if __name__ == "__main__":
+    main()
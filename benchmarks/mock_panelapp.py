@@ -0,0 +1,265 @@
+'''
+A local stand-in for the PanelApp web services, used by the benchmarks.
+
+Panels are generated from a seed so every run serves the same synthetic data.
+Each response can be delayed to imitate the latency of the real service.
+Both the original WebServices endpoints and the paginated REST API (/api/v1/) are served, from the same panels.
+
+Faults can be injected into a proportion of requests to test the client's retries: a 500 error, a 503 or 429 with a
+Retry-After header, a dropped connection, a response cut short or a response slower than the client's timeout.
+Responses have an ETag and Last-Modified header and conditional requests get a 304 if the response hasn't changed.
+'''
+
+import hashlib
+import json
+import random
+import threading
+import time
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+# LevelOfConfidence values used by PanelApp for red, amber and green genes
+CONFIDENCE_LEVELS = ["LowEvidence", "ModerateEvidence", "HighEvidence"]
+# the confidence_level used by the REST API for each LevelOfConfidence
+V1_CONFIDENCE_LEVELS = {"LowEvidence": "1", "ModerateEvidence": "2", "HighEvidence": "3"}
+
+# the faults that can be injected
+FAULTS = ["error", "unavailable", "too_many_requests", "drop", "truncate", "slow"]
+
+# Last-Modified of every response
+LAST_MODIFIED = "Mon, 03 Sep 2018 09:00:00 GMT"
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    '''HTTP server handling each request in its own thread so concurrent clients are not serialised'''
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # clients giving up on slow responses are expected when faults are injected
+        pass
+
+
+class MockPanelAppHandler(BaseHTTPRequestHandler):
+    '''Serves the list_panels and get_panel web services from the data held by the server's MockPanelApp'''
+    # keep-alive is needed so clients can reuse pooled connections
+    protocol_version = "HTTP/1.1"
+    # send small responses straight away rather than waiting for the client's ack
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        mock = self.server.mock
+        # split the path into its parts eg /WebServices/get_panel/<panel_id>/
+        url = urlparse.urlparse(self.path)
+        path = url.path.strip("/").split("/")
+        query = dict(urlparse.parse_qsl(url.query))
+
+        # imitate the time taken by the real service
+        if mock.latency:
+            time.sleep(mock.latency)
+
+        # count the requests so the benchmarks can report them
+        with mock.lock:
+            mock.requests_served += 1
+        fault = mock.next_fault()
+
+        if path == ["WebServices", "list_panels"]:
+            self.send_json(mock.list_panels(), fault=fault)
+        elif len(path) == 3 and path[:2] == ["WebServices", "get_panel"] and path[2] in mock.panels:
+            self.send_json(mock.get_panel(path[2]), fault=fault)
+        elif path == ["api", "v1", "panels"]:
+            self.send_json(mock.page(mock.v1_panels(), url.path, query), fault=fault)
+        elif len(path) == 4 and path[:3] == ["api", "v1", "panels"] and path[3] in mock.by_number:
+            self.send_json(mock.v1_panel(mock.by_number[path[3]]), fault=fault)
+        elif path == ["api", "v1", "genes"]:
+            self.send_json(mock.page(mock.v1_genes(query.get("confidence_level")), url.path, query), fault=fault)
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def send_json(self, content, status=200, fault=None):
+        '''Write a json response, injecting a fault if one is given'''
+        mock = self.server.mock
+        if fault == "drop":
+            # close the connection without a response
+            self.close_connection = True
+            return
+        if fault == "slow":
+            time.sleep(mock.slow_seconds)
+        if fault in ("error", "unavailable", "too_many_requests"):
+            status = {"error": 500, "unavailable": 503, "too_many_requests": 429}[fault]
+            content = {"error": fault}
+
+        body = json.dumps(content)
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        if status == 200 and (self.headers.get("If-None-Match") == etag or
+                              (self.headers.get("If-None-Match") is None and self.headers.get("If-Modified-Since") == LAST_MODIFIED)):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            with mock.lock:
+                mock.not_modified += 1
+            return
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 200:
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", LAST_MODIFIED)
+        if fault in ("unavailable", "too_many_requests"):
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        if fault == "truncate":
+            # send half the body then close the connection
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # don't print a line for every request
+        pass
+
+
+class MockPanelApp():
+    '''A set of synthetic panels served over HTTP on localhost'''
+
+    def __init__(self, panels=100, genes=50, latency=0.0, seed=1, fault_rate=0.0, faults=FAULTS, slow_seconds=2.0, page_size=100):
+        # seconds to wait before answering each request
+        self.latency = latency
+        # results in each page of the REST API, unless the request asks for another page size
+        self.page_size = page_size
+        # number of requests answered
+        self.requests_served = 0
+        # number of 304 responses
+        self.not_modified = 0
+        self.lock = threading.Lock()
+
+        # proportion of requests given one of faults, chosen at random
+        self.fault_rate = fault_rate
+        self.faults = faults
+        # seconds a slow response takes
+        self.slow_seconds = slow_seconds
+        # number of each fault injected
+        self.faults_injected = dict((fault, 0) for fault in faults)
+        self.fault_random = random.Random(seed)
+
+        self.server = None
+        self.url = None
+
+        # generate the panels. the same seed always gives the same panels
+        rand = random.Random(seed)
+        # a pool of genes shared between the panels, as in PanelApp the same gene appears in many panels
+        gene_pool = []
+        for i in range(max(genes * 4, 100)):
+            ensemblids = ["ENSG%011d" % i]
+            # some genes have more than one ensembl id
+            if i % 20 == 0:
+                ensemblids.append("ENSG%011d" % (i + 500000))
+            gene_pool.append({"GeneSymbol": "GENE%d" % i, "EnsembleGeneIds": ensemblids})
+
+        self.panels = {}
+        for i in range(panels):
+            panel_id = "%024x" % rand.getrandbits(96)
+            panel_genes = []
+            for gene in rand.sample(gene_pool, min(genes, len(gene_pool))):
+                gene = dict(gene)
+                gene["LevelOfConfidence"] = rand.choice(CONFIDENCE_LEVELS)
+                panel_genes.append(gene)
+            self.panels[panel_id] = {
+                "Name": "Synthetic panel %d" % i,
+                "CurrentVersion": "%d.%d" % (rand.randint(0, 2), rand.randint(0, 150)),
+                "Genes": panel_genes,
+            }
+        # the REST API identifies panels by number as well as by hash id
+        self.numbers = {}
+        self.by_number = {}
+        for number, panel_id in enumerate(sorted(self.panels), 1):
+            self.numbers[panel_id] = number
+            self.by_number[str(number)] = panel_id
+        # confidence_level: results of the genes endpoint, built when first requested
+        self.bulk_genes = {}
+
+    def next_fault(self):
+        '''The fault to inject into the next response, or None'''
+        with self.lock:
+            if self.fault_rate and self.fault_random.random() < self.fault_rate:
+                fault = self.fault_random.choice(self.faults)
+                self.faults_injected[fault] += 1
+                return fault
+        return None
+
+    def list_panels(self):
+        '''Response for the list_panels web service'''
+        return {"result": [{"Panel_Id": panel_id, "Name": panel["Name"], "CurrentVersion": panel["CurrentVersion"]}
+                           for panel_id, panel in sorted(self.panels.items())]}
+
+    def get_panel(self, panel_id):
+        '''Response for the get_panel web service'''
+        return {"result": {"Genes": self.panels[panel_id]["Genes"]}}
+
+    def v1_panels(self):
+        '''Results of the REST API panels endpoint'''
+        return [self.v1_panel_summary(panel_id) for panel_id in sorted(self.panels)]
+
+    def v1_panel_summary(self, panel_id):
+        panel = self.panels[panel_id]
+        return {"id": self.numbers[panel_id], "hash_id": panel_id, "name": panel["Name"], "version": panel["CurrentVersion"]}
+
+    def v1_gene(self, gene):
+        '''A gene as returned by the REST API. A second ensembl id is given as the id in the other genome build'''
+        ensembl_ids = gene["EnsembleGeneIds"]
+        return {"entity_type": "gene", "entity_name": gene["GeneSymbol"], "confidence_level": V1_CONFIDENCE_LEVELS[gene["LevelOfConfidence"]],
+                "gene_data": {"gene_symbol": gene["GeneSymbol"],
+                              "ensembl_genes": {"GRch37": {"82": {"ensembl_id": ensembl_ids[0]}},
+                                                "GRch38": {"90": {"ensembl_id": ensembl_ids[-1]}}}}}
+
+    def v1_panel(self, panel_id):
+        '''Response for the REST API panel endpoint'''
+        panel = self.v1_panel_summary(panel_id)
+        panel["genes"] = [self.v1_gene(gene) for gene in self.panels[panel_id]["Genes"]]
+        return panel
+
+    def v1_genes(self, confidence_level):
+        '''Results of the REST API genes endpoint - the genes of every panel at a confidence level'''
+        with self.lock:
+            if confidence_level not in self.bulk_genes:
+                results = []
+                for panel_id in sorted(self.panels):
+                    for gene in self.panels[panel_id]["Genes"]:
+                        if confidence_level is None or V1_CONFIDENCE_LEVELS[gene["LevelOfConfidence"]] == confidence_level:
+                            v1_gene = self.v1_gene(gene)
+                            v1_gene["panel"] = self.v1_panel_summary(panel_id)
+                            results.append(v1_gene)
+                self.bulk_genes[confidence_level] = results
+            return self.bulk_genes[confidence_level]
+
+    def page(self, results, path, query):
+        '''One page of results from the REST API, with a link to the next page'''
+        page_size = int(query.get("page_size", self.page_size))
+        page = int(query.get("page", 1))
+        content = {"count": len(results), "next": None, "previous": None,
+                   "results": results[(page - 1) * page_size:page * page_size]}
+        for name, other_page in (("next", page + 1), ("previous", page - 1)):
+            if 0 < other_page and (other_page - 1) * page_size < len(results):
+                query = dict(query, page=other_page)
+                content[name] = self.url + path + "?" + urllib.urlencode(sorted(query.items()))
+        return content
+
+    def start(self):
+        '''Start serving on a free port in a background thread'''
+        self.server = ThreadedHTTPServer(("127.0.0.1", 0), MockPanelAppHandler)
+        self.server.mock = self
+        self.url = "http://127.0.0.1:%s" % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        '''Stop the server'''
+        self.server.shutdown()
+        self.server.server_close()
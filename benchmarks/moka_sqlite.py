@@ -0,0 +1,46 @@
+'''
+An SQLite stand-in for the parts of the Moka database used by insert_to_moka.py.
+
+The tables are created in a database attached as "dbo" so queries work whether or not they
+prefix the table names with dbo. (SQLite searches attached databases for unqualified names).
+'''
+
+import sqlite3
+
+SCHEMA = [
+    "create table dbo.ItemCategory (ItemCategoryID integer primary key autoincrement, ItemCategory text)",
+    "create table dbo.Item (ItemID integer primary key autoincrement, Item text, ItemCategoryIndex1ID integer)",
+    "create table dbo.NGSPanel (NGSPanelID integer primary key autoincrement, Category integer, SubCategory integer, Panel text, PanelCode text, Active integer, Checker1 text, CheckDate timestamp, PanelType integer)",
+    "create table dbo.NGSPanelGenes (NGSPanelGeneID integer primary key autoincrement, NGSPanelID integer, HGNCID text, Symbol text, Checker text, CheckDate timestamp)",
+    "create table dbo.GenesHGNC_current_translation (HGNCID text, PanelApp_Symbol text, EnsemblID_PanelApp text)",
+    "create index dbo.translation_ensembl on GenesHGNC_current_translation (EnsemblID_PanelApp)",
+    "create index dbo.panelgenes_panel on NGSPanelGenes (NGSPanelID)",
+]
+
+
+def connect_moka(path):
+    '''Return a new connection to a moka stand-in created by create_moka. Each worker of a parallel import needs its own connection.
+    The stand-in must be stored in a file to be shared by connections'''
+    cnxn = sqlite3.connect(":memory:", timeout=60)
+    cnxn.execute("attach database ? as dbo", (path,))
+    return cnxn
+
+
+def create_moka(path=":memory:"):
+    '''Return a connection to an empty moka stand-in. The main database is in memory, the tables are stored at path'''
+    cnxn = connect_moka(path)
+    for statement in SCHEMA:
+        cnxn.execute(statement)
+    cnxn.commit()
+    return cnxn
+
+
+def add_translations(cnxn, genes):
+    '''Populate the hgnc translation table from a list of (HGNCID, symbol, ensembl id) tuples'''
+    cnxn.executemany("insert into GenesHGNC_current_translation(HGNCID,PanelApp_Symbol,EnsemblID_PanelApp) values (?,?,?)", genes)
+    cnxn.commit()
+
+
+def synthetic_translations(count):
+    '''Translations for the genes served by benchmarks.mock_panelapp. Every gene GENE<i> has the ensembl id ENSG<i> and HGNCID HGNC:<i>'''
+    return [("HGNC:%d" % i, "GENE%d" % i, "ENSG%011d" % i) for i in range(count)]
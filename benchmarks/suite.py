@@ -0,0 +1,224 @@
+'''
+A reproducible benchmark suite, run against a local mock PanelApp and an SQLite stand-in for Moka, so neither the live
+PanelApp service nor the Moka SQL Server is needed.
+
+Four scenarios are run in turn:
+- harvest: a full harvest of the mock PanelApp (panels x genes, with the given latency and fault rate)
+- first import: importing the harvest into an empty Moka
+- incremental import: importing a second harvest, made after some panels have changed, into the same Moka
+- reconcile: checking every active panel in Moka against the second harvest
+
+Each scenario runs in its own process so its peak memory can be measured. The throughput and peak memory of each scenario
+are compared with a stored baseline (benchmarks/baseline.json by default). The suite fails if a scenario's throughput has
+dropped, or its peak memory grown, by more than the tolerance. The baseline is only compared if it was recorded with the
+same settings. Timings depend on the machine, so record a baseline on the machine running the suite with --update-baseline.
+
+run from the repository root:
+    python -m benchmarks.suite --update-baseline
+    python -m benchmarks.suite
+'''
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from insert_to_moka import insert_PanelApp
+from panelapp_io import read_panel_records
+from run_report import RunReport
+from ReadPanelApp import PanelAPP_API
+from benchmarks.bench_snapshots import change_panels
+from benchmarks.bench_stream import peak_memory_kb
+from benchmarks.mock_panelapp import MockPanelApp
+from benchmarks.moka_sqlite import add_translations, connect_moka, create_moka, synthetic_translations
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# the scenarios in the order they are run, and the unit of each scenario's throughput
+SCENARIOS = OrderedDict([("harvest", "panels/s"), ("first import", "gene rows/s"), ("incremental import", "panel colours/s"),
+                         ("reconcile", "gene rows/s")])
+
+
+def run_harvest(url, outputdir, workers):
+    '''Harvest the mock PanelApp. Returns the run report and the number of panels harvested'''
+    report = RunReport("ReadPanelApp.py")
+    api = PanelAPP_API(workers=int(workers), base_url=url, retries=10, report=report)
+    # don't wait long between retries, the mock's faults are random rather than a sign of an overloaded server
+    api.client.backoff = 0.01
+    api.outputfilepath = outputdir + os.sep
+    api.get_list_of_panels()
+    return report, len(api.dict_of_panels)
+
+
+def run_import(api_result, db_path):
+    '''Import an API result into the stand-in Moka. Returns the run report and the number of gene rows inserted'''
+    report = RunReport("insert_to_moka.py")
+    cnxn = connect_moka(db_path)
+    rows_before = cnxn.execute("select count(*) from NGSPanelGenes").fetchone()[0]
+    moka = insert_PanelApp(cnxn, connect=lambda: connect_moka(db_path), report=report)
+    moka.API_result = api_result
+    moka.load_translations()
+    moka.check_item_category_table()
+    moka.get_list_of_versions()
+    moka.all_existing_panels()
+    moka.parse_PanelAPP_API_result()
+    return report, cnxn.execute("select count(*) from NGSPanelGenes").fetchone()[0] - rows_before
+
+
+def run_incremental_import(api_result, db_path):
+    '''Import a second API result into the stand-in Moka. Returns the run report and the number of panel colours in the API result'''
+    report, rows = run_import(api_result, db_path)
+    return report, sum(1 for record in read_panel_records(api_result))
+
+
+def run_reconcile(api_result, db_path):
+    '''Check every active panel in the stand-in Moka against an API result. Returns the run report and the number of gene rows checked'''
+    report = RunReport("insert_to_moka.py")
+    cnxn = connect_moka(db_path)
+    moka = insert_PanelApp(cnxn, connect=lambda: connect_moka(db_path), report=report)
+    moka.API_result = api_result
+    moka.load_translations()
+    with report.phase("reconcile database"):
+        moka.reconcile_database()
+    return report, cnxn.execute("select count(*) from NGSPanelGenes g join NGSPanel n on n.NGSPanelID = g.NGSPanelID "
+                                "where n.Active = 1").fetchone()[0]
+
+
+# the function run in a separate process for each scenario
+RUNNERS = {"harvest": run_harvest, "first import": run_import, "incremental import": run_incremental_import,
+           "reconcile": run_reconcile}
+
+
+def run_scenario(name, arguments):
+    '''Run a scenario in this process, printing its result as json'''
+    start = time.time()
+    report, items = RUNNERS[name](*arguments)
+    seconds = time.time() - start
+    print json.dumps({"seconds": seconds, "items": items, "peak_kb": peak_memory_kb(), "phases": report.to_dict()["phases"]})
+
+
+def scenario(name, *arguments):
+    '''Run a scenario in its own process, returning its result'''
+    output = subprocess.check_output([sys.executable, "-m", "benchmarks.suite", "--run", name] + [str(argument) for argument in arguments])
+    # the result is the last line printed. the harvest also prints a summary of its requests
+    result = json.loads(output.splitlines()[-1])
+    return OrderedDict([("seconds", round(result["seconds"], 3)), ("throughput", round(result["items"] / result["seconds"], 1)),
+                        ("unit", SCENARIOS[name]), ("peak_mb", round(result["peak_kb"] / 1024.0, 1)), ("phases", result["phases"])])
+
+
+def new_moka(path, genes):
+    '''Create an empty stand-in Moka with a translation for each gene of the mock PanelApp'''
+    cnxn = create_moka(path)
+    add_translations(cnxn, synthetic_translations(max(genes * 4, 100)))
+    cnxn.execute("insert into ItemCategory (ItemCategory) values ('NGS Panel')")
+    cnxn.commit()
+    cnxn.close()
+
+
+def run_suite(settings, tmp):
+    '''Run every scenario, returning the result of each'''
+    results = OrderedDict()
+    mock = MockPanelApp(panels=settings["panels"], genes=settings["genes"], latency=settings["latency"],
+                        fault_rate=settings["fault_rate"]).start()
+    try:
+        db_path = os.path.join(tmp, "moka.db")
+        new_moka(db_path, settings["genes"])
+        harvests = []
+        for name in ("first", "second"):
+            if name == "second":
+                # change some panels between the harvests
+                change_panels(mock, settings["changed"])
+            outputdir = os.path.join(tmp, name)
+            os.mkdir(outputdir)
+            result = scenario("harvest", mock.url, outputdir, settings["workers"])
+            if name == "first":
+                results["harvest"] = result
+            harvests.append(os.path.join(outputdir, [path for path in os.listdir(outputdir) if path.endswith("_PanelAppOut.jsonl")][0]))
+    finally:
+        mock.stop()
+    results["first import"] = scenario("first import", harvests[0], db_path)
+    results["incremental import"] = scenario("incremental import", harvests[1], db_path)
+    results["reconcile"] = scenario("reconcile", harvests[1], db_path)
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    '''The scenarios slower or using more memory than the baseline by more than the tolerance, as readable text'''
+    found = []
+    for name, result in results.items():
+        expected = baseline["scenarios"].get(name)
+        if expected is None:
+            continue
+        if result["throughput"] < expected["throughput"] * (1 - tolerance):
+            found.append("%s: %.1f %s, baseline %.1f" % (name, result["throughput"], result["unit"], expected["throughput"]))
+        if result["peak_mb"] > expected["peak_mb"] * (1 + tolerance):
+            found.append("%s: peak memory %.1f MB, baseline %.1f MB" % (name, result["peak_mb"], expected["peak_mb"]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", type=int, default=400)
+    parser.add_argument("--genes", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds added to every response (default: 0.002)")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="proportion of responses which fail (default: 0)")
+    parser.add_argument("--workers", type=int, default=4, help="workers for the harvest (default: 4)")
+    parser.add_argument("--changed", type=float, default=0.05, help="proportion of panels changed before the incremental import (default: 0.05)")
+    parser.add_argument("--baseline", default=BASELINE, help="the stored baseline (default: benchmarks/baseline.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="save the results as the baseline instead of comparing with it")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="the proportion a scenario can be slower or use more memory than the baseline (default: 0.3)")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--run", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_scenario(args.run[0], args.run[1:])
+        return
+
+    settings = OrderedDict([("panels", args.panels), ("genes", args.genes), ("latency", args.latency),
+                            ("fault_rate", args.fault_rate), ("workers", args.workers), ("changed", args.changed)])
+    tmp = tempfile.mkdtemp()
+    try:
+        results = run_suite(settings, tmp)
+    finally:
+        shutil.rmtree(tmp)
+    content = OrderedDict([("format", "BenchmarkResults"), ("format_version", 1), ("settings", settings), ("scenarios", results)])
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(content, output, indent=1)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["settings"] != settings:
+            print "%s was recorded with different settings and isn't compared: %s" % (args.baseline, json.dumps(baseline["settings"]))
+            baseline = None
+
+    print ", ".join("%s %s" % item for item in settings.items())
+    print "%-20s %8s %12s %-16s %8s %12s %8s" % ("scenario", "seconds", "throughput", "", "peak MB", "baseline", "peak MB")
+    for name, result in results.items():
+        expected = baseline["scenarios"].get(name) if baseline else None
+        print "%-20s %8.2f %12.1f %-16s %8.1f %12s %8s" % (name, result["seconds"], result["throughput"], result["unit"], result["peak_mb"],
+                                                         "%.1f" % expected["throughput"] if expected else "-",
+                                                         "%.1f" % expected["peak_mb"] if expected else "-")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(content, baseline_file, indent=1)
+            baseline_file.write("\n")
+        print "saved the baseline to %s" % args.baseline
+    elif baseline:
+        found = regressions(results, baseline, args.tolerance)
+        if found:
+            raise Exception("regressions against %s:\n%s" % (args.baseline, "\n".join(found)))
+        print "no regressions against %s (tolerance %.0f%%)" % (args.baseline, args.tolerance * 100)
+
+
+if __name__ == "__main__":
+    main()
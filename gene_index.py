@@ -0,0 +1,305 @@
+'''
+An inverted index of a PanelApp harvest, from each gene to the panels containing it, for answering "which panels, at which
+colour, contain BRCA1, or any (or all) of these 200 genes" without scanning the harvest or querying Moka.
+
+Each gene is indexed by its symbol and by each of its ensembl ids (case is ignored). Each key has a posting list of the
+panel colours (panel hash, name, version and colour) containing the gene, stored in whichever form is smaller:
+- a sorted array of panel colour ids, for genes in a few panels
+- a bitmap with a bit for each panel colour, for genes in many panels (more than 1 in 32 panel colours)
+Queries of many genes are answered by OR-ing (any) or AND-ing (all) the bitmaps of the genes.
+
+The index is written to a binary file which is memory-mapped when opened. Opening it only reads the keys and the table of
+panel colours. The posting lists, which are most of the file, are read from the map as they are looked up.
+
+    header          magic "PAGI", format version, number of panel colours, number of keys, length of the postings and
+                    of the panel table
+    key offsets     (keys + 1) uint32, the start of each key in the key strings
+    posting offsets (keys + 1) uint32, the start of each key's posting list in the postings
+    posting kinds   a byte for each key, "a" (array) or "b" (bitmap)
+    key strings     the keys, sorted and concatenated
+    postings        the posting lists
+    panel table     json list of [panel_hash, panel_name, version, colour]
+
+The integers in the header and arrays are little-endian. Each bitmap is a big-endian integer with bit n set if panel colour
+n contains the gene, so it can be read as an integer in one step.
+
+ReadPanelApp.py --gene-index writes <date>_PanelAppGenes.idx alongside the harvest. An index can also be built from any
+harvest, and queried, by running this module:
+    python gene_index.py build 20180828_PanelAppOut.jsonl genes.idx
+    python gene_index.py query genes.idx BRCA1 BRCA2
+    python gene_index.py query genes.idx BRCA1 BRCA2 --all --colour Green
+    python gene_index.py query genes.idx --any --genes-file genes.txt
+'''
+
+import argparse
+import binascii
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections import OrderedDict
+
+from panelapp_io import is_change_feed, read_api_result
+
+MAGIC = "PAGI"
+FORMAT_VERSION = 1
+# magic, format version, panel colours, keys, length of the postings, length of the panel table
+HEADER = struct.Struct("<4sIIIII")
+# the kinds of posting list
+ARRAY = "a"
+BITMAP = "b"
+
+
+def uint32_array(values=()):
+    '''An array of unsigned 32 bit integers'''
+    for typecode in ("I", "L"):
+        if array(typecode).itemsize == 4:
+            return array(typecode, values)
+    raise Exception("no 32 bit array type on this platform")
+
+
+def index_key(gene):
+    '''The key a gene symbol or ensembl id is indexed by: upper case, utf-8 encoded'''
+    if isinstance(gene, unicode):
+        gene = gene.encode("utf-8")
+    return gene.strip().upper()
+
+
+def little_endian(values):
+    '''Convert an array to or from little-endian, in place'''
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def little_endian_bytes(values):
+    '''The bytes of an array, little-endian, leaving the array as it is'''
+    return little_endian(array(values.typecode, values)).tostring()
+
+
+def to_bitmap(ids, size):
+    '''The bytes of a bitmap of size bytes with the bit of each id set'''
+    bits = 0
+    for value in ids:
+        bits |= 1 << value
+    return binascii.unhexlify("%0*x" % (size * 2, bits))
+
+
+def bitmap_ids(bits):
+    '''The sorted ids of the bits set in a bitmap held as an integer'''
+    # the binary digits of the integer, least significant first
+    return [position for position, bit in enumerate(bin(bits)[:1:-1]) if bit == "1"]
+
+
+class GeneIndexBuilder():
+    '''Collects the posting list of each gene from a harvest and writes the index file'''
+
+    def __init__(self):
+        # (panel_hash, panel_name, version, colour) of each panel colour, indexed by panel colour id
+        self.entries = []
+        # key: array of panel colour ids
+        self.postings = {}
+
+    def add(self, record):
+        '''Add the genes of a panel colour (a PanelRecord, or anything with the same attributes)'''
+        entry = len(self.entries)
+        self.entries.append((record.panel_hash, record.panel_name, record.version, record.colour))
+        for symbol, ensembl_ids in zip(record.symbols, record.ensembl_ids):
+            for key in [symbol] + list(ensembl_ids):
+                key = index_key(key)
+                if not key:
+                    continue
+                posting = self.postings.get(key)
+                if posting is None:
+                    posting = self.postings[key] = uint32_array()
+                # the ids are added in order, so a gene listed twice in a panel colour only needs checking against the last id
+                if not posting or posting[-1] != entry:
+                    posting.append(entry)
+        return self
+
+    def write(self, path):
+        '''Write the index, replacing any file at path only once it is complete'''
+        keys = sorted(self.postings)
+        bitmap_size = (len(self.entries) + 7) // 8
+        key_offsets = uint32_array([0])
+        posting_offsets = uint32_array([0])
+        kinds = []
+        postings = []
+        for key in keys:
+            posting = self.postings[key]
+            # store each posting list as a bitmap if it is smaller than the array
+            if len(posting) * 4 > bitmap_size:
+                kinds.append(BITMAP)
+                postings.append(to_bitmap(posting, bitmap_size))
+            else:
+                kinds.append(ARRAY)
+                postings.append(little_endian_bytes(posting))
+            key_offsets.append(key_offsets[-1] + len(key))
+            posting_offsets.append(posting_offsets[-1] + len(postings[-1]))
+        entries = json.dumps(self.entries, separators=(",", ":"))
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(handle, 'wb') as output:
+            output.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(self.entries), len(keys), posting_offsets[-1], len(entries)))
+            output.write(little_endian_bytes(key_offsets))
+            output.write(little_endian_bytes(posting_offsets))
+            output.write("".join(kinds))
+            output.write("".join(keys))
+            output.write("".join(postings))
+            output.write(entries)
+        os.rename(temp_path, path)
+
+
+def build_index(records, path):
+    '''Build an index from an iterable of PanelRecords and write it to path'''
+    builder = GeneIndexBuilder()
+    for record in records:
+        builder.add(record)
+    builder.write(path)
+    return builder
+
+
+class GeneIndex():
+    '''A gene index file, memory-mapped. Panel colours are returned as (panel_hash, panel_name, version, colour) tuples,
+    in the order of the harvest'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as index_file:
+            self.map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, entry_count, self.key_count, postings_length, entries_length = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise Exception("%s is not a gene index" % path)
+        if format_version != FORMAT_VERSION:
+            raise Exception("%s is a version %d gene index. version %d is supported" % (path, format_version, FORMAT_VERSION))
+        # read each section in turn
+        offsets_size = (self.key_count + 1) * 4
+        start = HEADER.size
+        key_offsets = little_endian(uint32_array(self.map[start:start + offsets_size]))
+        start += offsets_size
+        self.posting_offsets = little_endian(uint32_array(self.map[start:start + offsets_size]))
+        start += offsets_size
+        self.kinds = self.map[start:start + self.key_count]
+        start += self.key_count
+        # key: position. a dictionary rather than a binary search of the keys in the map, so looking up many genes is quick
+        keys = self.map[start:start + key_offsets[-1]]
+        self.positions = dict((keys[key_offsets[position]:key_offsets[position + 1]], position) for position in xrange(self.key_count))
+        self.postings_start = start + key_offsets[-1]
+        entries_start = self.postings_start + postings_length
+        self.entries = [tuple(entry) for entry in json.loads(self.map[entries_start:entries_start + entries_length])]
+        if len(self.entries) != entry_count:
+            raise Exception("%s is incomplete" % path)
+
+    def posting(self, gene):
+        '''The kind and bytes of a gene's posting list, or None if the gene isn't in the index'''
+        position = self.positions.get(index_key(gene))
+        if position is None:
+            return None
+        return self.kinds[position], self.map[self.postings_start + self.posting_offsets[position]:self.postings_start + self.posting_offsets[position + 1]]
+
+    def postings(self, gene):
+        '''The sorted ids of the panel colours containing a gene, given by symbol or ensembl id'''
+        posting = self.posting(gene)
+        if posting is None:
+            return []
+        kind, data = posting
+        if kind == BITMAP:
+            return bitmap_ids(int(binascii.hexlify(data), 16))
+        return little_endian(uint32_array(data)).tolist()
+
+    def bits(self, gene):
+        '''The panel colours containing a gene as a bitmap, held as an integer'''
+        posting = self.posting(gene)
+        if posting is None:
+            return 0
+        kind, data = posting
+        if kind == BITMAP:
+            return int(binascii.hexlify(data), 16)
+        bits = 0
+        for entry in little_endian(uint32_array(data)):
+            bits |= 1 << entry
+        return bits
+
+    def lookup(self, gene):
+        '''The panel colours containing a gene'''
+        return [self.entries[entry] for entry in self.postings(gene)]
+
+    def lookup_many(self, genes):
+        '''The panel colours containing each of a list of genes, as a dictionary of gene: panel colours'''
+        return OrderedDict((gene, self.lookup(gene)) for gene in genes)
+
+    def union(self, genes):
+        '''The panel colours containing any of a list of genes'''
+        bits = 0
+        for gene in genes:
+            bits |= self.bits(gene)
+        return [self.entries[entry] for entry in bitmap_ids(bits)]
+
+    def intersection(self, genes):
+        '''The panel colours containing all of a list of genes'''
+        bits = None
+        for gene in genes:
+            bits = self.bits(gene) if bits is None else bits & self.bits(gene)
+            if not bits:
+                return []
+        return [self.entries[entry] for entry in bitmap_ids(bits or 0)]
+
+    def __len__(self):
+        return self.key_count
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_genes(genes, genes_file):
+    '''The genes given on the command line, followed by those in a file with one gene per line'''
+    genes = list(genes)
+    if genes_file:
+        with open(genes_file, 'r') as lines:
+            genes.extend(line.strip() for line in lines if line.strip())
+    return genes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query an index from each gene to the PanelApp panels containing it")
+    commands = parser.add_subparsers(dest="command")
+    build = commands.add_parser("build", help="build an index from a harvest")
+    build.add_argument("api_result", help="a PanelAppOut.jsonl file, or a legacy PanelAppOut.txt file given with --symbols")
+    build.add_argument("index", help="the index file to write")
+    build.add_argument("--symbols", help="the PanelAppOut_symbols.txt file of a legacy PanelAppOut.txt file")
+    query = commands.add_parser("query", help="list the panels containing genes")
+    query.add_argument("index")
+    query.add_argument("genes", nargs="*", help="gene symbols or ensembl ids")
+    query.add_argument("--genes-file", help="a file of genes to look up, one a line")
+    combine = query.add_mutually_exclusive_group()
+    combine.add_argument("--any", action="store_true", help="list the panels containing any of the genes")
+    combine.add_argument("--all", action="store_true", help="list the panels containing all of the genes")
+    query.add_argument("--colour", choices=["Amber", "Green"], help="only list panels where the genes have this colour")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        # a change feed only has the panels which changed, so most genes would be missing from the index
+        if not args.symbols and is_change_feed(args.api_result):
+            raise Exception("%s is a change feed. Build the index from a full API result" % args.api_result)
+        builder = build_index(read_api_result(args.api_result, args.symbols), args.index)
+        print "indexed %d genes and ensembl ids in %d panel colours" % (len(builder.postings), len(builder.entries))
+    else:
+        genes = read_genes(args.genes, args.genes_file)
+        with GeneIndex(args.index) as index:
+            if args.any or args.all:
+                results = [(None, index.union(genes) if args.any else index.intersection(genes))]
+            else:
+                results = index.lookup_many(genes).items()
+            for gene, entries in results:
+                for panel_hash, panel_name, version, colour in entries:
+                    if args.colour is None or colour == args.colour:
+                        print "\t".join(([gene] if gene else []) + [panel_hash, panel_name, version, colour]).encode("utf-8")
@@ -0,0 +1,113 @@
+'''
+An in-memory index of the GenesHGNC_current_translation table.
+
+The same genes appear in many panels, so rather than querying the translation table for every gene the
+table is read once and lookups are answered from memory. The index maps each PanelApp ensembl id to its
+(HGNCID, PanelApp_Symbol) and each HGNCID to the PanelApp symbols of every row it has in the table.
+
+If the table has more rows than max_entries only the most recently used translations are kept in memory.
+Any others are fetched from the database, in batches, when they are needed.
+'''
+
+from collections import OrderedDict
+
+
+class HGNCTranslationIndex():
+    '''Ensembl id <-> HGNCID lookups for the GenesHGNC_current_translation table'''
+    # number of ids looked up in each query (sql server accepts at most 2100 parameters in a statement)
+    lookup_batch_size = 1000
+
+    def __init__(self, queries, max_entries=None):
+        # the MokaQueries used to read the table
+        self.queries = queries
+        # the most translations to hold in memory. None loads the whole table
+        self.max_entries = max_entries
+        # True when the whole table is in memory, so an id that is not in the index is not in the table
+        self.complete = False
+        self.loaded = False
+
+        # ensembl id: (HGNCID, PanelApp_Symbol). an OrderedDict is used as an LRU cache if the table is too big to load
+        self.by_ensembl = OrderedDict()
+        # HGNCID: set of PanelApp symbols, from every row of the table. only used when the whole table is in memory
+        self.symbols_of_hgncid = {}
+
+    def load(self):
+        '''Read the translation table into memory, unless it has more than max_entries rows'''
+        if self.max_entries is not None:
+            rows = self.queries.fetchone("translation_count")[0]
+            if rows > self.max_entries:
+                # too big. translations will be fetched when needed
+                self.loaded = True
+                return
+        for ensbl_id, HGNCID, PanelApp_Symbol in self.queries.fetchall("translations"):
+            self.add(ensbl_id, HGNCID, PanelApp_Symbol)
+            # rows without an ensembl id, or with an ensembl id already seen, aren't used to translate ensembl ids but are
+            # still joined to when translating HGNCIDs
+            self.symbols_of_hgncid.setdefault(intern(str(HGNCID)), set()).add(intern(str(PanelApp_Symbol)))
+        self.complete = True
+        self.loaded = True
+
+    def add(self, ensbl_id, HGNCID, PanelApp_Symbol):
+        '''Add a row of the translation table to the index. If an ensembl id is in more than one row the first is used, so the
+        rows are read ordered by HGNCID and PanelApp_Symbol'''
+        if ensbl_id is None or ensbl_id in self.by_ensembl:
+            return
+        # intern the strings so each id and symbol is only held once, however many panels it appears in
+        ensbl_id = intern(str(ensbl_id))
+        HGNCID = intern(str(HGNCID))
+        self.by_ensembl[ensbl_id] = (HGNCID, intern(str(PanelApp_Symbol)))
+
+        # if over the limit remove the least recently used translation
+        if self.max_entries is not None and len(self.by_ensembl) > self.max_entries:
+            self.by_ensembl.popitem(last=False)
+
+    def fetch(self, statement, values):
+        '''Query the translation table for the rows matching values, using the named statement, adding them to the index.
+        Returns the rows found'''
+        rows = self.queries.fetchall_in(statement, sorted(set(values)), self.lookup_batch_size)
+        for row in rows:
+            self.add(*row)
+        return rows
+
+    def lookup(self, ensembl_ids):
+        '''Returns a dictionary of ensembl id: (HGNCID, PanelApp_Symbol) for the ensembl ids in the translation table'''
+        if not self.loaded:
+            self.load()
+        gene_info = {}
+        missing = []
+        for ensbl_id in ensembl_ids:
+            if ensbl_id in self.by_ensembl:
+                gene_info[ensbl_id] = self.by_ensembl[ensbl_id]
+                if not self.complete:
+                    # mark as recently used
+                    self.by_ensembl[ensbl_id] = self.by_ensembl.pop(ensbl_id)
+            elif not self.complete:
+                missing.append(ensbl_id)
+        # fetch any ids which are not in memory. the rows are used directly as they may already have been evicted again
+        for ensbl_id, HGNCID, PanelApp_Symbol in self.fetch("translations_by_ensembl_id", missing) if missing else []:
+            if ensbl_id not in gene_info:
+                gene_info[ensbl_id] = (str(HGNCID), str(PanelApp_Symbol))
+        return gene_info
+
+    def symbols_for_hgncids(self, hgncids):
+        '''Returns the set of PanelApp symbols for a list of HGNCIDs, as would be returned by joining to the translation table'''
+        symbols = set()
+        for hgncid_symbols in self.symbols_by_hgncid(hgncids).values():
+            symbols.update(hgncid_symbols)
+        return symbols
+
+    def symbols_by_hgncid(self, hgncids):
+        '''Returns a dictionary of HGNCID: set of PanelApp symbols for the HGNCIDs in the translation table'''
+        if not self.loaded:
+            self.load()
+        hgncids = [str(HGNCID) for HGNCID in hgncids]
+        symbols = {}
+        if not self.complete:
+            # only part of the table is in memory so an HGNCID may have rows which aren't in the index
+            for ensbl_id, HGNCID, PanelApp_Symbol in self.fetch("translations_by_hgncid", hgncids):
+                symbols.setdefault(str(HGNCID), set()).add(str(PanelApp_Symbol))
+            return symbols
+        for HGNCID in hgncids:
+            if HGNCID in self.symbols_of_hgncid:
+                symbols[HGNCID] = set(self.symbols_of_hgncid[HGNCID])
+        return symbols
@@ -0,0 +1,61 @@
+'''
+A journal of the panels imported to Moka, so an interrupted import can be resumed.
+
+Each panel is inserted in its own transaction and, once committed, a line is appended to the journal:
+
+{"panel_hash_colour": "553f968cbb5a1616e5ed45cc_Green", "version": "1.0", "ngspanel_id": 1234}
+
+When the import is run again with the same journal, panel versions in the journal are skipped without being
+compared with Moka or translated, so only the panels which failed or weren't reached are imported.
+A line is only written after its panel is committed, so a panel in the journal is always complete in Moka.
+If the import stops after a commit but before the line is written, the panel version is found in Moka on the next run.
+Panels are matched on the upper-cased hash_colour, as when the import compares them with Moka.
+'''
+
+import json
+import os
+import threading
+
+
+class ImportJournal():
+    '''The panel versions already imported, read from and appended to a JSON Lines file'''
+
+    def __init__(self, path):
+        self.path = path
+        # (upper-cased panel_hash_colour, version) of each imported panel
+        self.imported = set()
+        # panels recorded by this run
+        self.recorded = 0
+        # parallel import workers record panels at the same time
+        self.lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as journal:
+                for line in journal:
+                    # a line cut short by a crash is ignored - its panel will be found in Moka
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.imported.add((str(entry["panel_hash_colour"]).upper(), str(entry["version"])))
+        self.output = open(self.path, 'a')
+
+    def done(self, panel_hash_colour, version):
+        '''True if this panel version has already been imported'''
+        return (panel_hash_colour.upper(), version) in self.imported
+
+    def record(self, change):
+        '''Record that the panel in a PanelChange has been committed to Moka. The line is written to disk before returning'''
+        with self.lock:
+            self.output.write(json.dumps({"panel_hash_colour": change.panel_hash_colour, "version": change.version,
+                                          "ngspanel_id": change.ngspanel_key}, sort_keys=True) + "\n")
+            self.output.flush()
+            os.fsync(self.output.fileno())
+            self.imported.add((change.panel_hash_colour.upper(), change.version))
+            self.recorded += 1
+
+    def close(self):
+        self.output.close()
+
+    def summary(self):
+        return "import journal %s: %s panels recorded by this run, %s in total" % (self.path, self.recorded, len(self.imported))
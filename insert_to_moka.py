@@ -1,44 +1,95 @@
 '''
 The API cannot be used on the trust network and MOKA cannot be accessed from outside the trust network so two scripts are required.
 This script takes the output of the read_api script.
+This can be a full result, or a change feed listing only the panels which changed since an earlier harvest (see snapshot_store.py),
+in which case only the changed panels are processed.
 Each panel has a stable identifer (hash) and a human readable name, colour and version.
 Using the hash, for each panel it checks if it is already in MOKA, and if the panel has been updated.
 If it's a new panel the gene panel and genes are inserted into MOKA.
 This script was designed to be run repeatedly over time.
 
 steps in more detail:
+0) Load the HGNC translation table into memory, so genes can be translated without querying the database for every gene
 1) Look to see if 'NGS Panel Version' is in the lookup (item) table. if not insert it.
 2) Loop through the API result creating a list of version numbers 
-3) Pull out all versions in the item table. Insert any version numbers that are not already in the database
+3) Pull out all versions in the item table and their keys.
 4) Pull out the existing panels and versions from database. This creates a dictonary with panel_hash as key and the values as a list of versions eg {panel_hash_green:[0.1,0.2]}
-5) Loop through the API result:
+5) Plan the changes, without writing to the database. Loop through the API result:
     - check if the panel name is already in dict
         - checks if the version number from API is > than that in the db
-            - If newer insert new panel name and version, deactivating the older version
-6) Add the genes to the NGSpanelsGenes table
+            - If newer the panel is added to the change set, along with its genes translated using the HGNC table
+    - any version numbers not in the database are added to the change set
+6) Apply the change set in a single transaction - insert the new version numbers, deactivate the older versions of updated panels,
+   insert the new panels and add the genes to the NGSpanelsGenes table
+   With --dry-run the change set is printed instead.
+   With --workers the rows shared by panels (the version numbers and panel items) are inserted first, then the panels are split between
+   the workers, each inserting its panels using its own connection and transaction.
+   With --journal each panel is inserted in its own transaction and recorded in the journal once committed. If the import stops
+   it can be run again with the same journal and the panels already recorded are skipped.
+   With --bulk the changes are worked out and made by the database instead. The API result is copied into staging tables in
+   batches (a bulk insert with pyodbc) and set based statements compare it with the panels in moka, insert the new versions,
+   deactivate the older versions of updated panels and insert the new panels and their genes (translated by joining to the HGNC table),
+   in a single transaction. The result is the same as steps 4 to 6, without moving each panel and gene over the network to plan it.
 7) A check is then done using the list if gene symbols from each panel to check all the genes are imported. This uses a translation copy of the HGNC_current table which has been manually curated to get around the outdated symbols in panelapp. 
+   The genes of all the inserted panels are read back in one query and any differences are collected in a single discrepancy report (see reconcile.py)
+   With --reconcile every active panel in moka is checked against the API result instead of importing.
+
+With --run-report the time taken by each step and a latency histogram of each statement are written to a json run report
+(see run_report.py). With --profile the import is run under a profiler.
 
-NB when run for the very first time there must be one version in the item table (imported manually) otherwise the script fails.
 
 created by Aled 18 Oct 2016
 '''
-import pyodbc
+import argparse
+from multiprocessing.pool import ThreadPool
+from hgnc_translation import HGNCTranslationIndex
+from panelapp_io import is_change_feed, read_api_result, read_api_versions
+from panel_changes import ChangeSet, PanelChange
+from panel_model import GeneTable, PanelGenes, PanelVersion
+from moka_queries import STAGING_TABLES, MokaQueries
+from reconcile import Reconciliation
+from import_journal import ImportJournal
+from run_report import Profiler, RunReport
+try:
+    import pyodbc
+except ImportError:
+    # pyodbc is only needed to connect to moka. a connection to a stand-in database can be passed to insert_PanelApp instead
+    pyodbc = None
 
 class insert_PanelApp:
-    def __init__(self):
-        # the file containing the result of the API query
+    # number of rows copied into a staging table by each statement of a bulk load
+    stage_batch_size = 10000
+
+    def __init__(self, cnxn=None, max_translations=None, workers=1, connect=None, journal_path=None, report=None):
+        # the file containing the result of the API query.
+        # this is either a PanelAppOut.jsonl file or, for the original text output, a PanelAppOut.txt file with a matching symbols file
         self.API_result = "\\\\gstt.local\\apps\\Moka\\Files\\Software\\PanelApp\\20180828_PanelAppOut_modified.txt"
         self.API_symbol_result = "\\\\gstt.local\\apps\\Moka\\Files\\Software\\PanelApp\\20180828_PanelAppOut_symbols.txt"
         
-        # list to hold the API response
-        self.API_list = []
         # list to hold the database contents
         self.db_list = []
 
         # variables for the database connection
-        #self.cnxn = pyodbc.connect("DRIVER={SQL Server}; SERVER=GSTTV-MOKA; DATABASE=mokadata;")
-        self.cnxn = pyodbc.connect("DRIVER={SQL Server}; SERVER=GSTTV-MOKA; DATABASE=devdatabase;")
-        self.cursor = self.cnxn.cursor()
+        # connect is a function returning a new connection, used to give each worker its own connection
+        if connect is not None:
+            self.connect = connect
+        if cnxn is None:
+            cnxn = self.connect()
+        self.cnxn = cnxn
+        # number of workers inserting panels at the same time. 1 inserts all the panels in a single transaction
+        self.workers = workers
+        # optional journal of the panels imported, so an interrupted import can be resumed
+        self.journal = None
+        if journal_path:
+            self.journal = ImportJournal(journal_path)
+        # timings of each phase and statement for the run report. nothing is recorded unless a report is given
+        self.report = report or RunReport("insert_to_moka.py", enabled=False)
+        # all statements are run through the query layer, with bound parameters
+        self.queries = MokaQueries(self.cnxn, report=self.report)
+
+        # in memory copy of the hgnc translation table, loaded once by load_translations.
+        # if max_translations is set and the table is bigger only the most recently used translations are held in memory
+        self.translations = HGNCTranslationIndex(self.queries, max_translations)
 
         # name of category in item category
         self.category_name = "NGS Panel version"
@@ -46,16 +97,12 @@ class insert_PanelApp:
         # list of versions for item table
         self.versions_in_api = [0.0]
 
-        # query used when returning a key after select statement
-        self.fetch_key_qry = ""
+        # error messages used if a query doesn't return a result
+        # when returning a key after select statement
         self.exception_message = ""
-
-        # query used for select_query
-        self.select_qry = ""
+        # for select_query
         self.select_qry_exception = ""
-
-        # used in insert query
-        self.insert_query = ""
+        # for insert query
         self.insert_query_exception = ""
 
         # value for item_category_NGS_panel in item table
@@ -67,24 +114,31 @@ class insert_PanelApp:
 
         # variable to hold all the panels currently in the database
         self.all_panels_in_db = {}
+        # the highest version of each panel in the database, with the panelhash_colour converted to upper case
+        self.max_version_in_db = {}
 
         # key assigned to panel in item table
         self.VersionItemCategory = ''
 
         # all versions in database
         self.versions_in_db = []
+        # itemid of each version in the database
+        self.version_keys = {}
+
+        # itemid of each panel in the item table, with the panelhash_colour converted to upper case
+        self.panel_item_keys = {}
+
+        # every gene in the api result, held once
+        self.genes = GeneTable()
 
-        # a list to hold the api gene symbols output
+        # the api genes of each panel colour, as an array of gene ids in self.genes
         self.API_symbols = {}
 
-        # new version key
-        self.version_key = ""
+        # the discrepancies found by the last check of the imported genes
+        self.reconciliation = None
 
         # key of newly inserted panel
         self.inserted_panel_key = ""
-
-        # variable to hold the key for the existing gene panel
-        self.panel_key = ""
         
         #ignore exception flag
         self.ignore=False
@@ -93,14 +147,18 @@ class insert_PanelApp:
         #id for the moka user
         self.moka_user="1201865448"
 
+    def connect(self):
+        '''Return a new connection to moka'''
+        #return pyodbc.connect("DRIVER={SQL Server}; SERVER=GSTTV-MOKA; DATABASE=mokadata;")
+        return pyodbc.connect("DRIVER={SQL Server}; SERVER=GSTTV-MOKA; DATABASE=devdatabase;")
+
     def check_item_category_table(self):
         '''this module checks the item category table to find the key that marks an row as a NGS panel version.
         If not present inserts it. This should only be required the first time the script is run for a database'''
         
         # query to extract all rows in table
-        self.select_qry = "select itemcategory from itemcategory"
         self.select_qry_exception = "cannot retrieve all itemcategories from itemcategory table"
-        item_cat = self.select_query()
+        item_cat = self.select_query("item_categories")
         
         # loop through the table contents and append to a list
         item_cat_list = []
@@ -109,71 +167,68 @@ class insert_PanelApp:
         
         # If there is no entry for NGS Panel version insert it 
         if self.category_name not in item_cat_list:
-            self.insert_query = "Insert into Itemcategory(itemcategory) values ('%s')" % (self.category_name)
-            self.insert_query_function()
+            self.insert_query_function("insert_item_category", (self.category_name,))
+
+    def read_api_result(self):
+        '''Generator yielding the PanelGenes of each panel colour in the API result, one at a time. The genes are added to self.genes'''
+        for record in read_api_result(self.API_result, self.legacy_symbols_file()):
+            yield PanelGenes.from_record(record, self.genes)
+
+    def legacy_symbols_file(self):
+        '''The original text output has the symbols in a separate file. Returns this file, or None if the API result is a json lines file'''
+        if self.API_result.endswith(".txt"):
+            return self.API_symbol_result
+        return None
 
     def get_list_of_versions(self):
         '''The API results are parsed to identify all the version numbers'''
-        # Parse the API result to find all the version numbers
-        with open(self.API_result, 'r') as API_output:
-            self.API_list = API_output.readlines()
-        
-        # split to capture the version number
-        for panel in self.API_list:
-            split1 = panel.split(':')
-            names = split1[0].split('_')
-            version = names[2]
-            # add version to the list
-            self.versions_in_api.append(version)
+        # Parse the API result to find all the version numbers and add them to the list
+        self.versions_in_api.extend(read_api_versions(self.API_result, self.legacy_symbols_file()))
         
         # condense this to a unqiue list
-        self.versions_in_api = set(self.versions_in_api)
+        self.versions_in_api = set(str(version) for version in self.versions_in_api)
         
-        # Call module to insert any new version numbers to the database
-        self.insert_versions()
+        # Call module to find the version numbers already in the database
+        self.load_versions()
 
-    def insert_versions(self):
-        '''If a version number from the API result is not in the database insert it'''
+    def load_versions(self):
+        '''Find the version numbers already in the database and their keys. Any versions from the API result which are not in the database are inserted when the changes are applied'''
         
         # first need to get the key used to mark version numbers in the item table
-        self.fetch_key_qry = "select ItemCategoryID from ItemCategory where ItemCategory = '%s'" % self.category_name
         self.exception_message = "Cannot return the itemcategoryID from itemcategory table when looking for 'ngs panel version'"
 
         # call fetch key module
-        version_item_cat = self.fetch_key()
+        version_item_cat = self.fetch_key("item_category_key", (self.category_name,))
         self.VersionItemCategory = version_item_cat[0]
 
-        # get list of versions already in table
-        self.select_qry = "select Item from item where itemcategoryindex1ID= %s" % (self.VersionItemCategory)
-        self.select_qry_exception = "cannot find any versions in item table"
-        list_of_db_versions = self.select_query()
+        # get list of versions already in table, and their keys
+        # there won't be any the first time the script is run
+        self.ignore = True
+        list_of_db_versions = self.select_query("items_in_category", (self.VersionItemCategory,))
+        self.ignore = False
+        if list_of_db_versions == self.notfound:
+            list_of_db_versions = []
         
         #loop through results 
-        for version in list_of_db_versions:
-            # Even though only one column is returned in the query a tuple is returned
-            # append the the first item in the tuple to the list
-            self.versions_in_db.append(version[0])
-        
-        # if version in API result not already in db:
-        for version in self.versions_in_api:
-            if version not in self.versions_in_db:
-                # add the version to the item table
-                self.insert_query = "Insert into Item(Item,itemcategoryindex1ID) values (%s,%s)" % (version, self.VersionItemCategory)
-                self.insert_query_function()
+        for version, key in list_of_db_versions:
+            # append the version to the list and record its key
+            self.versions_in_db.append(str(version))
+            self.version_keys[str(version)] = key
 
     def all_existing_panels(self):
         '''This module extracts all the panels and the version numbers from the database'''
         
         # extract all the existing panels from the database
         # retrun the panelhash_colour and version number
-        self.select_qry = "select ItemA.item, ItemB.item from Item itemA, Item ItemB, NGSPanel where ItemA.ItemID=dbo.NGSPanel.Category and ItemB.itemID = dbo.NGSPanel.subCategory and itemA.ItemCategoryIndex1ID = %s and itemB.ItemCategoryIndex1ID = %s" % (self.item_category_NGS_panel, self.VersionItemCategory)
         self.select_qry_exception = "cannot extract all panels and versions"
                
-        # execute query to pull out all panels and version in db
-        self.db_list = self.select_query()
+        # execute query to pull out all panels and version in db. there won't be any the first time the script is run
+        self.ignore = True
+        self.db_list = self.select_query("panel_versions", (self.item_category_NGS_panel, self.VersionItemCategory))
+        self.ignore = False
         
         # if no panels in gene all_panels will be empty- looping through this will error!
-        if len(self.db_list) > 0:
+        if self.db_list != self.notfound:
             # loop through db results result and create a dict with the panel name as key and list of version numbers as value
             for i in self.db_list:
                 # i[0] is panel name, i[1] is version number
@@ -187,164 +242,425 @@ class insert_PanelApp:
                 else:
                     # otherwise create dictionary entry
                     self.all_panels_in_db[panelhash] = [version]
-
+                # keep the highest version of each panel so checking if an API version is newer is a single lookup
+                # versions are compared by release number - 1.4 is < 1.10 (1 point four is less than 1 point 10)
+                version = PanelVersion(version)
+                if panelhash not in self.max_version_in_db or version > self.max_version_in_db[panelhash]:
+                    self.max_version_in_db[panelhash] = version
+
+        # capture the itemid for every panel in the items table
+        # this will be stored in the category column in ngspanels table
+        self.ignore = True
+        panel_items = self.select_query("items_in_category", (self.item_category_NGS_panel,))
+        self.ignore = False
+        if panel_items != self.notfound:
+            for panel_hash_colour, key in panel_items:
+                # there may be two entries in the item table if there is Green and green - take the highest
+                panelhash = panel_hash_colour.upper()
+                if key > self.panel_item_keys.get(panelhash, key - 1):
+                    self.panel_item_keys[panelhash] = key
 
     def parse_PanelAPP_API_result(self):
         ''' This module loops through the API result. If the panel name is not in the database it inserts it. 
-        If the panel already exists it checks the version number to see if the panel has been updated and if so the updated verison is inserted'''
-        # open and parse the text file containing the api query result
+        If the panel already exists it checks the version number to see if the panel has been updated and if so the updated verison is inserted.
+        All the changes are planned first and then made in a single transaction. Returns the change set'''
+        with self.report.phase("plan changes"):
+            changes = self.plan_changes()
+        with self.report.phase("apply changes"):
+            self.apply_changes(changes)
+        self.check_imported(changes)
+        return changes
+
+    def import_panels(self, batches):
+        '''Import panels while they are still being harvested, for a pipelined harvest and import (see pipeline.py).
+        batches is an iterable of lists of the PanelGenes of each panel colour, in the order they were harvested. Each batch is
+        planned and applied as it arrives, in its own transaction (or with workers or a journal, as apply_changes_in_partitions does).
+        Returns the ChangeSet of every batch'''
+        changes = ChangeSet()
+        # as when the whole API result is read by get_list_of_versions, the version of every panel is added to the item table,
+        # not only the versions of the panels inserted
+        versions = set(str(version) for version in self.versions_in_api)
+        for batch in batches:
+            batch_changes = ChangeSet()
+            with self.report.phase("plan changes"):
+                for record in batch:
+                    panel = PanelGenes.from_record(record, self.genes)
+                    versions.add(str(panel.version))
+                    self.plan_panel(panel, batch_changes)
+                batch_changes.new_versions = sorted(version for version in versions if version not in self.version_keys)
+            if len(batch_changes):
+                with self.report.phase("apply changes"):
+                    self.apply_changes(batch_changes)
+            changes.extend(batch_changes)
+        self.check_imported(changes)
+        return changes
+
+    def bulk_load(self):
+        '''Import the API result using set based statements run by the database, rather than planning each panel here.
+        The API result is copied into staging tables and merged into moka in a single transaction, making the same changes as
+        parse_PanelAPP_API_result. Needs the same setup, except all_existing_panels (the panels in moka are compared in the
+        database) and get_list_of_versions (load_versions is enough, the versions are collected while staging). Returns the change set'''
+        if self.workers > 1 or self.journal:
+            raise Exception("a bulk load is made in a single transaction so can't be split between workers or journalled")
+        # the staging tables are committed before they are used so they can be dropped whether or not the load succeeds
+        for table in STAGING_TABLES:
+            self.queries.execute("create_" + table)
+        self.queries.commit()
+        try:
+            with self.report.phase("stage api result"):
+                panels, previous_versions = self.stage_api_result()
+            with self.report.phase("merge staged panels"):
+                changes = self.merge_staged_panels(panels, previous_versions)
+            self.queries.commit()
+        except:
+            self.queries.rollback()
+            raise
+        finally:
+            for table in STAGING_TABLES:
+                self.queries.execute("drop_" + table)
+            self.queries.commit()
+        self.check_imported(changes)
+        return changes
+
+    def stage_api_result(self):
+        '''Copy the API result into the staging tables - each panel colour, the ensembl ids of its genes in order, and every version number
+        in the API result or in moka, ranked in release order. Rows are sent stage_batch_size at a time.
+        Returns the PanelGenes of each panel colour (in the order of the API result) and the version number of each rank in moka'''
+        panels = []
+        panel_rows = []
+        gene_rows = []
+        # number of gene rows staged, giving the order the genes are inserted in
+        ordinal = 0
+        versions = set(str(version) for version in self.versions_in_api)
+        for panel in self.read_api_result():
+            position = len(panels)
+            panels.append(panel)
+            versions.add(str(panel.version))
+            panel_rows.append((position, panel.panel_hash_colour, panel.panel_hash_colour.upper(), self.name_panel_colour(panel), panel.version))
+            # each ensembl id of each gene is translated, as by gene_rows
+            for ensembl_ids in panel.ensembl_ids:
+                for ensemblid in ensembl_ids:
+                    gene_rows.append((ordinal, position, ensemblid))
+                    ordinal += 1
+            if len(panel_rows) >= self.stage_batch_size:
+                self.queries.executemany("stage_panels", panel_rows)
+                panel_rows = []
+            if len(gene_rows) >= self.stage_batch_size:
+                self.queries.executemany("stage_genes", gene_rows)
+                gene_rows = []
+        self.queries.executemany("stage_panels", panel_rows)
+        self.queries.executemany("stage_genes", gene_rows)
+
+        # versions are compared in the database by rank. versions with the same release number (eg 1.2 and 1.02) have the same rank
+        # position orders the new versions as plan_changes does
+        every_version = versions.union(self.versions_in_db)
+        ranks = dict((version, rank) for rank, version in enumerate(sorted(set(PanelVersion(version) for version in every_version))))
+        self.queries.executemany("stage_versions", [(version, ranks[PanelVersion(version)], int(version in versions), position)
+                                                    for position, version in enumerate(sorted(every_version))])
+        previous_versions = {}
+        for version in self.versions_in_db:
+            previous_versions.setdefault(ranks[PanelVersion(version)], version)
+        return panels, previous_versions
+
+    def merge_staged_panels(self, panels, previous_versions):
+        '''Merge the staged API result into moka, in the same order as apply_changes. Doesn't commit.
+        Returns the change set made, read back from the staging tables'''
+        changes = ChangeSet()
+        # insert the version numbers not yet in the item table and capture their keys
+        self.queries.execute("staged_version_keys", (self.VersionItemCategory,))
+        changes.new_versions = [str(version) for version, in self.queries.fetchall("staged_new_versions")]
+        self.queries.execute("insert_staged_versions", (self.VersionItemCategory,))
+        self.queries.execute("staged_version_keys", (self.VersionItemCategory,))
+        # compare each staged panel with the highest version of the panel in moka (ignoring the case of the panel hash_colour),
+        # then add the new panels to the item table
+        self.queries.execute("stage_existing_panels", (self.VersionItemCategory, self.item_category_NGS_panel))
+        self.queries.execute("plan_staged_panels")
+        self.queries.execute("staged_panel_changes")
+        self.queries.execute("insert_staged_panel_items", (self.item_category_NGS_panel,))
+        self.queries.execute("staged_panel_item_keys", (self.item_category_NGS_panel,))
+        # deactivate the older versions, insert the panels and their pan numbers, then the genes
+        self.queries.execute("deactivate_staged_panels")
+        self.queries.execute("insert_staged_panels", (self.moka_user,))
+        self.queries.execute("staged_panel_keys")
+        self.queries.execute("set_staged_panel_codes")
+        self.queries.execute("insert_staged_panel_genes", (self.moka_user,))
+
+        # read back what was inserted for the summary and the check of the imported genes
+        genes = {}
+        for position, HGNCID, PanelApp_Symbol in self.queries.fetchall("staged_change_genes"):
+            genes.setdefault(position, []).append((str(HGNCID), str(PanelApp_Symbol)))
+        for position, previous_rank, item_key, ngspanel_key in self.queries.fetchall("staged_changes"):
+            panel = panels[position]
+            change = PanelChange(panel.panel_hash_colour, self.name_panel_colour(panel), panel.version, item_key,
+                                 previous_versions.get(previous_rank), genes.get(position, []), panel.genes)
+            change.ngspanel_key = ngspanel_key
+            changes.panels.append(change)
+        return changes
+
+    def check_imported(self, changes):
+        '''Check the genes in each panel of a ChangeSet were imported'''
+        with self.report.phase("check imported genes"):
+            self.reconciliation = Reconciliation(self.queries, self.translations, self.genes)
+            self.reconciliation.check_changes(changes)
+
+    def reconcile_database(self):
+        '''Check the genes of every active panel in the database against the API result. Returns the Reconciliation'''
+        # a change feed only has the panels which changed, so every other panel would be reported as not in the API
+        if not self.legacy_symbols_file() and is_change_feed(self.API_result):
+            raise Exception("%s is a change feed. Reconcile against a full API result" % self.API_result)
+        self.reconciliation = Reconciliation(self.queries, self.translations, self.genes)
+        self.reconciliation.check_database(self.read_api_result(), self.item_category_NGS_panel)
+        return self.reconciliation
+
+    def plan_changes(self):
+        '''Compare the API result with the panels in the database and return a ChangeSet of the panels to insert.
+        Nothing is written to the database'''
+        changes = ChangeSet()
+
+        # any versions in the API result which are not in the database need adding to the item table
+        changes.new_versions = sorted(version for version in self.versions_in_api if version not in self.version_keys)
+
+        # read the api query result one panel at a time
+        for panel in self.read_api_result():
+            self.plan_panel(panel, changes)
+        return changes
+
+    def plan_panel(self, panel, changes):
+        '''Add a PanelChange to changes if a panel colour (a PanelGenes) is new or a new version of a panel in the database'''
+        # skip any panels imported by an earlier run using the same journal
+        if self.journal and self.journal.done(panel.panel_hash_colour, panel.version):
+            changes.journalled.append(panel.panel_hash_colour)
+            return
+
+        version = panel.version
         
-        #loop through and extract required info
-        for panel in self.API_list:
-            # split - example line  = panelhash_Epidermolysis bullosa_0.8_amber:[list,of,ensemblids]
-            split1 = panel.split(':')
-            
-            # take everything before the colon and split on underscore
-            names = split1[0].split('_')
-            # panel hash is first item
-            panel_hash = str(names[0])
-            # panel name is second item removing any "'" from panel_name (messes up the sql query)
-            panel_name = str(names[1].replace("'",""))
-            # version in third item
-            version = str(names[2])
-            # panel colour is fourth item
-            colour = str(names[3])
-            
-            # define the unique panel identifier as panel hash _ panel colour - this is imported into item table and should be one of these for multiple versions
-            self.panel_hash_colour = panel_hash + "_" + colour
-            
-            # human readable panel name is panel name (Panel App Green v1.0) - this goes into ngspanel.panel
-            self.panel_name_colour = panel_name + " (Panel App " + colour + " v" + version + ")"
-            
-            # check if panel is already in the item table.
-            # convert to upper case as all keys in self.all_panels_in_db were converted to upper case when adding
-            if self.panel_hash_colour.upper() in self.all_panels_in_db:
-                # capture the itemid for that panel from the items table
-                # there may be two entries in the item table if there is Green and green - take the highest
-                # this will be stored in the category column in ngspanels table
-                self.fetch_key_qry = "select top 1 itemid from item where item = '" + self.panel_hash_colour + "' order by itemid desc"
-                self.panel_key = self.fetch_key()[0]
-
-            # if panel not in items table already insert it
-            else:               
-                # set insert query
-                self.insert_query_return_key = "insert into item(item,ItemCategoryIndex1ID) values ('%s',%s)" % (self.panel_hash_colour,self.item_category_NGS_panel)
-                # insert and capture the key (itemid)
-                self.panel_key=self.insert_query_return_key_function()[0]
-
-            #### Has the panel been updated?
-            # need to calculate if the version numbers have increased - 1.4 is < 1.10 (1 point four is less than 1 point 10)
-            # if directly compare numbers this would fail eg 1.102 < 1.2 where actually 1.102 is 100 releases higher
-            
-            # set default max_value at to -1
-            max_version = "-1.0"
-            
-            # if the panel exists in moka
-            if self.panel_hash_colour.upper() in self.all_panels_in_db:
-                # loop through all versions in the database for that panel
-                for db_version in self.all_panels_in_db[self.panel_hash_colour.upper()]:
-                    # set the major and minor release numbers (splitting on ".") for max_version and db version
-                    db_major_version = int(db_version.split(".")[0])
-                    db_minor_version = int(db_version.split(".")[1])
-                    max_major_version = int(max_version.split(".")[0])
-                    max_minor_version = int(max_version.split(".")[1])
-                    # if the db major version is higher than the current max major version then this version number is higher
-                    if db_major_version > max_major_version:
-                        max_version = db_version
-                    # if same major release but increased minor release eg 1.2 -> 1.102 change the version number
-                    elif db_major_version == max_major_version and db_minor_version > max_minor_version:
-                        max_version = db_version
-                    # else this version number is lower than a previously seen version
-                    else:
-                        pass
-
-            # To determine if the panel needs adding one of the below is true:
-            # max version = "-1.0" (the panel_hash_colour was not found in db). 
-            # the major version number has increased
-            # the major number is the same but minior version number has increased
-            if max_version == "-1.0" or int(version.split(".")[0]) > int(str(max_version).split(".")[0]) or int(version.split(".")[0]) == int(str(max_version).split(".")[0]) and int(version.split(".")[1]) > int(str(max_version).split(".")[1]):
-                # first, if it exists need to deactivate the existing panel(s)
-                self.insert_query = "update ngspanel set active = 0 where category in (select itemid from dbo.Item where item = '%s')" % self.panel_hash_colour
-                self.insert_query_function()
-                
-                # then get the itemid of the version 
-                self.select_qry = "select itemid from item where item  = '%s' and ItemCategoryIndex1ID = %s" % (version, self.VersionItemCategory)
-                self.select_qry_exception = "Cannot get key for version number"
-                version_key = self.select_query()
-                self.version_key = version_key[0][0]
-
-                # Insert the NGSpanel, returning the key 
-                self.insert_query_return_key = "insert into ngspanel(category, subcategory, panel, panelcode, active, checker1,checkdate,PanelType) values (%s,%s,'%s','Pan',1,%s,CURRENT_TIMESTAMP,2)" % (self.panel_key,self.version_key,self.panel_name_colour,self.moka_user) 
-                self.insert_query_exception = "cannot get the key when inserting panel %s" % (self.panel_name_colour)
-                key = self.insert_query_return_key_function()
-                self.inserted_panel_key = key[0]
-                
-                # update the table so the Pan number is created.
-                self.insert_query = "update NGSPanel set PanelCode = PanelCode+cast(NGSPanelID as VARCHAR) where NGSPanelID = %s" % self.inserted_panel_key
-                self.insert_query_function()
+        # define the unique panel identifier as panel hash _ panel colour - this is imported into item table and should be one of these for multiple versions
+        panel_hash_colour = panel.panel_hash_colour
+        
+        panel_name_colour = self.name_panel_colour(panel)
+
+        #### Has the panel been updated?
+        # the panel needs adding if it's not in the database or the API version is higher than any version in the database
+        # convert to upper case as all keys in self.max_version_in_db were converted to upper case when adding
+        max_version = self.max_version_in_db.get(panel_hash_colour.upper())
+        if max_version is None or PanelVersion(version) > max_version:
+            if max_version is None:
+                # a new panel is added to the item table when the changes are applied, unless an earlier import
+                # added it to the item table but stopped before inserting the panel
+                item_key = self.panel_item_keys.get(panel_hash_colour.upper())
+                previous_version = None
+            else:
+                item_key = self.panel_item_keys[panel_hash_colour.upper()]
+                previous_version = str(max_version)
+            # translate the genes now so the change set holds exactly what will be inserted
+            changes.panels.append(PanelChange(panel_hash_colour, panel_name_colour, version, item_key, previous_version,
+                                              self.gene_rows(panel.ensembl_ids), panel.genes))
 
-                # Call module to insert gene list to NGSPanelGenes.
-                self.add_genes_to_NGSPanelGenes(split1[1])
+        # if not a new version ignore
+        else:
+            pass
+
+    def name_panel_colour(self, panel):
+        '''The human readable name of a panel colour: panel name (Panel App Green v1.0) - this goes into ngspanel.panel'''
+        return panel.panel_name + " (Panel App " + panel.colour + " v" + panel.version + ")"
+
+    def apply_changes(self, changes):
+        '''Make the changes in a ChangeSet in a single transaction. If anything fails none of the changes are made.
+        If there is more than one worker, or a journal, the changes are made by apply_changes_in_partitions instead'''
+        if self.workers > 1 or self.journal:
+            return self.apply_changes_in_partitions(changes)
+        try:
+            self.insert_items(changes)
+            self.insert_panels(self.queries, changes.panels)
+            self.queries.commit()
+        except:
+            self.queries.rollback()
+            raise
+
+    def apply_changes_in_partitions(self, changes):
+        '''Make the changes in a ChangeSet in more than one transaction.
+        The items shared by panels are inserted and committed first, then the panels are split into a partition for each worker.
+        If there is more than one worker each has its own connection and inserts its partition in a single transaction - if a worker fails
+        its panels are not inserted, but the panels of the other workers are. With a journal each panel is inserted in its own transaction
+        and recorded in the journal once committed, so if a panel fails the rest are still inserted.
+        Any error is raised once all the panels have been tried'''
+        try:
+            self.insert_items(changes)
+            self.queries.commit()
+        except:
+            self.queries.rollback()
+            raise
+
+        # split the panels between the workers so each has about the same number of genes to insert
+        partitions = [[] for i in range(min(self.workers, len(changes.panels)))]
+        sizes = [0] * len(partitions)
+        for change in sorted(changes.panels, key=lambda change: -len(change.genes)):
+            smallest = sizes.index(min(sizes))
+            partitions[smallest].append(change)
+            sizes[smallest] += len(change.genes) + 1
+
+        if len(partitions) > 1:
+            pool = ThreadPool(len(partitions))
+            try:
+                results = pool.map(self.insert_partition, partitions)
+            finally:
+                pool.close()
+                pool.join()
+            # add the statement statistics of each worker to the totals
+            for stats, errors in results:
+                self.queries.add_stats(stats)
+        else:
+            # a single partition is inserted using the main connection
+            results = [self.insert_partition(partition, self.queries) for partition in partitions]
+
+        # raise the first error
+        errors = [error for stats, partition_errors in results for error in partition_errors]
+        if errors:
+            raise Exception("%s panels were not inserted. first error: %s" % (len(errors), errors[0]))
+
+    def insert_partition(self, panels, queries=None):
+        '''Insert a list of PanelChanges, using a new connection unless queries is given. Run by each worker.
+        Without a journal the panels are inserted in a single transaction. With a journal each panel is inserted in its own transaction
+        and recorded in the journal.
+        Returns the statement statistics and a list of an error for each panel that wasn't inserted'''
+        connection = queries is None
+        if connection:
+            try:
+                queries = MokaQueries(self.connect(), report=self.report)
+            except Exception as e:
+                return {}, ["%s: %s" % (change.panel_hash_colour, e) for change in panels]
+        # each unit is inserted in a single transaction
+        if self.journal:
+            units = [[change] for change in panels]
+        else:
+            units = [panels]
+        errors = []
+        try:
+            for unit in units:
+                try:
+                    self.insert_panels(queries, unit)
+                    queries.commit()
+                except Exception as e:
+                    queries.rollback()
+                    for change in unit:
+                        change.ngspanel_key = None
+                        errors.append("%s: %s" % (change.panel_hash_colour, e))
+                    continue
+                if self.journal:
+                    for change in unit:
+                        self.journal.record(change)
+        finally:
+            if connection:
+                queries.cnxn.close()
+        return queries.stats, errors
+
+    def insert_items(self, changes):
+        '''Insert the new version numbers and the panels not yet in the items table, capturing the keys (itemid). Doesn't commit'''
+        # add the new version numbers and the new panels to the item table together
+        item_rows = [(version, self.VersionItemCategory) for version in changes.new_versions]
+        new_items = [change for change in changes.panels if change.item_key is None]
+        item_rows += [(change.panel_hash_colour, self.item_category_NGS_panel) for change in new_items]
+        # version numbers and panel hash_colours can't be confused, so the new rows are matched by item
+        item_keys = dict((item, key) for key, item, category in self.queries.insert_return_keys("insert_items", item_rows))
+        for version in changes.new_versions:
+            self.version_keys[version] = item_keys[version]
+            self.versions_in_db.append(version)
+        for change in new_items:
+            change.item_key = item_keys[change.panel_hash_colour]
+
+    def insert_panels(self, queries, panels):
+        '''Insert a list of PanelChanges into NGSPanel and NGSPanelGenes using queries, deactivating any older versions. Doesn't commit.
+        All the state for each panel is held in its PanelChange so several lists can be inserted at once'''
+        # deactivate the existing panel(s) of panels with a new version
+        queries.executemany("deactivate_panel", [(change.panel_hash_colour,) for change in panels if not change.is_new])
+
+        # Insert the NGSpanels, capturing the keys. each panel has a different item (category) so the new rows are matched by category
+        panel_rows = [(change.item_key, self.version_keys[change.version], change.panel_name_colour, self.moka_user) for change in panels]
+        panel_keys = dict((category, key) for key, category in queries.insert_return_keys("insert_panels", panel_rows))
+        for change in panels:
+            change.ngspanel_key = panel_keys[change.item_key]
+        # create the Pan number, where the insert can't do it
+        queries.executemany("set_panel_code", [(change.ngspanel_key,) for change in panels])
+
+        # rows to insert into NGSPanelGenes
+        gene_rows = []
+        for change in panels:
+            for HGNCID, PanelApp_Symbol in change.genes:
+                gene_rows.append((change.ngspanel_key, HGNCID, PanelApp_Symbol, self.moka_user))
+
+        # insert the genes for all the panels together
+        queries.executemany("insert_panel_gene", gene_rows)
 
-            # if not a new version ignore
-            else:
-                pass
-    
     def add_genes_to_NGSPanelGenes(self, list_of_genes):
-        '''This module inserts the list of genes into the NGSGenePanel. The HGNC table is queried to find the symbol and HGNCID from the ensembl id'''
+        '''This module inserts the list of genes into the NGSGenePanel. The HGNC table is queried to find the symbol and HGNCID from the ensembl id.
+        All the ensembl ids in the panel are looked up together and the genes are inserted in one batch with a single commit.
+        list_of_genes is a list of ensembl ids for each gene, or the list as written in the original PanelAppOut.txt file'''
         # list of cleaned gene ids:
         list_of_genes_cleaned = []
 
-        # convert the string containing gene list into a python list
-        # split and remove all unwanted characters
-        for gene in list_of_genes.split(","):
-            gene = gene.replace("\"","").replace("[","").replace("]","").replace(" ","").rstrip()
-            # append to list
-            list_of_genes_cleaned.append(gene)
-
-        #loop through gene list
-        for ensbl_id in list_of_genes_cleaned:
-            if len(ensbl_id)>5:
-                # for each ensemblid get the HGNCID and PanelAppSymbol from use the hgnc translation table.
-                #set ignore flag to ignore exception
-                self.ignore = True
-                self.select_qry = "select HGNCID,PanelApp_Symbol from dbo.GenesHGNC_current_translation where EnsemblID_PanelApp = %s" % ensbl_id.replace("u","")
-                self.select_qry_exception = "%s: can't find the gene from ensembl_id: %s " %(self.panel_name_colour ,ensbl_id)
-                # if no result pass
-                gene_info = self.select_query()
-                if gene_info == self.notfound:
-                    pass
-                # if found a match import the row into NGSpanelGenes table
-                else:
-                    HGNCID = gene_info[0][0]
-                    PanelApp_Symbol = gene_info[0][1]
-                    
-                    # insert each gene into the NGSPanelGenes table
-                    self.insert_query = "insert into NGSPanelGenes(NGSPanelID,HGNCID,symbol,checker,checkdate) values (%s,'%s','%s',%s,CURRENT_TIMESTAMP)" % (self.inserted_panel_key, HGNCID, PanelApp_Symbol, self.moka_user)
-                    self.insert_query_exception = "can't insert gene into the NGSPanelGenes table"
-                    self.insert_query_function()
-        
-        #unset ignore variable
-        self.ignore=False
+        if isinstance(list_of_genes, basestring):
+            # convert the string containing gene list into a python list
+            # split and remove all unwanted characters, including the quotes around each ensembl id
+            for gene in list_of_genes.split(","):
+                gene = gene.replace("\"","").replace("[","").replace("]","").replace(" ","").rstrip().replace("u","").replace("'","")
+                # ignore anything too short to be an id
+                if len(gene)>3:
+                    # append to list
+                    list_of_genes_cleaned.append(gene)
+        else:
+            list_of_genes_cleaned = list_of_genes
+
+        # build a row for each gene found, in the order they appear in the panel
+        rows = []
+        for HGNCID, PanelApp_Symbol in self.gene_rows(list_of_genes_cleaned):
+            rows.append((self.inserted_panel_key, HGNCID, PanelApp_Symbol, self.moka_user))
+
+        # insert all the genes into the NGSPanelGenes table and commit once
+        if rows:
+            self.queries.executemany("insert_panel_gene", rows)
+            self.queries.commit()
         
         # Call module to insert any gene symbols which do not have an ensemblID in panel app, or in the HGNC_translation table.
         self.check_for_missing_genes()
+
+    def gene_rows(self, list_of_genes):
+        '''Translate a list of ensembl ids, or a list of ensembl ids for each gene, returning (HGNCID, PanelApp_Symbol) for each id found in the hgnc translation table.
+        A gene can have more than one ensembl id - each id is looked up. Any ensembl ids without a match in the translation table are ignored'''
+        ensembl_ids = []
+        for gene in list_of_genes:
+            if isinstance(gene, basestring):
+                ensembl_ids.append(gene)
+            else:
+                ensembl_ids.extend(gene)
+
+        # for each ensemblid get the HGNCID and PanelAppSymbol from use the hgnc translation table.
+        gene_info = self.lookup_ensembl_ids(ensembl_ids)
+        return [gene_info[ensbl_id] for ensbl_id in ensembl_ids if ensbl_id in gene_info]
+
+    def lookup_ensembl_ids(self, ensembl_ids):
+        '''Look up a list of ensembl ids in the hgnc translation index.
+        Returns a dictionary of ensembl id: (HGNCID, PanelApp_Symbol). If an id matches more than one row the first by HGNCID and PanelApp_Symbol is used'''
+        return self.translations.lookup(ensembl_ids)
+
+    def load_translations(self):
+        '''Read the hgnc translation table into memory so genes don't need to be looked up in the database for each panel'''
+        self.translations.load()
     
     def check_for_missing_genes(self):
         """
         Compare the genes that were imported to the database with those in the api symbols list
         """
-        # pull out all the PanelApp gene symbols for the genes in that panel
-        self.select_qry = "select PanelApp_Symbol from dbo.GenesHGNC_current_translation, ngspanelgenes, dbo.NGSPanel where NGSPanel.NGSPanelID = NGSPanelGenes.NGSPanelID and NGSPanelGenes.HGNCID=GenesHGNC_current_translation.HGNCID and Panel = '%s'" % self.panel_name_colour
+        # pull out the HGNCIDs of all the genes in that panel
         self.select_qry_exception = "Cannot find the genes in this panel:%s. This is probably because the ensembl ID is missing for this panel in the panelapp out file. Copy the ensembl id from the HGNC snapshot table." % self.panel_name_colour
-        imported_genes = self.select_query()
+        imported_genes = self.select_query("panel_gene_hgncids", (self.panel_name_colour,))
                 
-        # create and populate list to hold symbols
-        db_list = []
-        # lop through the select query reponse
-        for gene in imported_genes:
-            # add the gene symbol to the list
-            db_list.append(str(gene[0]))
+        # use the translation index to get the PanelApp gene symbols for these genes
+        db_list = sorted(self.translations.symbols_for_hgncids([gene[0] for gene in imported_genes]))
+        # the gene symbols for this panel in the api result (a gene without a symbol is only possible from a hand edited file)
+        api_list = [symbol for symbol in self.genes.symbols_of(self.API_symbols[self.panel_hash_colour]) if symbol]
+        # sets of each list for the comparisons
+        api_set = set(api_list)
+        db_set = set(db_list)
         
         # create a list to populate with error messages to print
         to_print = []
@@ -352,16 +668,16 @@ class insert_PanelApp:
         
         # assess if any symbols from the api aren't in moka
         # loop through the genes for this panel from the dictionary populated from the api symbol list
-        for api_gene in self.API_symbols[self.panel_hash_colour]:
+        for api_gene in api_list:
             # if the gene symbol is not in the list of gene symbols
-            if api_gene not in db_list:
+            if api_gene not in db_set:
                 # add the error statement to the list
                 to_print.append(api_gene + " missing from moka. is there a ensembl ID for this gene?")
         
         # check if there are any symbols imported to Moka that aren't present in the API
         for db_gene in db_list:
             # if this gene symbol not in the API list
-            if db_gene not in self.API_symbols[self.panel_hash_colour]:
+            if db_gene not in api_set:
                 # add the error statement to the list
                 to_print.append(db_gene + " imported to moka but symbol not in API. is there a errant ensembl ID in the api? (look if the panelapp_ensemblid in moka for this gene is in the API)")
         
@@ -379,41 +695,14 @@ class insert_PanelApp:
         This check uses a selection of manually curated genes (defined as PanelAppGeneSymbolCheck is not null).
         Any that are missing are reported and may need manual curation in the future
         '''
-        # open and parse the text file containing the api query result
-        with open(self.API_symbol_result, 'r') as API_symbol_file:
-            for line in API_symbol_file.readlines():
-                # split - example line  = panelhash_Epidermolysis bullosa_0.8_amber:[list,of,genesymbols]
-                splitline = line.split(':')
-                # everything before the colon
-                names = splitline[0].split('_')
-                # panelhash
-                panel_hash = names[0]
-                # panel name
-                panel_name = names[1].replace("'","")# removing any "'" from panel_name (messes up the sql query)
-                # version number
-                version = names[2]
-                # colour
-                colour = names[3]
-                # panel hash colour 
-                panel_hash_colour = panel_hash + "_" + colour
-                #rebuild the panelapp name
-                panel_name_colour = panel_name + " (Panel App " + colour + " v" + str(version) + ")"
-                
-                # create a entry in the dictionary with the panel hash with empty list as value
-                self.API_symbols[panel_hash_colour] = []
-                # create a list of the symbols after the colon (splitting on ',')
-                genes = splitline[1].split(',')
-                # loop through list
-                for gene in genes:
-                    # remove all unwanted characters
-                    gene = gene.replace("[","").replace("'","").replace("[","").replace("'","").replace("]","").replace(" ","").replace("\n","").rstrip()
-                    # append the gene symbol to the list
-                    self.API_symbols[panel_hash_colour].append(gene)
-
-    def fetch_key(self):
+        # read the symbols for each panel colour from the API result
+        for panel in self.read_api_result():
+            self.API_symbols[panel.panel_hash_colour] = panel.genes
+
+    def fetch_key(self, statement, params=()):
         '''This function is called to retrieve a single entry from a select query'''
         # Perform query and fetch one
-        result = self.cursor.execute(self.fetch_key_qry).fetchone()
+        result = self.queries.fetchone(statement, params)
 
         # return result
         if result:
@@ -421,10 +710,10 @@ class insert_PanelApp:
         else:
             raise Exception(self.exception_message)
 
-    def select_query(self):
+    def select_query(self, statement, params=()):
         '''This function is called to retrieve the whole result of a select query '''
         # Perform query and fetch all
-        result = self.cursor.execute(self.select_qry).fetchall()
+        result = self.queries.fetchall(statement, params)
 
         # return result
         if result:
@@ -434,34 +723,104 @@ class insert_PanelApp:
         else:
             raise Exception(self.select_qry_exception)
 
-    def insert_query_function(self):
+    def insert_query_function(self, statement, params=()):
         '''This function executes an insert query'''
         # execute the insert query
-        self.cursor.execute(self.insert_query)
-        self.cursor.commit()
+        self.queries.execute(statement, params)
+        self.queries.commit()
+
+    def insert_query_return_keys_function(self, statement, rows):
+        '''This function inserts rows and returns the rows output by the insert statement, which include the key of each new row.
+        The key is returned by the insert itself, so there is no separate query for it'''
+        # Perform insert query and return the output for the new rows
+        output = self.queries.insert_return_keys(statement, rows)
+        self.queries.commit()
 
-    def insert_query_return_key_function(self):
-        '''This function executes an insert query and returns the key of the newly created row'''
-        # Perform insert query and return the key for the row
-        self.cursor.execute(self.insert_query_return_key)
-        self.cursor.commit()
-        #capture key
-        self.cursor.execute("SELECT @@IDENTITY")
-        key = self.cursor.fetchone()
- 
         # return result
-        if key:
-            return(key)
+        if output:
+            return(output)
         elif self.ignore:
             return(self.notfound)
         else:
             raise Exception(self.insert_query_exception)
 
+    def insert_query_return_key_function(self, statement, params=()):
+        '''This function executes an insert query and returns the key of the newly created row'''
+        output = self.insert_query_return_keys_function(statement, [params])
+        if output == self.notfound:
+            return(output)
+        return(output[0][0])
+
 
 if __name__ == "__main__":
-    a = insert_PanelApp()
-    a.populate_api_symbols_dict()
-    a.check_item_category_table()
-    a.get_list_of_versions()
-    a.all_existing_panels()
-    a.parse_PanelAPP_API_result()
+    parser = argparse.ArgumentParser(description="Import the PanelApp API result into Moka")
+    parser.add_argument("--api-result", help="the PanelAppOut.jsonl file to import, a PanelAppChanges.jsonl change feed, or a PanelAppOut.txt file from the original output")
+    parser.add_argument("--api-symbols", help="the PanelAppOut_symbols.txt file to use with a PanelAppOut.txt file")
+    parser.add_argument("--dry-run", action="store_true", help="print the changes that would be made to moka without making them")
+    parser.add_argument("--query-stats", action="store_true", help="print the number of times each statement was run and the time taken")
+    parser.add_argument("--reconcile", action="store_true", help="check every active panel in moka against the API result, without importing")
+    parser.add_argument("--report", help="write the discrepancies between moka and the API result to this file (.csv or .json) rather than printing them")
+    parser.add_argument("--workers", type=int, default=1, help="number of workers inserting panels at the same time, each with its own connection (default: 1)")
+    parser.add_argument("--bulk", action="store_true", help="copy the API result into staging tables and make the changes with set based statements in the database")
+    parser.add_argument("--journal", help="record each panel imported in this file, committing each panel separately. if the import is interrupted run it again with the same journal to resume")
+    parser.add_argument("--max-translations", type=int, help="the most rows of the hgnc translation table to hold in memory. by default the whole table is loaded")
+    parser.add_argument("--run-report", help="time each phase and statement and write a json run report to this file")
+    parser.add_argument("--profile", help="profile the import and write the functions taking the most time to this file")
+    parser.add_argument("--profiler", choices=["cprofile", "pyinstrument"], default="cprofile", help="the profiler used by --profile (default: cprofile)")
+    args = parser.parse_args()
+    if args.bulk and (args.dry_run or args.reconcile or args.journal or args.workers > 1):
+        parser.error("--bulk can't be used with --dry-run, --reconcile, --journal or --workers")
+
+    report = RunReport("insert_to_moka.py", enabled=bool(args.run_report))
+    profiler = Profiler(args.profile, args.profiler) if args.profile else None
+    a = insert_PanelApp(max_translations=args.max_translations, workers=args.workers, journal_path=args.journal, report=report)
+    if profiler:
+        profiler.start()
+    try:
+        if args.api_result:
+            a.API_result = args.api_result
+        if args.api_symbols:
+            a.API_symbol_result = args.api_symbols
+        with report.phase("load translations"):
+            a.load_translations()
+        if args.reconcile:
+            with report.phase("reconcile database"):
+                a.reconcile_database()
+        else:
+            if not args.dry_run:
+                a.check_item_category_table()
+            if args.bulk:
+                # the panels in moka are compared with the API result in the database
+                with report.phase("read versions"):
+                    a.load_versions()
+                print a.bulk_load().report().splitlines()[0]
+            else:
+                with report.phase("read versions"):
+                    a.get_list_of_versions()
+                with report.phase("read existing panels"):
+                    a.all_existing_panels()
+                if args.dry_run:
+                    with report.phase("plan changes"):
+                        changes = a.plan_changes()
+                    print changes.report()
+                else:
+                    a.parse_PanelAPP_API_result()
+    finally:
+        if profiler:
+            profiler.stop()
+        # the journal is closed even if the import fails, so every recorded line is on disk
+        if a.journal:
+            a.journal.close()
+    if a.journal:
+        print a.journal.summary()
+    if a.reconciliation:
+        print a.reconciliation.summary()
+        if args.report:
+            a.reconciliation.write(args.report)
+        elif a.reconciliation.discrepancies:
+            print a.reconciliation.table()
+    if args.query_stats:
+        print a.queries.report()
+    if args.run_report:
+        report.write(args.run_report)
+        print report.summary()
@@ -0,0 +1,63 @@
+'''
+Incremental decoding of a large array in a json document, one item at a time.
+
+Used by ReadPanelApp.py to read the genes in a get_panel response as the response is downloaded,
+rather than loading the whole response and then decoding it.
+'''
+
+import json
+import re
+
+decoder = json.JSONDecoder()
+# whitespace and the commas between the items of an array
+SEPARATOR = re.compile(r"[\s,]*")
+# characters of the document kept when searching for the start of the array, in case the key is split between chunks
+SEARCH_OVERLAP = 1024
+
+
+def iter_array(chunks, key):
+    '''Generator yielding each decoded item of the array named key in a json document given as an iterable of chunks of text.
+    Only the item being decoded is held in memory, not the whole document. The array used is the first one with this key.
+    Once the array ends the rest of the chunks are read (and ignored), so a response body is downloaded in full and can be cached'''
+    chunks = iter(chunks)
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+
+    # read until the start of the array is found
+    buffer = ""
+    match = None
+    while match is None:
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("no %s array in json document" % key)
+        buffer = buffer[-SEARCH_OVERLAP:] + chunk
+        match = start.search(buffer)
+
+    position = match.end()
+    # True once all the chunks have been read
+    finished = False
+    while True:
+        position = SEPARATOR.match(buffer, position).end()
+        if buffer[position:position + 1] == "]":
+            for chunk in chunks:
+                pass
+            return
+        try:
+            if position == len(buffer):
+                raise ValueError("no item")
+            item, end = decoder.raw_decode(buffer, position)
+            # an item ending at the end of the buffer (eg a number) may continue in the next chunk
+            if end == len(buffer) and not finished:
+                raise ValueError("item may be incomplete")
+        except ValueError:
+            # the item isn't complete - add the next chunk to the buffer, dropping the items already decoded
+            if finished:
+                raise ValueError("%s array is incomplete or not valid json" % key)
+            chunk = next(chunks, None)
+            if chunk is None:
+                finished = True
+            else:
+                buffer = buffer[position:] + chunk
+                position = 0
+            continue
+        yield item
+        position = end
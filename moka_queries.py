@@ -0,0 +1,302 @@
+'''
+The statements insert_to_moka.py runs against Moka, kept in one place and run with bound parameters.
+
+Each statement has a name and is written with ? placeholders, so the statement text is the same for every
+panel and gene and the server can reuse its plan. Each statement is run on its own cursor; pyodbc keeps the
+last statement a cursor prepared, so running the same statement again reuses the prepared handle.
+
+Inserts return the keys of the new rows from the insert statement itself (OUTPUT INSERTED on sql server,
+RETURNING on SQLite), and can insert many rows in one statement.
+
+A statement can have a different version for SQLite, which is used in place of Moka for testing.
+The bulk load (insert_to_moka.py --bulk) stages the API result in temporary tables and merges it into Moka with set based
+statements. Their names are written as {temp}StagedPanel, which is #StagedPanel on sql server and StagedPanel on SQLite.
+The number of times each statement is run and the time taken are recorded, and each run is added to the latency
+histogram of the statement in the RunReport, if one is given.
+'''
+
+import sqlite3
+import time
+
+from run_report import RunReport
+
+# statements used by insert_PanelApp. a dictionary gives the sql server ("mssql") and sqlite versions of a statement
+STATEMENTS = {
+    # item categories
+    "item_categories": "select itemcategory from itemcategory",
+    "insert_item_category": "Insert into Itemcategory(itemcategory) values (?)",
+    "item_category_key": "select ItemCategoryID from ItemCategory where ItemCategory = ?",
+    # items - panel versions and panel hash_colours
+    "items_in_category": "select Item, ItemID from item where itemcategoryindex1ID = ?",
+    # {rows} is replaced by a (?,?) for each row. returns the key, item and category of each new row
+    "insert_items": {
+        "mssql": "insert into Item(Item,ItemCategoryIndex1ID) OUTPUT INSERTED.ItemID, INSERTED.Item, INSERTED.ItemCategoryIndex1ID values {rows}",
+        "sqlite": "insert into Item(Item,ItemCategoryIndex1ID) values {rows} returning ItemID, Item, ItemCategoryIndex1ID",
+    },
+    "panel_versions": "select ItemA.item, ItemB.item from Item itemA, Item ItemB, NGSPanel where ItemA.ItemID=dbo.NGSPanel.Category and ItemB.itemID = dbo.NGSPanel.subCategory and itemA.ItemCategoryIndex1ID = ? and itemB.ItemCategoryIndex1ID = ?",
+    # panels
+    "deactivate_panel": "update ngspanel set active = 0 where category in (select itemid from dbo.Item where item = ?)",
+    # {rows} is replaced by a (?,?,?,?) for each row. returns the key and category of each new row.
+    # on sql server the PanelCode (Pan + the key) is set in the same batch; sqlite can't run a batch so uses set_panel_code
+    "insert_panels": {
+        "mssql": "SET NOCOUNT ON; "
+                 "declare @keys table (NGSPanelID int, Category int); "
+                 "insert into ngspanel(category, subcategory, panel, panelcode, active, checker1,checkdate,PanelType) OUTPUT INSERTED.NGSPanelID, INSERTED.Category into @keys "
+                 "select category, subcategory, panel, 'Pan', 1, checker1, CURRENT_TIMESTAMP, 2 from (values {rows}) as new(category, subcategory, panel, checker1); "
+                 "update NGSPanel set PanelCode = 'Pan'+cast(NGSPanel.NGSPanelID as VARCHAR) from NGSPanel join @keys k on NGSPanel.NGSPanelID = k.NGSPanelID; "
+                 "select NGSPanelID, Category from @keys",
+        "sqlite": "insert into ngspanel(category, subcategory, panel, panelcode, active, checker1,checkdate,PanelType) "
+                  "select column1, column2, column3, 'Pan', 1, column4, CURRENT_TIMESTAMP, 2 from (values {rows}) returning NGSPanelID, Category",
+    },
+    "set_panel_code": {
+        "mssql": None,
+        "sqlite": "update NGSPanel set PanelCode = 'Pan'||NGSPanelID where NGSPanelID = ?",
+    },
+    # genes
+    "insert_panel_gene": "insert into NGSPanelGenes(NGSPanelID,HGNCID,symbol,checker,checkdate) values (?,?,?,?,CURRENT_TIMESTAMP)",
+    "panel_gene_hgncids": "select NGSPanelGenes.HGNCID from ngspanelgenes, dbo.NGSPanel where NGSPanel.NGSPanelID = NGSPanelGenes.NGSPanelID and Panel = ?",
+    # reconciliation. {values} is replaced by a placeholder for each NGSPanelID in a batch
+    "panel_gene_hgncids_by_panel": "select NGSPanelID, HGNCID from dbo.NGSPanelGenes where NGSPanelID in ({values})",
+    "active_panel_genes": "select NGSPanel.NGSPanelID, Panel.Item, Version.Item, NGSPanel.Panel, NGSPanelGenes.HGNCID from dbo.NGSPanel "
+                          "join dbo.Item Panel on Panel.ItemID = NGSPanel.Category join dbo.Item Version on Version.ItemID = NGSPanel.SubCategory "
+                          "left join dbo.NGSPanelGenes on NGSPanelGenes.NGSPanelID = NGSPanel.NGSPanelID "
+                          "where NGSPanel.Active = 1 and Panel.ItemCategoryIndex1ID = ?",
+    # hgnc translation table. {values} is replaced by a placeholder for each value in a batch.
+    # an ensembl id in more than one row is translated with the first row ordered by HGNCID and PanelApp_Symbol (the table has no
+    # key column), so every way of translating it, including the bulk load, picks the same row whatever order the server returns
+    "translation_count": "select count(*) from dbo.GenesHGNC_current_translation",
+    "translations": "select EnsemblID_PanelApp,HGNCID,PanelApp_Symbol from dbo.GenesHGNC_current_translation order by HGNCID, PanelApp_Symbol",
+    "translations_by_ensembl_id": "select EnsemblID_PanelApp,HGNCID,PanelApp_Symbol from dbo.GenesHGNC_current_translation where EnsemblID_PanelApp in ({values}) "
+                                  "order by HGNCID, PanelApp_Symbol",
+    "translations_by_hgncid": "select EnsemblID_PanelApp,HGNCID,PanelApp_Symbol from dbo.GenesHGNC_current_translation where HGNCID in ({values})",
+    # bulk load. the staging tables: each panel colour in the API result (with the plan for it filled in by the merge),
+    # each ensembl id of its genes, each version number (ranked in release order), and each panel already in moka.
+    # on sql server the text columns use the database's collation so they can be compared with the moka tables
+    "create_StagedPanel": {
+        "mssql": "create table #StagedPanel (Position int primary key, PanelHashColour varchar(255) collate database_default, "
+                 "PanelKey varchar(255) collate database_default, PanelName nvarchar(max), Version varchar(50) collate database_default, "
+                 "PreviousRank int, Changed int, ItemKey int, NGSPanelID int)",
+        "sqlite": "create temp table StagedPanel (Position integer primary key, PanelHashColour text, PanelKey text, PanelName text, Version text, "
+                  "PreviousRank integer, Changed integer, ItemKey integer, NGSPanelID integer)",
+    },
+    "create_StagedGene": {
+        "mssql": "create table #StagedGene (Ordinal int primary key, Position int, EnsemblID varchar(255) collate database_default)",
+        "sqlite": "create temp table StagedGene (Ordinal integer primary key, Position integer, EnsemblID text)",
+    },
+    "create_StagedVersion": {
+        "mssql": "create table #StagedVersion (Version varchar(50) collate database_default primary key, Rank int, InApi int, Position int, ItemID int)",
+        "sqlite": "create temp table StagedVersion (Version text primary key, Rank integer, InApi integer, Position integer, ItemID integer)",
+    },
+    "create_StagedExisting": {
+        "mssql": "create table #StagedExisting (PanelKey varchar(255) collate database_default primary key, ItemID int, Rank int)",
+        "sqlite": "create temp table StagedExisting (PanelKey text primary key, ItemID integer, Rank integer)",
+    },
+    "stage_panels": "insert into {temp}StagedPanel(Position, PanelHashColour, PanelKey, PanelName, Version) values (?,?,?,?,?)",
+    "stage_genes": "insert into {temp}StagedGene(Ordinal, Position, EnsemblID) values (?,?,?)",
+    "stage_versions": "insert into {temp}StagedVersion(Version, Rank, InApi, Position) values (?,?,?,?)",
+    # the itemid of each version number already in moka. the version numbers in the API result which aren't are inserted
+    "staged_version_keys": "update {temp}StagedVersion set ItemID = (select max(ItemID) from dbo.Item where ItemCategoryIndex1ID = ? and Item = {temp}StagedVersion.Version)",
+    "staged_new_versions": "select Version from {temp}StagedVersion where InApi = 1 and ItemID is null order by Position",
+    "insert_staged_versions": "insert into Item(Item,ItemCategoryIndex1ID) select Version, ? from {temp}StagedVersion where InApi = 1 and ItemID is null order by Position",
+    # the highest itemid and the highest version of each panel hash_colour (in upper case) in moka
+    "stage_existing_panels": "insert into {temp}StagedExisting(PanelKey, ItemID, Rank) select upper(Panel.Item), max(Panel.ItemID), max(Staged.Rank) from dbo.Item Panel "
+                             "left join dbo.NGSPanel on NGSPanel.Category = Panel.ItemID "
+                             "left join dbo.Item Version on Version.ItemID = NGSPanel.SubCategory and Version.ItemCategoryIndex1ID = ? "
+                             "left join {temp}StagedVersion Staged on Staged.Version = Version.Item "
+                             "where Panel.ItemCategoryIndex1ID = ? group by upper(Panel.Item)",
+    # a panel colour is inserted if it isn't in moka or its version is higher than any version in moka
+    "plan_staged_panels": "update {temp}StagedPanel set "
+                          "PreviousRank = (select Rank from {temp}StagedExisting Existing where Existing.PanelKey = {temp}StagedPanel.PanelKey), "
+                          "ItemKey = (select ItemID from {temp}StagedExisting Existing where Existing.PanelKey = {temp}StagedPanel.PanelKey)",
+    "staged_panel_changes": "update {temp}StagedPanel set Changed = 1 where PreviousRank is null "
+                            "or PreviousRank < (select Rank from {temp}StagedVersion Staged where Staged.Version = {temp}StagedPanel.Version)",
+    "insert_staged_panel_items": "insert into Item(Item,ItemCategoryIndex1ID) select PanelHashColour, ? from {temp}StagedPanel where Changed = 1 and ItemKey is null order by Position",
+    "staged_panel_item_keys": {
+        "mssql": "update Staged set ItemKey = Items.ItemID from #StagedPanel Staged "
+                 "join (select Item, max(ItemID) as ItemID from dbo.Item where ItemCategoryIndex1ID = ? group by Item) Items on Items.Item = Staged.PanelHashColour "
+                 "where Staged.Changed = 1 and Staged.ItemKey is null",
+        "sqlite": "update StagedPanel set ItemKey = Items.ItemID "
+                  "from (select Item, max(ItemID) as ItemID from dbo.Item where ItemCategoryIndex1ID = ? group by Item) Items "
+                  "where Items.Item = StagedPanel.PanelHashColour and StagedPanel.Changed = 1 and StagedPanel.ItemKey is null",
+    },
+    "deactivate_staged_panels": "update ngspanel set active = 0 where category in (select Item.itemid from dbo.Item "
+                                "join {temp}StagedPanel Staged on Staged.PanelHashColour = Item.Item where Staged.Changed = 1 and Staged.PreviousRank is not null)",
+    "insert_staged_panels": "insert into ngspanel(category, subcategory, panel, panelcode, active, checker1,checkdate,PanelType) "
+                            "select Staged.ItemKey, Version.ItemID, Staged.PanelName, 'Pan', 1, ?, CURRENT_TIMESTAMP, 2 from {temp}StagedPanel Staged "
+                            "join {temp}StagedVersion Version on Version.Version = Staged.Version where Staged.Changed = 1 order by Staged.Position",
+    "staged_panel_keys": {
+        "mssql": "update Staged set NGSPanelID = Panels.NGSPanelID from #StagedPanel Staged "
+                 "join (select Category, max(NGSPanelID) as NGSPanelID from dbo.NGSPanel group by Category) Panels on Panels.Category = Staged.ItemKey "
+                 "where Staged.Changed = 1",
+        "sqlite": "update StagedPanel set NGSPanelID = Panels.NGSPanelID "
+                  "from (select Category, max(NGSPanelID) as NGSPanelID from dbo.NGSPanel group by Category) Panels "
+                  "where Panels.Category = StagedPanel.ItemKey and StagedPanel.Changed = 1",
+    },
+    "set_staged_panel_codes": {
+        "mssql": "update NGSPanel set PanelCode = 'Pan'+cast(NGSPanel.NGSPanelID as VARCHAR) from NGSPanel join #StagedPanel Staged on Staged.NGSPanelID = NGSPanel.NGSPanelID",
+        "sqlite": "update NGSPanel set PanelCode = 'Pan'||NGSPanelID where NGSPanelID in (select NGSPanelID from StagedPanel where Changed = 1)",
+    },
+    # each ensembl id is translated with its first row ordered by HGNCID and PanelApp_Symbol, as by the translation index
+    "insert_staged_panel_genes": {
+        "mssql": "insert into NGSPanelGenes(NGSPanelID,HGNCID,symbol,checker,checkdate) "
+                 "select Staged.NGSPanelID, Translation.HGNCID, Translation.PanelApp_Symbol, ?, CURRENT_TIMESTAMP from #StagedGene Gene "
+                 "join #StagedPanel Staged on Staged.Position = Gene.Position "
+                 "join (select EnsemblID_PanelApp, HGNCID, PanelApp_Symbol, row_number() over (partition by EnsemblID_PanelApp order by HGNCID, PanelApp_Symbol) as TranslationRow "
+                 "from dbo.GenesHGNC_current_translation) Translation on Translation.EnsemblID_PanelApp = Gene.EnsemblID and Translation.TranslationRow = 1 "
+                 "where Staged.Changed = 1 order by Gene.Ordinal",
+        "sqlite": "insert into NGSPanelGenes(NGSPanelID,HGNCID,symbol,checker,checkdate) "
+                  "select Staged.NGSPanelID, Translation.HGNCID, Translation.PanelApp_Symbol, ?, CURRENT_TIMESTAMP from StagedGene Gene "
+                  "join StagedPanel Staged on Staged.Position = Gene.Position "
+                  "join dbo.GenesHGNC_current_translation Translation on Translation.EnsemblID_PanelApp = Gene.EnsemblID "
+                  "where Staged.Changed = 1 and Translation.rowid = (select rowid from dbo.GenesHGNC_current_translation where EnsemblID_PanelApp = Gene.EnsemblID "
+                  "order by HGNCID, PanelApp_Symbol limit 1) "
+                  "order by Gene.Ordinal",
+    },
+    # the panels inserted, and their genes
+    "staged_changes": "select Position, PreviousRank, ItemKey, NGSPanelID from {temp}StagedPanel where Changed = 1 order by Position",
+    "staged_change_genes": "select Staged.Position, NGSPanelGenes.HGNCID, NGSPanelGenes.Symbol from {temp}StagedPanel Staged "
+                           "join dbo.NGSPanelGenes on NGSPanelGenes.NGSPanelID = Staged.NGSPanelID where Staged.Changed = 1 order by NGSPanelGenes.NGSPanelGeneID",
+}
+
+# the staging tables of the bulk load, created by create_<table> and dropped once it has finished
+STAGING_TABLES = ["StagedPanel", "StagedGene", "StagedVersion", "StagedExisting"]
+for table in STAGING_TABLES:
+    STATEMENTS["drop_" + table] = "drop table {temp}" + table
+
+# the prefix of the name of a temporary table
+TEMP_TABLE_PREFIX = {"mssql": "#", "sqlite": ""}
+
+# the most parameters sql server accepts in one statement, and the most rows in a values list
+MAX_PARAMETERS = 2000
+MAX_ROWS = 1000
+
+
+class MokaQueries():
+    '''Runs the named statements on a database connection, recording how often each is run and how long it takes'''
+
+    def __init__(self, cnxn, dialect=None, report=None):
+        self.cnxn = cnxn
+        # "sqlite" for an sqlite connection, otherwise "mssql"
+        self.dialect = dialect or ("sqlite" if isinstance(cnxn, sqlite3.Connection) else "mssql")
+        # a cursor for each statement, so prepared statements are reused
+        self.cursors = {}
+        # statement name: [number of times run, total seconds]
+        self.stats = {}
+        # timings for the run report. nothing is recorded unless a report is given
+        self.run_report = report or RunReport("moka_queries", enabled=False)
+
+    def sql(self, name, values=0, rows=0, columns=0):
+        '''The text of a statement, or None if the statement isn't needed in this dialect.
+        For statements taking a list of values, values is the number of placeholders to use.
+        For inserts of many rows, rows is the number of rows and columns the number of values in each'''
+        statement = STATEMENTS[name]
+        if isinstance(statement, dict):
+            statement = statement[self.dialect]
+        if statement is not None:
+            statement = statement.replace("{temp}", TEMP_TABLE_PREFIX[self.dialect])
+        if values:
+            statement = statement.replace("{values}", ",".join("?" * values))
+        if rows:
+            statement = statement.replace("{rows}", ",".join(["(" + ",".join("?" * columns) + ")"] * rows))
+        return statement
+
+    def cursor(self, name):
+        '''The cursor used for a statement'''
+        if name not in self.cursors:
+            cursor = self.cnxn.cursor()
+            # send executemany parameters to sql server in a single batch rather than a round trip per row
+            if hasattr(cursor, "fast_executemany"):
+                cursor.fast_executemany = True
+            self.cursors[name] = cursor
+        return self.cursors[name]
+
+    def record(self, name, start):
+        '''Add a run of a statement to the statistics'''
+        seconds = time.time() - start
+        stat = self.stats.setdefault(name, [0, 0.0])
+        stat[0] += 1
+        stat[1] += seconds
+        self.run_report.record("sql " + name, seconds)
+
+    def execute(self, name, params=()):
+        '''Run a statement with bound parameters, returning the cursor'''
+        if self.sql(name) is None:
+            return
+        start = time.time()
+        cursor = self.cursor(name)
+        cursor.execute(self.sql(name), params)
+        self.record(name, start)
+        return cursor
+
+    def fetchone(self, name, params=()):
+        start = time.time()
+        row = self.cursor(name).execute(self.sql(name), params).fetchone()
+        self.record(name, start)
+        return row
+
+    def fetchall(self, name, params=()):
+        start = time.time()
+        rows = self.cursor(name).execute(self.sql(name), params).fetchall()
+        self.record(name, start)
+        return rows
+
+    def executemany(self, name, rows):
+        '''Run a statement once for each row of parameters'''
+        if not rows or self.sql(name) is None:
+            return
+        start = time.time()
+        self.cursor(name).executemany(self.sql(name), rows)
+        self.record(name, start)
+
+    def fetchall_in(self, name, values, batch_size):
+        '''Run a statement taking a list of values in batches of batch_size, returning all the rows.
+        The last batch is padded by repeating its last value so every batch uses the same statement text'''
+        rows = []
+        values = list(values)
+        for i in range(0, len(values), batch_size):
+            batch = values[i:i + batch_size]
+            batch += batch[-1:] * (batch_size - len(batch))
+            start = time.time()
+            rows.extend(self.cursor(name).execute(self.sql(name, batch_size), batch).fetchall())
+            self.record(name, start)
+        return rows
+
+    def insert_return_keys(self, name, rows):
+        '''Insert rows using a statement with a {rows} placeholder, as few statements as possible.
+        Returns the rows the statement outputs for the new rows, which include the key of each.
+        The order of the output isn't guaranteed to match the order of rows, so it includes columns to match them by'''
+        output = []
+        if not rows:
+            return output
+        columns = len(rows[0])
+        batch_size = min(MAX_ROWS, MAX_PARAMETERS // columns)
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            start = time.time()
+            output.extend(self.cursor(name).execute(self.sql(name, rows=len(batch), columns=columns), [value for row in batch for value in row]).fetchall())
+            self.record(name, start)
+        return output
+
+    def insert_return_key(self, name, params=()):
+        '''Insert a single row using a statement with a {rows} placeholder and return its key'''
+        return self.insert_return_keys(name, [params])[0][0]
+
+    def add_stats(self, stats):
+        '''Add the statistics of another MokaQueries, eg one used by a worker with its own connection'''
+        for name, (count, seconds) in stats.items():
+            stat = self.stats.setdefault(name, [0, 0.0])
+            stat[0] += count
+            stat[1] += seconds
+
+    def commit(self):
+        self.cnxn.commit()
+
+    def rollback(self):
+        self.cnxn.rollback()
+
+    def report(self):
+        '''A table of the number of times each statement was run and the time taken'''
+        lines = ["%-28s %10s %10s %10s" % ("statement", "count", "seconds", "ms each")]
+        for name, (count, seconds) in sorted(self.stats.items(), key=lambda stat: -stat[1][1]):
+            lines.append("%-28s %10d %10.3f %10.3f" % (name, count, seconds, seconds * 1000 / count))
+        return "\n".join(lines)
@@ -0,0 +1,224 @@
+'''
+Harvest several PanelApp instances (eg Genomics England and PanelApp Australia) at the same time into one merged result.
+
+The sources are listed in a json file. Each source is harvested by its own PanelAPP_API, in its own thread, with its own
+web services, number of workers and rate limit, so a slow or rate limited instance doesn't hold up the others:
+
+[
+ {"name": "england", "base_url": "https://panelapp.genomicsengland.co.uk", "namespace": "", "workers": 4},
+ {"name": "australia", "base_url": "https://panelapp.agha.umccr.org", "api": "v1", "workers": 2, "rate_limit": 5}
+]
+
+name is required. The other keys are optional: base_url, api ("legacy" or "v1"), workers, rate_limit (requests a second),
+page_size, timeout, retries, cache (a panel cache file) and http_cache (a directory).
+
+Panel ids are only unique within an instance, so each panel hash is prefixed by the source's namespace (by default its
+name) eg australia:137. A namespace of "" keeps the ids of a source as they are, so panels already imported into Moka from
+that source are still recognised.
+
+Each source is written to its own directory (<output dir>/<name>/<date>_PanelAppOut.jsonl). Once every source has been
+harvested they are merged into <output dir>/<date>_PanelAppOut.jsonl, which can be imported with insert_to_moka.py like a
+harvest from one instance. If any source fails no merged result is written. As with ReadPanelApp.py the merged result can be
+added to a snapshot store (--snapshots) and indexed (--gene-index).
+
+    python multi_source.py sources.json --output-dir /home/mokaguys/Documents/PanelApp/ --run-report sources_report.json
+'''
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from gene_index import build_index
+from panelapp_io import PanelRecordWriter, read_panel_records
+from ReadPanelApp import PanelAPP_API
+from run_report import RunReport
+from snapshot_store import SnapshotStore, diff
+
+# separates the namespace from the panel id in a panel hash
+NAMESPACE_SEPARATOR = ":"
+
+# source setting: PanelAPP_API argument
+SOURCE_SETTINGS = {"base_url": "base_url", "api": "api", "workers": "workers", "rate_limit": "rate", "page_size": "page_size",
+                   "timeout": "timeout", "retries": "retries", "cache": "cache_path", "http_cache": "http_cache_dir"}
+
+
+class Source():
+    '''A PanelApp instance to harvest, and the result of harvesting it'''
+
+    def __init__(self, name, namespace=None, **settings):
+        for setting in settings:
+            if setting not in SOURCE_SETTINGS:
+                raise Exception("unknown setting %s for source %s. the settings are %s" % (setting, name, ", ".join(sorted(SOURCE_SETTINGS))))
+        self.name = str(name)
+        # prefix for the panel hashes. "" leaves them as they are
+        self.namespace = self.name if namespace is None else str(namespace)
+        # "_" separates the panel hash from the rest of the panel in the legacy text output and the panel_hash_colour
+        if "_" in self.namespace or NAMESPACE_SEPARATOR in self.namespace:
+            raise Exception("the namespace of source %s can't contain _ or %s" % (self.name, NAMESPACE_SEPARATOR))
+        # keyword arguments for the PanelAPP_API
+        self.settings = dict((SOURCE_SETTINGS[setting], value) for setting, value in settings.items())
+        if "timeout" in self.settings:
+            self.settings["timeout"] = (10, self.settings["timeout"])
+        self.harvester = None
+        # seconds taken by the harvest, and the exc_info of any error
+        self.seconds = None
+        self.error = None
+
+    def harvest(self, outputdir, report):
+        '''Harvest the source into outputdir. Any error is kept rather than raised so the other sources aren't stopped'''
+        start = time.time()
+        try:
+            if not os.path.isdir(outputdir):
+                os.makedirs(outputdir)
+            self.harvester = PanelAPP_API(report=report, **self.settings)
+            self.harvester.outputfilepath = outputdir + os.sep
+            self.harvester.get_list_of_panels()
+        except Exception:
+            self.error = sys.exc_info()
+        self.seconds = time.time() - start
+
+    @property
+    def output(self):
+        '''The PanelAppOut.jsonl file written by the harvest'''
+        return self.harvester.outputfilepath + self.harvester.now + "_PanelAppOut.jsonl"
+
+    def records(self):
+        '''Generator yielding the PanelRecords harvested, with their panel hashes namespaced'''
+        for record in read_panel_records(self.output):
+            if self.namespace:
+                record.panel_hash = self.namespace + NAMESPACE_SEPARATOR + record.panel_hash
+            yield record
+
+
+def load_sources(path):
+    '''Read the list of sources from a json file'''
+    with open(path, 'r') as config:
+        sources = [Source(**dict((str(key), value) for key, value in source.items())) for source in json.load(config)]
+    for attribute in ("name", "namespace"):
+        values = [getattr(source, attribute) for source in sources]
+        if len(set(values)) != len(values):
+            raise Exception("each source needs a different %s" % attribute)
+    return sources
+
+
+class MultiSourceHarvester():
+    '''Harvests a list of Sources at the same time and merges them into one result'''
+
+    def __init__(self, sources, outputdir, snapshot_dir=None, gene_index=False, reports=False):
+        self.sources = sources
+        self.outputdir = outputdir
+        # optional store of earlier merged harvests. the changes since the previous merged harvest are written to a change feed
+        self.snapshots = None
+        if snapshot_dir:
+            self.snapshots = SnapshotStore(snapshot_dir)
+        # also write an index from each gene to the panels containing it
+        self.gene_index = gene_index
+        # a run report for each source. only recorded if reports is True
+        self.reports = OrderedDict((source.name, RunReport("multi_source.py " + source.name, enabled=reports)) for source in sources)
+        # seconds taken by the whole harvest and by merging the sources
+        self.seconds = None
+        self.merge_seconds = None
+        self.now = datetime.now().strftime("%Y%m%d")
+        # number of panel colours merged from each source
+        self.counts = OrderedDict((source.name, 0) for source in sources)
+
+    @property
+    def output(self):
+        '''The merged PanelAppOut.jsonl file'''
+        return os.path.join(self.outputdir, self.now + "_PanelAppOut.jsonl")
+
+    def harvest(self):
+        '''Harvest every source in its own thread, then merge them. Raises the first error if any source failed'''
+        start = time.time()
+        threads = []
+        for source in self.sources:
+            thread = threading.Thread(target=source.harvest, args=(os.path.join(self.outputdir, source.name), self.reports[source.name]),
+                                      name="harvest " + source.name)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        failed = [source for source in self.sources if source.error]
+        if failed:
+            self.seconds = time.time() - start
+            print self.summary()
+            error = failed[0].error
+            raise error[0], error[1], error[2]
+
+        merge_start = time.time()
+        self.merge()
+        self.merge_seconds = time.time() - merge_start
+        if self.snapshots:
+            self.write_changes()
+        if self.gene_index:
+            build_index(read_panel_records(self.output), os.path.join(self.outputdir, self.now + "_PanelAppGenes.idx"))
+        self.seconds = time.time() - start
+        return self.output
+
+    def merge(self):
+        '''Write the panels of every source to one PanelAppOut.jsonl file, one source after another'''
+        with PanelRecordWriter(self.output) as writer:
+            for source in self.sources:
+                for record in source.records():
+                    writer.write(record)
+                    self.counts[source.name] += 1
+
+    def write_changes(self):
+        '''Add the merged result to the snapshot store and write the changes since the previous snapshot to a change feed'''
+        snapshot = self.snapshots.add(self.now, read_panel_records(self.output))
+        previous = self.snapshots.previous(self.now)
+        if previous is None:
+            print "snapshot %s added. there are no earlier snapshots to compare it with" % self.now
+            return
+        feed = diff(self.snapshots.load(previous), snapshot)
+        feed.write(os.path.join(self.outputdir, self.now + "_PanelAppChanges.jsonl"))
+        print feed.summary()
+
+    def summary(self):
+        '''The time taken by each source, as readable text. The panel colours of each source are only counted once they are merged'''
+        lines = ["%-20s %-12s %8s %14s %10s %8s %10s" % ("source", "namespace", "panels", "panel colours", "requests", "retries", "seconds")]
+        for source in self.sources:
+            client = source.harvester.client if source.harvester else None
+            lines.append("%-20s %-12s %8s %14s %10s %8s %10s" % (
+                source.name, source.namespace or "-", len(source.harvester.dict_of_panels) if source.harvester else "-",
+                self.counts[source.name] if self.merge_seconds is not None else "-", client.requests if client else "-", client.retried if client else "-",
+                "%.2f" % source.seconds if source.seconds is not None else "-"))
+            if source.error:
+                lines.append("    failed: %s" % source.error[1])
+        if self.merge_seconds is not None:
+            lines.append("merged %d panel colours in %.2f seconds" % (sum(self.counts.values()), self.merge_seconds))
+        if self.seconds is not None:
+            lines.append("total %.2f seconds" % self.seconds)
+        return "\n".join(lines)
+
+    def write_reports(self, path):
+        '''Write the run report of each source to a json file'''
+        content = OrderedDict([("format", "MultiSourceRunReport"), ("format_version", 1), ("seconds", self.seconds),
+                               ("merge_seconds", self.merge_seconds),
+                               ("sources", [OrderedDict([("name", name), ("report", report.to_dict())]) for name, report in self.reports.items()])])
+        with open(path, 'w') as output:
+            json.dump(content, output, indent=1)
+            output.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Harvest several PanelApp instances at the same time into one merged result")
+    parser.add_argument("sources", help="json file listing the PanelApp instances to harvest")
+    parser.add_argument("--output-dir", default="/home/mokaguys/Documents/PanelApp/", help="directory to write the harvests to")
+    parser.add_argument("--snapshots", help="directory of earlier merged harvests. the changes since the previous harvest are written to a PanelAppChanges.jsonl file")
+    parser.add_argument("--gene-index", action="store_true", help="also write a PanelAppGenes.idx index from each gene to the panels containing it")
+    parser.add_argument("--run-report", help="time each phase and request of each source and write the run reports to this json file")
+    args = parser.parse_args()
+
+    harvester = MultiSourceHarvester(load_sources(args.sources), args.output_dir, snapshot_dir=args.snapshots, gene_index=args.gene_index,
+                                     reports=bool(args.run_report))
+    harvester.harvest()
+    print harvester.summary()
+    if args.run_report:
+        harvester.write_reports(args.run_report)
@@ -0,0 +1,76 @@
+'''
+A persistent on-disk cache of the gene lists harvested for each panel.
+
+Entries are keyed by the panel id and version number. A panel's gene lists only change when PanelApp
+publishes a new version, so a panel is only downloaded again if it is new or its version has changed.
+
+The cache is a single json file in the form:
+{"format_version": 2, "panels": {panel_id: {"version": "1.2", "gene_lists": {"Green": [[ensembl ids], ...], "Green_symbols": [...], ...}}}}
+'''
+
+import json
+import os
+
+
+class PanelCache():
+    '''Gene lists for each (panel id, version), saved between harvests'''
+    # increment if the layout of the cache file changes. a cache file with another format is ignored
+    format_version = 2
+
+    def __init__(self, path):
+        # location of the cache file
+        self.path = path
+        # dictionary of panel id: {"version": version, "gene_lists": gene_lists}
+        self.panels = {}
+
+        # statistics for this run
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        # read the existing cache, if there is one
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as cache_file:
+                content = json.load(cache_file)
+            if content.get("format_version") == self.format_version:
+                self.panels = content["panels"]
+
+    def get(self, panel_id, version):
+        '''Return the cached gene lists for this panel version, or None if it needs to be fetched'''
+        entry = self.panels.get(panel_id)
+        if entry is not None and entry["version"] == version:
+            self.hits += 1
+            # json returns unicode strings - convert back to str so the output files are written the same way as a fresh download
+            gene_lists = {}
+            for colour, genes in entry["gene_lists"].items():
+                if colour.endswith("_symbols"):
+                    gene_lists[str(colour)] = [str(gene) for gene in genes]
+                else:
+                    gene_lists[str(colour)] = [[str(ensemblid) for ensemblid in gene] for gene in genes]
+            return gene_lists
+        self.misses += 1
+        return None
+
+    def put(self, panel_id, version, gene_lists):
+        '''Store the gene lists for this panel version, replacing any older version'''
+        self.panels[panel_id] = {"version": version, "gene_lists": gene_lists}
+
+    def evict_stale(self, current_panels):
+        '''Remove entries for panels which are no longer listed, or which have been replaced by a new version.
+        current_panels is a list of (panel id, version) tuples from the latest list of panels'''
+        current = dict(current_panels)
+        for panel_id in list(self.panels):
+            if current.get(panel_id) != self.panels[panel_id]["version"]:
+                del self.panels[panel_id]
+                self.evicted += 1
+
+    def save(self):
+        '''Write the cache to disk. The file is replaced in one step so an interrupted run can't leave it half written'''
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as cache_file:
+            json.dump({"format_version": self.format_version, "panels": self.panels}, cache_file)
+        os.rename(tmp_path, self.path)
+
+    def summary(self):
+        '''A one line summary of the cache statistics for this run'''
+        return "panel cache: %s hits, %s misses, %s stale entries evicted" % (self.hits, self.misses, self.evicted)
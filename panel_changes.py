@@ -0,0 +1,86 @@
+'''
+The set of changes needed to bring Moka up to date with a PanelApp API result.
+
+insert_to_moka.py compares the panels in Moka with the API result and records what needs to change
+in a ChangeSet before writing anything. The change set can then be printed (a dry run) or applied.
+'''
+
+
+class PanelChange():
+    '''A panel colour to insert into NGSPanel, either a panel new to Moka or a new version of an existing panel'''
+
+    def __init__(self, panel_hash_colour, panel_name_colour, version, item_key, previous_version, genes, api_genes):
+        # the panel identifier stored in the item table eg 553f968cbb5a1616e5ed45cc_Green
+        self.panel_hash_colour = panel_hash_colour
+        # the name stored in NGSPanel eg Classical tuberous sclerosis (Panel App Green v1.0)
+        self.panel_name_colour = panel_name_colour
+        self.version = version
+        # itemid of the panel in the item table, or None if the panel needs adding to the item table
+        self.item_key = item_key
+        # the highest version already in Moka, or None if the panel is new
+        self.previous_version = previous_version
+        # (HGNCID, symbol) for each gene to insert into NGSPanelGenes
+        self.genes = genes
+        # the genes in the API result (an array of ids in the importer's GeneTable), used to check the genes were imported
+        self.api_genes = api_genes
+        # key of the NGSPanel row, set when the change is applied
+        self.ngspanel_key = None
+
+    @property
+    def is_new(self):
+        '''True if the panel is not yet in Moka'''
+        return self.previous_version is None
+
+
+class ChangeSet():
+    '''All the changes to make to Moka, in the order they will be made'''
+
+    def __init__(self):
+        # version numbers to add to the item table
+        self.new_versions = []
+        # a PanelChange for each panel to insert, in the order of the API result
+        self.panels = []
+        # the panel_hash_colours skipped as the import journal shows they have already been imported
+        self.journalled = []
+
+    def extend(self, other):
+        '''Add the changes in another ChangeSet, made after these'''
+        self.new_versions.extend(other.new_versions)
+        self.panels.extend(other.panels)
+        self.journalled.extend(other.journalled)
+
+    @property
+    def new_panels(self):
+        return [change for change in self.panels if change.is_new]
+
+    @property
+    def version_bumps(self):
+        return [change for change in self.panels if not change.is_new]
+
+    @property
+    def deactivations(self):
+        '''The panels which will have their existing versions deactivated'''
+        return [change.panel_hash_colour for change in self.version_bumps]
+
+    @property
+    def gene_count(self):
+        '''The number of rows to insert into NGSPanelGenes'''
+        return sum(len(change.genes) for change in self.panels)
+
+    def __len__(self):
+        return len(self.new_versions) + len(self.panels)
+
+    def report(self):
+        '''A readable description of the changes'''
+        lines = ["%s new versions, %s new panels, %s version bumps (deactivating the previous versions), %s genes to add" % (
+            len(self.new_versions), len(self.new_panels), len(self.version_bumps), self.gene_count)]
+        if self.journalled:
+            lines.append("%s panels skipped as already in the import journal" % len(self.journalled))
+        if self.new_versions:
+            lines.append("new versions: " + ", ".join(self.new_versions))
+        for change in self.panels:
+            if change.is_new:
+                lines.append("new panel     %s %s: %s genes" % (change.panel_hash_colour, change.panel_name_colour, len(change.genes)))
+            else:
+                lines.append("version bump  %s %s: v%s -> v%s, %s genes" % (change.panel_hash_colour, change.panel_name_colour, change.previous_version, change.version, len(change.genes)))
+        return "\n".join(lines)
@@ -0,0 +1,155 @@
+'''
+Types shared by the harvester and the importer.
+
+The same gene appears in many panels, so genes are held once in a GeneTable and each panel holds the integer
+ids of its genes in an array. The symbol and ensembl id strings are interned so each is only held once.
+The lists of symbols and ensembl ids are only built when a panel is written out or its genes are looked up.
+'''
+
+import threading
+from array import array
+from functools import total_ordering
+
+
+@total_ordering
+class PanelVersion(object):
+    '''A PanelApp panel version number eg 1.102.
+
+    The major and minor release numbers are compared as integers, so versions are ordered by release rather than as
+    decimals - 1.102 is 100 releases after 1.2, not less than it:
+
+    >>> PanelVersion("1.102") > PanelVersion("1.2")
+    True
+    >>> PanelVersion("1.10") > PanelVersion("1.9")
+    True
+    >>> PanelVersion("2.0") > PanelVersion("1.999")
+    True
+    >>> PanelVersion("0.8") < PanelVersion("1.0")
+    True
+    >>> PanelVersion("1.2") == PanelVersion("1.2"), PanelVersion("1.2") == PanelVersion("1.20")
+    (True, False)
+    >>> max([PanelVersion("1.2"), PanelVersion("1.102"), PanelVersion("1.11")])
+    PanelVersion('1.102')
+    >>> str(PanelVersion("1.10"))
+    '1.10'
+    '''
+    __slots__ = ("text", "key")
+
+    def __init__(self, text):
+        # the version as written by PanelApp
+        self.text = str(text)
+        # the (major, minor) release numbers used for comparisons. a version without a minor number is release 0
+        major, _, minor = self.text.partition(".")
+        self.key = (int(major), int(minor or 0))
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return self.key != other.key
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return "PanelVersion(%r)" % self.text
+
+
+class GeneTable(object):
+    '''Every distinct gene (a symbol and its ensembl ids), stored once and referred to by an integer id.
+
+    >>> table = GeneTable()
+    >>> table.add("TSC1", ["ENSG00000165699", "LRG_486"]), table.add("TSC2", ["ENSG00000103197"]), table.add("TSC1", ["ENSG00000165699", "LRG_486"])
+    (0, 1, 0)
+    >>> genes = table.add_genes(["TSC2", "TSC1"], [["ENSG00000103197"], ["ENSG00000165699", "LRG_486"]])
+    >>> genes, len(table)
+    (array('l', [1, 0]), 2)
+    >>> table.symbols_of(genes), table.ensembl_ids_of(genes)
+    (['TSC2', 'TSC1'], [['ENSG00000103197'], ['ENSG00000165699', 'LRG_486']])
+    '''
+    __slots__ = ("symbols", "ensembl_ids", "ids", "lock")
+
+    def __init__(self):
+        # the symbol and the tuple of ensembl ids of each gene, indexed by gene id
+        self.symbols = []
+        self.ensembl_ids = []
+        # (symbol, ensembl ids): gene id
+        self.ids = {}
+        # genes can be added by several harvester threads at once
+        self.lock = threading.Lock()
+
+    def add(self, symbol, ensembl_ids):
+        '''Return the id of a gene, adding it to the table if it is new'''
+        key = (intern(str(symbol)), tuple(intern(str(ensemblid)) for ensemblid in ensembl_ids))
+        gene = self.ids.get(key)
+        if gene is None:
+            with self.lock:
+                gene = self.ids.get(key)
+                if gene is None:
+                    gene = len(self.symbols)
+                    self.symbols.append(key[0])
+                    self.ensembl_ids.append(key[1])
+                    self.ids[key] = gene
+        return gene
+
+    def add_genes(self, symbols, ensembl_ids):
+        '''Return an array of the ids of a list of genes, given as matching lists of symbols and ensembl ids.
+        If one list is longer (eg in a hand edited file) the extra genes are added with no symbol or no ensembl ids'''
+        genes = array("l")
+        for i in range(max(len(symbols), len(ensembl_ids))):
+            genes.append(self.add(symbols[i] if i < len(symbols) else "", ensembl_ids[i] if i < len(ensembl_ids) else ()))
+        return genes
+
+    def symbols_of(self, genes):
+        '''The symbols of an array of gene ids'''
+        return [self.symbols[gene] for gene in genes]
+
+    def ensembl_ids_of(self, genes):
+        '''The ensembl ids of an array of gene ids, as a list for each gene'''
+        return [list(self.ensembl_ids[gene]) for gene in genes]
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+class PanelGenes(object):
+    '''The genes of one colour in one version of a panel, held as an array of ids in a GeneTable.
+    Has the same attributes as a panelapp_io.PanelRecord so can be written by a PanelRecordWriter'''
+    __slots__ = ("panel_hash", "panel_name", "version", "colour", "genes", "table")
+
+    def __init__(self, panel_hash, panel_name, version, colour, genes, table):
+        self.panel_hash = panel_hash
+        self.panel_name = panel_name
+        self.version = version
+        self.colour = colour
+        # array of gene ids
+        self.genes = genes
+        self.table = table
+
+    @classmethod
+    def from_record(cls, record, table):
+        '''Add the genes of a PanelRecord to the table'''
+        return cls(record.panel_hash, record.panel_name, record.version, record.colour, table.add_genes(record.symbols, record.ensembl_ids), table)
+
+    @property
+    def panel_hash_colour(self):
+        '''The stable identifier of the panel colour eg 553f968cbb5a1616e5ed45cc_Green'''
+        return self.panel_hash + "_" + self.colour
+
+    @property
+    def symbols(self):
+        return self.table.symbols_of(self.genes)
+
+    @property
+    def ensembl_ids(self):
+        return self.table.ensembl_ids_of(self.genes)
+
+    def to_dict(self):
+        return {"panel_hash": self.panel_hash, "panel_name": self.panel_name, "version": self.version,
+                "colour": self.colour, "ensembl_ids": self.ensembl_ids, "symbols": self.symbols}
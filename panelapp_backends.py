@@ -0,0 +1,168 @@
+'''
+The PanelApp web services the harvester can read from.
+
+LegacyBackend reads the original WebServices endpoints. list_panels returns every panel in one response and get_panel
+returns the genes of one panel, so a harvest makes one request per panel.
+
+V1Backend reads the current REST API (/api/v1/), which returns its results a page at a time. Pages are read with a
+PageIterator, which requests the next page while the results of the current page are being used. As well as the genes of
+one panel (/api/v1/panels/<id>/) the API can return the genes of every panel, one confidence level at a time
+(/api/v1/genes/?confidence_level=3), so a full harvest takes a request per page of genes rather than one per panel.
+The confidence levels are paged at the same time.
+
+Both backends return panels as (panel id, name, version) and genes as (colour, symbol, list of ensembl ids).
+A panel from the REST API is identified by the hash id used by the WebServices, so it keeps the same identifier in Moka
+whichever API it was harvested from. Panels which don't have a hash id are identified by their number.
+'''
+
+from multiprocessing.pool import ThreadPool
+
+from json_stream import iter_array
+
+# colour of the genes at each LevelOfConfidence (WebServices) or confidence_level (REST API). red genes aren't used
+LEGACY_COLOURS = {"HighEvidence": "Green", "ModerateEvidence": "Amber"}
+V1_COLOURS = {"3": "Green", "2": "Amber"}
+
+
+class PageIterator():
+    '''Iterates through the results of a paginated endpoint, following the next link of each page.
+    The next page is requested in a background thread while the results of the current page are used'''
+
+    def __init__(self, client, url):
+        self.client = client
+        self.url = url
+        # number of pages read
+        self.pages = 0
+
+    def __iter__(self):
+        pool = ThreadPool(1)
+        try:
+            pending = pool.apply_async(self.client.get_json, (self.url,))
+            while pending is not None:
+                # wait for the page. any error getting it is raised here
+                page = pending.get()
+                self.pages += 1
+                # request the next page before the results of this one are used
+                pending = pool.apply_async(self.client.get_json, (page["next"],)) if page.get("next") else None
+                for result in page["results"]:
+                    yield result
+        finally:
+            pool.close()
+            pool.join()
+
+
+class LegacyBackend():
+    '''The WebServices endpoints, list_panels and get_panel'''
+    # the genes of every panel can't be requested at once
+    supports_bulk = False
+    # genes are kept in the order of the get_panel response
+    sort_genes = False
+
+    def __init__(self, client, base_url, page_size=None):
+        # page_size isn't used as the WebServices aren't paginated
+        self.client = client
+        # define the apis urls. both set to return json.
+        self.list_of_panels = base_url + "/WebServices/list_panels/?format=json"
+        # need to append the panel name on end
+        self.list_of_genes = base_url + "/WebServices/get_panel/%s/?format=json"
+
+    def list_panels(self):
+        '''Generator yielding (panel id, name, version) for each panel'''
+        for panel in self.client.get_json(self.list_of_panels)["result"]:
+            yield panel["Panel_Id"], panel["Name"], panel["CurrentVersion"]
+
+    def panel_genes(self, panel_id, streaming=False, chunk_size=65536):
+        '''Generator yielding (colour, symbol, ensembl ids) for the amber and green genes of a panel.
+        When streaming each gene is decoded as the response is downloaded'''
+        if streaming:
+            genes = iter_array(self.client.iter_content(self.list_of_genes % panel_id, chunk_size), "Genes")
+        else:
+            genes = self.client.get_json(self.list_of_genes % panel_id)["result"]["Genes"]
+        for gene in genes:
+            # each gene is red amber or green based on the evidence
+            colour = LEGACY_COLOURS.get(gene["LevelOfConfidence"])
+            if colour:
+                # some genes have multiple ensembl gene ids so each gene has a list of ids
+                yield colour, gene["GeneSymbol"], gene["EnsembleGeneIds"]
+
+
+class V1Backend():
+    '''The paginated REST API, /api/v1/'''
+    supports_bulk = True
+    # genes are sorted so a panel is the same whether it was read on its own or with every other panel
+    sort_genes = True
+
+    def __init__(self, client, base_url, page_size=None):
+        self.client = client
+        self.panels_url = base_url + "/api/v1/panels/?format=json"
+        self.panel_url = base_url + "/api/v1/panels/%s/?format=json"
+        self.genes_url = base_url + "/api/v1/genes/?format=json&confidence_level=%s"
+        # results to ask for in each page. None uses the server's default. the server may return fewer
+        self.page_size = page_size
+        # panel id: the panel's number, used in the url of the panel
+        self.numbers = {}
+
+    def pages(self, url):
+        '''A PageIterator for an endpoint'''
+        if self.page_size:
+            url += "&page_size=%d" % self.page_size
+        return PageIterator(self.client, url)
+
+    def panel_id(self, panel):
+        '''The identifier of a panel - its hash id if it has one, otherwise its number'''
+        return panel.get("hash_id") or str(panel["id"])
+
+    def list_panels(self):
+        '''Generator yielding (panel id, name, version) for each panel'''
+        for panel in self.pages(self.panels_url):
+            panel_id = self.panel_id(panel)
+            self.numbers[panel_id] = panel["id"]
+            yield panel_id, panel["name"], panel["version"]
+
+    def panel_genes(self, panel_id, streaming=False, chunk_size=65536):
+        '''Generator yielding (colour, symbol, ensembl ids) for the amber and green genes of a panel.
+        When streaming each gene is decoded as the response is downloaded'''
+        url = self.panel_url % self.numbers[panel_id]
+        if streaming:
+            genes = iter_array(self.client.iter_content(url, chunk_size), "genes")
+        else:
+            genes = self.client.get_json(url)["genes"]
+        for gene in genes:
+            colour = V1_COLOURS.get(str(gene["confidence_level"]))
+            if colour:
+                yield colour, self.symbol(gene), self.ensembl_ids(gene)
+
+    def bulk_genes(self):
+        '''Generator yielding (panel id, version, colour, symbol, ensembl ids) for the amber and green genes of every panel.
+        The confidence levels are paged at the same time, each in its own thread, rather than one after the other'''
+        levels = sorted(V1_COLOURS.items(), reverse=True)
+        pool = ThreadPool(len(levels))
+        try:
+            # each level's genes are read in full, so the levels are downloaded side by side
+            pending = [(colour, pool.apply_async(list, (self.pages(self.genes_url % level),))) for level, colour in levels]
+            for colour, genes in pending:
+                # any error paging the level is raised here
+                for gene in genes.get():
+                    yield self.panel_id(gene["panel"]), gene["panel"]["version"], colour, self.symbol(gene), self.ensembl_ids(gene)
+        finally:
+            pool.close()
+            pool.join()
+
+    def symbol(self, gene):
+        return gene["gene_data"].get("gene_symbol") or gene["entity_name"]
+
+    def ensembl_ids(self, gene):
+        '''The ensembl ids of a gene. The REST API gives an id for each genome build and ensembl release, which are usually
+        the same. Each id is returned once, GRch37 first'''
+        ensembl_ids = []
+        builds = gene["gene_data"].get("ensembl_genes") or {}
+        for build in sorted(builds):
+            for release in sorted(builds[build]):
+                ensembl_id = builds[build][release].get("ensembl_id")
+                if ensembl_id and ensembl_id not in ensembl_ids:
+                    ensembl_ids.append(ensembl_id)
+        return ensembl_ids
+
+
+# the backends which can be chosen with PanelAPP_API(api=...)
+BACKENDS = {"legacy": LegacyBackend, "v1": V1Backend}
@@ -0,0 +1,266 @@
+'''
+The HTTP client used by ReadPanelApp.py to call the PanelApp web services.
+
+- one requests session is shared by all requests so connections are pooled and reused
+- every request has a connect and read timeout
+- requests which time out, lose their connection or get a 429 or 5xx response are retried, waiting an exponentially
+  increasing, randomised (jittered) time between attempts. A Retry-After header from the server is respected
+- an optional rate limiter spaces out requests, across all threads, so the server's limits aren't exceeded.
+  If the server asks for requests to stop with a Retry-After header all threads wait
+- with a response cache, the ETag and Last-Modified headers of each response are saved along with the body and sent back as
+  If-None-Match and If-Modified-Since on the next request. If the response hasn't changed the server replies with a cheap
+  304 Not Modified and the saved body is used
+- the latency of every request (until the headers are received), the time taken to download each body, the bytes downloaded
+  and the time taken to decode json are added to a RunReport
+
+Retries cover a whole request when the body is read with get_json. When a body is streamed with iter_content, a failure
+after the first chunk has been returned can't be retried by the client. Instead the code using the body can be run with
+retry, which starts it again if the body is cut short.
+'''
+
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from run_report import RunReport
+
+# responses which are retried. 429 is too many requests
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RequestFailed(Exception):
+    '''A request failed with a response which can't be retried, or failed every retry'''
+    pass
+
+
+class RateLimiter():
+    '''Allows at most rate requests a second, across all threads'''
+
+    def __init__(self, rate):
+        # seconds between requests
+        self.interval = 1.0 / rate
+        # time the next request can be made
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        '''Wait until a request can be made'''
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(self, seconds):
+        '''Don't allow any requests for this many seconds, eg when the server sends Retry-After'''
+        with self.lock:
+            self.next_time = max(self.next_time, time.time() + seconds)
+
+
+class ResponseCache():
+    '''The body, ETag and Last-Modified of the last response for each url, stored in a directory'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def path(self, url):
+        '''The path of the body of the response for a url. The headers are saved in the same path with .json added'''
+        return os.path.join(self.directory, hashlib.sha1(url).hexdigest())
+
+    def conditional_headers(self, url):
+        '''The headers to send to only get the response if it has changed'''
+        if not os.path.exists(self.path(url)):
+            return {}
+        try:
+            with open(self.path(url) + ".json", 'r') as meta_file:
+                meta = json.load(meta_file)
+        except (IOError, ValueError):
+            return {}
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = str(meta["etag"])
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = str(meta["last_modified"])
+        return headers
+
+    def iter_body(self, url, chunk_size):
+        '''Generator yielding the saved body of a url in chunks'''
+        with open(self.path(url), 'rb') as body:
+            for chunk in iter(lambda: body.read(chunk_size), ""):
+                yield chunk
+
+    def save(self, url, response, chunks):
+        '''Generator saving the body of a response as its chunks are passed through. The body is only saved once all of it has been read'''
+        if not response.headers.get("ETag") and not response.headers.get("Last-Modified"):
+            # the response can't be requested conditionally so there is no point saving it
+            for chunk in chunks:
+                yield chunk
+            return
+        handle, tmp_path = tempfile.mkstemp(dir=self.directory)
+        complete = False
+        try:
+            with os.fdopen(handle, 'wb') as body:
+                for chunk in chunks:
+                    body.write(chunk)
+                    yield chunk
+            # replace the saved body in one step, then the headers
+            os.rename(tmp_path, self.path(url))
+            with open(self.path(url) + ".json", 'w') as meta_file:
+                json.dump({"url": url, "etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}, meta_file)
+            complete = True
+        finally:
+            if not complete and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class PanelAppClient():
+    '''Makes GET requests with pooled connections, timeouts, retries, rate limiting and conditional requests'''
+
+    def __init__(self, pool_size=10, timeout=(10, 60), retries=5, backoff=0.5, max_backoff=30, rate=None, cache_dir=None, report=None):
+        # one session is shared by all requests so connections are pooled and reused rather than opened for every request
+        self.session = requests.Session()
+        # the pool needs a connection for each thread otherwise threads queue for a connection
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # (connect, read) timeouts in seconds
+        self.timeout = timeout
+        # number of times a failed request is retried
+        self.retries = retries
+        # the wait before the nth retry is a random time up to backoff * 2^n seconds, but no more than max_backoff
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # optional limit on requests per second
+        self.limiter = RateLimiter(rate) if rate else None
+        # optional cache of responses for conditional requests
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+
+        # timings for the run report. nothing is recorded unless a report is given
+        self.report = report or RunReport("panelapp_client", enabled=False)
+        # statistics for this run
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retried = 0
+        self.not_modified = 0
+
+    def count(self, attribute):
+        with self.lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def request(self, url, stream=False):
+        '''Make a GET request, retrying if it fails. Returns the response, which has a status of 200,
+        or 304 if conditional headers were sent from the cache'''
+        attempt = 0
+        while True:
+            if self.limiter:
+                self.limiter.wait()
+            headers = self.cache.conditional_headers(url) if self.cache else {}
+            self.count("requests")
+            retry_after = None
+            start = time.time()
+            try:
+                try:
+                    response = self.session.get(url, headers=headers, timeout=self.timeout, stream=stream)
+                finally:
+                    # the time to get the response headers. the body is downloaded later and timed by count_bytes
+                    self.report.record("http request", time.time() - start)
+                if response.status_code not in RETRY_STATUS:
+                    if response.status_code == 304 and not headers:
+                        # 304 is only a valid response to a conditional request, when there is a cached body to use
+                        response.close()
+                        raise RequestFailed("304 Not Modified for url: %s but no conditional request was made" % url)
+                    if response.status_code != 304:
+                        try:
+                            response.raise_for_status()
+                        except requests.HTTPError as e:
+                            raise RequestFailed(str(e))
+                    return response
+                error = requests.HTTPError("%s error for url: %s" % (response.status_code, url), response=response)
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt >= self.retries:
+                raise RequestFailed("%s failed %s times, last error: %s" % (url, attempt + 1, error))
+            self.count("retried")
+            self.report.count("http retries")
+            wait = self.backoff_time(attempt)
+            if retry_after is not None:
+                # the server has said how long to wait. (Retry-After can also be a date, which is ignored)
+                try:
+                    wait = max(wait, float(retry_after))
+                except ValueError:
+                    pass
+                if self.limiter:
+                    self.limiter.pause(wait)
+            self.report.record("http retry wait", wait)
+            time.sleep(wait)
+            attempt += 1
+
+    def backoff_time(self, attempt):
+        '''Seconds to wait before retrying for the attempt'th time - a random time up to the exponential backoff'''
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def retry(self, function, *args):
+        '''Call function, starting again if a response body it reads is cut short or isn't valid json.
+        Errors getting a response have already been retried by request so aren't retried again'''
+        attempt = 0
+        while True:
+            try:
+                return function(*args)
+            except (requests.RequestException, ValueError):
+                if attempt >= self.retries:
+                    raise
+                self.count("retried")
+                time.sleep(self.backoff_time(attempt))
+                attempt += 1
+
+    def get_json(self, url):
+        '''Return the decoded json response of a url. If the body is cut short or isn't valid json the request is retried'''
+        return self.retry(self.download_json, url)
+
+    def download_json(self, url):
+        '''Download and decode a json response, without retrying if the body is cut short'''
+        body = "".join(self.iter_content(url, 65536))
+        start = time.time()
+        content = json.loads(body)
+        self.report.record("json decode", time.time() - start)
+        return content
+
+    def iter_content(self, url, chunk_size):
+        '''Generator yielding the body of a url in chunks as it is downloaded, or from the cache if it hasn't changed'''
+        response = self.request(url, stream=True)
+        if response.status_code == 304:
+            response.close()
+            self.count("not_modified")
+            self.report.count("http not modified")
+            return self.cache.iter_body(url, chunk_size)
+        chunks = self.count_bytes(response.iter_content(chunk_size), time.time())
+        if self.cache:
+            chunks = self.cache.save(url, response, chunks)
+        return chunks
+
+    def count_bytes(self, chunks, start):
+        '''Generator passing through the chunks of a response body, adding their size to the run report. Once the last chunk has
+        been read the time since start (when the headers were received) is recorded as the time taken to download the body.
+        When the body is decoded as it is streamed this includes the decoding'''
+        for chunk in chunks:
+            self.report.count("bytes downloaded", len(chunk))
+            yield chunk
+        self.report.record("http body", time.time() - start)
+
+    def summary(self):
+        '''A one line summary of the requests made in this run'''
+        return "http client: %s requests, %s retries, %s not modified" % (self.requests, self.retried, self.not_modified)
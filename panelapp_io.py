@@ -0,0 +1,204 @@
+'''
+Reading and writing the PanelApp API result passed from ReadPanelApp.py to insert_to_moka.py.
+
+The result is written as JSON Lines. The first line is a header naming the format and its version,
+then there is one line for each panel and colour eg.
+
+{"format": "PanelAppOut", "format_version": 1}
+{"panel_hash": "553f968cbb5a1616e5ed45cc", "panel_name": "Classical tuberous sclerosis", "version": "1.0", "colour": "Green", "ensembl_ids": [["ENSG00000165699", "LRG_486"], ["ENSG00000103197", "LRG_487"]], "symbols": ["TSC1", "TSC2"]}
+
+ensembl_ids holds a list of ids for each gene as some genes have more than one ensembl id.
+Both the reader and writer work one panel at a time so a whole result never needs to be held in memory.
+
+A change feed written by snapshot_store.py has a different header and a line for each panel colour which has changed.
+Lines for added or updated panel colours have the same keys as above (and some more describing the change), so the
+change feed can be read in place of a full result. Lines for removed panel colours are skipped.
+
+The original output, a pair of text files with a python list written after each panel name, can still be
+read with read_legacy_panel_records and converted to the new format by running this module:
+    python panelapp_io.py 20180828_PanelAppOut.txt 20180828_PanelAppOut_symbols.txt 20180828_PanelAppOut.jsonl
+'''
+
+import argparse
+import json
+import re
+
+# name and version written in the header line. increment the version if the layout of the records changes
+FORMAT_NAME = "PanelAppOut"
+FORMAT_VERSION = 1
+# name and version of the header of a change feed
+CHANGES_FORMAT_NAME = "PanelAppChanges"
+CHANGES_FORMAT_VERSION = 1
+
+
+class PanelRecord():
+    '''The genes of one colour in one version of a panel'''
+
+    def __init__(self, panel_hash, panel_name, version, colour, ensembl_ids, symbols):
+        self.panel_hash = panel_hash
+        self.panel_name = panel_name
+        self.version = version
+        self.colour = colour
+        # a list of ensembl ids for each gene
+        self.ensembl_ids = ensembl_ids
+        # a list of gene symbols
+        self.symbols = symbols
+
+    @property
+    def panel_hash_colour(self):
+        '''The stable identifier of the panel colour eg 553f968cbb5a1616e5ed45cc_Green'''
+        return self.panel_hash + "_" + self.colour
+
+    def to_dict(self):
+        return {"panel_hash": self.panel_hash, "panel_name": self.panel_name, "version": self.version,
+                "colour": self.colour, "ensembl_ids": self.ensembl_ids, "symbols": self.symbols}
+
+    @classmethod
+    def from_dict(cls, content):
+        # json returns unicode strings - convert to str to match the rest of the scripts
+        return cls(str(content["panel_hash"]), content["panel_name"].encode("utf-8"), str(content["version"]), str(content["colour"]),
+                   [[str(ensemblid) for ensemblid in gene] for gene in content["ensembl_ids"]],
+                   [str(symbol) for symbol in content["symbols"]])
+
+
+class PanelRecordWriter():
+    '''Writes panel records to a JSON Lines file, one panel at a time'''
+
+    def __init__(self, path):
+        self.output = open(path, 'w')
+        self.output.write(json.dumps({"format": FORMAT_NAME, "format_version": FORMAT_VERSION}, sort_keys=True) + "\n")
+
+    def write(self, record):
+        self.output.write(json.dumps(record.to_dict(), sort_keys=True) + "\n")
+
+    def close(self):
+        self.output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def is_change_feed(path):
+    '''True if a JSON Lines file is a change feed rather than a full result'''
+    with open(path, 'r') as input_file:
+        return json.loads(input_file.readline() or "{}").get("format") == CHANGES_FORMAT_NAME
+
+
+def read_panel_records(path):
+    '''Generator yielding a PanelRecord for each line of a JSON Lines file, or for each added or updated panel colour in a change feed'''
+    with open(path, 'r') as input_file:
+        header = json.loads(input_file.readline() or "{}")
+        header = (header.get("format"), header.get("format_version"))
+        if header not in ((FORMAT_NAME, FORMAT_VERSION), (CHANGES_FORMAT_NAME, CHANGES_FORMAT_VERSION)):
+            raise Exception("%s is not a %s file version %s" % (path, FORMAT_NAME, FORMAT_VERSION))
+        for line in input_file:
+            if line.strip():
+                content = json.loads(line)
+                if content.get("change") != "removed":
+                    yield PanelRecord.from_dict(content)
+
+
+# the panel details before the list in a legacy line eg. 553f968cbb5a1616e5ed45cc_Classical tuberous sclerosis_1.0_Green_symbols:[
+# panel names can't contain underscores (they are replaced when harvesting)
+LEGACY_HEADER = re.compile(r"([^_]*)_([^_]*)_([^_]*)_([^_:]*)(_symbols)?:\[")
+# the list after the header is tokenised in a single pass, each token being a value in single quotes and the text before it.
+# the symbols file has a quoted symbol for each gene eg. ['TSC1', 'TSC2']. the ensembl id file has a double quoted string
+# for each gene containing its quoted ids eg. ["'ENSG00000165699','LRG_486'", "'ENSG00000103197'"], so ids in the same gene
+# are only separated by a comma. (files edited by hand don't always have the double quotes so they aren't relied on)
+LEGACY_TOKEN = re.compile(r"([^']*)'([^']*)'")
+
+
+def parse_legacy_line(line):
+    '''Split a line of the legacy text files into the panel hash, name, version, colour and list of values.
+    For the symbols file the values are the gene symbols, for the ensembl id file they are a list of ids for each gene'''
+    header = LEGACY_HEADER.match(line)
+    if header is None:
+        raise Exception("Cannot parse PanelApp API result line: %s" % line[:100])
+    panel_hash, panel_name, version, colour, symbols_file = header.groups()
+
+    tokens = LEGACY_TOKEN.findall(line, header.end())
+    if symbols_file:
+        return panel_hash, panel_name, version, colour, [value for separator, value in tokens]
+
+    values = []
+    gene = None
+    for separator, value in tokens:
+        # anything but a comma (or a comma and the u of a unicode string) between ids starts a new gene
+        if gene is None or (separator != "," and separator != ",u"):
+            gene = []
+            values.append(gene)
+        # ignore empty ids
+        if value:
+            gene.append(value)
+    return panel_hash, panel_name, version, colour, values
+
+
+def parse_legacy_file(lines):
+    '''Generator parsing each line of a legacy text file as it is read'''
+    for line in lines:
+        if line.strip():
+            yield parse_legacy_line(line)
+
+
+def read_legacy_panel_records(ensembl_path, symbols_path):
+    '''Generator yielding a PanelRecord for each line of a legacy ensembl id file, with the symbols from the matching legacy symbols file.
+    Both files are read once, side by side. As they are written in the same order the matching symbols are normally on the same line,
+    any symbols read ahead of their ensembl ids (eg if a file has been edited by hand) are held until they are needed'''
+    with open(ensembl_path, 'r') as ensembl_file, open(symbols_path, 'r') as symbols_file:
+        symbols_lines = parse_legacy_file(symbols_file)
+        # symbols read before the matching line of the ensembl file
+        read_ahead = {}
+        for panel_hash, panel_name, version, colour, ensembl_ids in parse_legacy_file(ensembl_file):
+            key = (panel_hash, colour)
+            # read the symbols file until the symbols for this panel are found
+            while key not in read_ahead:
+                symbols_line = next(symbols_lines, None)
+                if symbols_line is None:
+                    break
+                read_ahead[(symbols_line[0], symbols_line[3])] = symbols_line[4]
+            yield PanelRecord(panel_hash, panel_name, version, colour, ensembl_ids, read_ahead.pop(key, []))
+
+
+def read_api_versions(path, symbols_path=None):
+    '''Return the set of panel versions in either a JSON Lines result or, if a symbols file is given, a legacy text file.
+    Only the panel details are read from the legacy file, the gene lists are not parsed'''
+    versions = set()
+    if symbols_path:
+        with open(path, 'r') as input_file:
+            for line in input_file:
+                header = LEGACY_HEADER.match(line)
+                if header:
+                    versions.add(header.group(3))
+    else:
+        for record in read_panel_records(path):
+            versions.add(record.version)
+    return versions
+
+
+def read_api_result(path, symbols_path=None):
+    '''Read either a JSON Lines result or, if a symbols file is given, a pair of legacy text files'''
+    if symbols_path:
+        return read_legacy_panel_records(path, symbols_path)
+    return read_panel_records(path)
+
+
+def convert_legacy(ensembl_path, symbols_path, output_path):
+    '''Convert a pair of legacy text files to a JSON Lines file. Returns the number of records written'''
+    count = 0
+    with PanelRecordWriter(output_path) as writer:
+        for record in read_legacy_panel_records(ensembl_path, symbols_path):
+            writer.write(record)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a legacy PanelAppOut.txt and PanelAppOut_symbols.txt pair to a JSON Lines file")
+    parser.add_argument("ensembl_file")
+    parser.add_argument("symbols_file")
+    parser.add_argument("output_file")
+    args = parser.parse_args()
+    print "%s panels written to %s" % (convert_legacy(args.ensembl_file, args.symbols_file, args.output_file), args.output_file)
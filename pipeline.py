@@ -0,0 +1,195 @@
+'''
+A pipelined harvest and import, for where both PanelApp and Moka can be reached (eg a test environment).
+
+Normally ReadPanelApp.py harvests every panel and writes the PanelAppOut.jsonl file, and only then does insert_to_moka.py
+start reading it. Here the harvest runs in a background thread in streaming mode and each panel colour is put on a
+bounded queue (a PanelPipe) as soon as it is fetched. The importer takes the panels off the queue in batches and plans and
+applies each batch in its own transaction while later panels are still downloading. The Moka tables the import needs
+(translations, versions, existing panels) are read while the panels are being listed. So the whole run takes about as
+long as the slower of the harvest and the import, rather than the sum of the two.
+
+- backpressure: if the importer falls behind the queue fills and the harvest waits for space, so memory use stays bounded.
+  If the harvest falls behind the importer waits for panels. The time each side waited is reported
+- batches: the importer takes every panel waiting on the queue (up to the batch size) at once, so when it falls behind it
+  commits less often
+- errors: if the import fails the harvest is stopped at the next panel it fetches and the panels not yet fetched are
+  abandoned. If the harvest fails the importer stops taking panels. Either way both sides stop before the first error is
+  raised. The batches already committed stay in Moka, as with a journal (--journal), so the run can be repeated
+
+The PanelAppOut.jsonl file is still written, so the harvest can be checked or imported again in the usual way.
+
+run with the same options as the two scripts:
+    python pipeline.py --workers 4 --api v1 --run-report pipeline_report.json
+'''
+
+import argparse
+import Queue
+import sys
+import threading
+import time
+
+from insert_to_moka import insert_PanelApp
+from ReadPanelApp import PanelAPP_API
+from panelapp_backends import BACKENDS
+from run_report import RunReport
+
+# put on the queue by the harvest once every panel has been put
+END = object()
+
+
+class PipelineAborted(Exception):
+    '''Raised in one side of a pipeline when the other side has failed'''
+    pass
+
+
+class PanelPipe():
+    '''A bounded queue of the panel colours harvested, from the harvest thread to the importer'''
+
+    def __init__(self, size=64):
+        self.queue = Queue.Queue(size)
+        # set when either side fails, to stop the other
+        self.aborted = False
+        # seconds between checks of aborted while waiting on the queue
+        self.poll = 0.1
+        # number of panel colours and batches passed through the pipe
+        self.panels = 0
+        self.batch_count = 0
+        # seconds the harvest waited for space on the queue, and the importer waited for panels
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, record):
+        '''Put a panel colour on the queue, waiting if the queue is full. Raises PipelineAborted if the importer has failed'''
+        start = time.time()
+        while not self.aborted:
+            try:
+                self.queue.put(record, timeout=self.poll)
+            except Queue.Full:
+                continue
+            self.put_wait += time.time() - start
+            if record is not END:
+                self.panels += 1
+            return
+        raise PipelineAborted("the import has stopped")
+
+    def close(self):
+        '''Mark the end of the harvest, once every panel has been put'''
+        self.put(END)
+
+    def abort(self):
+        '''Stop both sides of the pipeline'''
+        self.aborted = True
+
+    def get(self):
+        '''Take the next panel colour off the queue, waiting if it is empty. Raises PipelineAborted if the harvest has failed'''
+        start = time.time()
+        while not self.aborted:
+            try:
+                record = self.queue.get(timeout=self.poll)
+            except Queue.Empty:
+                continue
+            self.get_wait += time.time() - start
+            return record
+        raise PipelineAborted("the harvest has stopped")
+
+    def batches(self, size=50):
+        '''Generator yielding lists of up to size panel colours, until the end of the harvest. Each batch is the panels waiting on
+        the queue, so batches are small while the importer keeps up and grow when it falls behind'''
+        while True:
+            batch = []
+            record = self.get()
+            while record is not END:
+                batch.append(record)
+                if len(batch) == size:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+            if batch:
+                self.batch_count += 1
+                yield batch
+            if record is END:
+                return
+
+    def summary(self):
+        return "pipeline: %d panel colours imported in %d batches. the harvest waited %.2fs for the importer, the importer waited %.2fs for panels" % (
+            self.panels, self.batch_count, self.put_wait, self.get_wait)
+
+
+def run_pipeline(harvester, importer, queue_size=64, batch_size=50):
+    '''Harvest panels with a PanelAPP_API and import them with an insert_PanelApp at the same time. Returns the ChangeSet imported
+    and the PanelPipe, with the time each side waited for the other'''
+    pipe = PanelPipe(queue_size)
+    # panels are only written, and so put on the pipe, as they are fetched when streaming
+    harvester.streaming = True
+    harvester.pipe = pipe
+    # the exc_info of an error in the harvest thread
+    harvest_errors = []
+
+    def harvest():
+        try:
+            harvester.get_list_of_panels()
+            pipe.close()
+        except PipelineAborted:
+            # the importer failed, its error is raised
+            pass
+        except Exception:
+            harvest_errors.append(sys.exc_info())
+            pipe.abort()
+
+    thread = threading.Thread(target=harvest, name="harvest")
+    thread.daemon = True
+    thread.start()
+    try:
+        # read the existing state of moka while the panels are listed
+        importer.load_translations()
+        importer.check_item_category_table()
+        importer.load_versions()
+        importer.all_existing_panels()
+        changes = importer.import_panels(pipe.batches(batch_size))
+    except Exception:
+        pipe.abort()
+        thread.join()
+        # if the import stopped because the harvest failed, raise the harvest's error
+        if harvest_errors:
+            raise harvest_errors[0][0], harvest_errors[0][1], harvest_errors[0][2]
+        raise
+    thread.join()
+    if harvest_errors:
+        raise harvest_errors[0][0], harvest_errors[0][1], harvest_errors[0][2]
+    return changes, pipe
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Harvest the PanelApp API and import the panels into Moka at the same time")
+    parser.add_argument("--workers", type=int, default=1, help="number of panels to fetch concurrently (default: 1)")
+    parser.add_argument("--api", choices=sorted(BACKENDS), default="legacy", help="the web services to read (default: legacy)")
+    parser.add_argument("--page-size", type=int, help="results to ask for in each page of the REST API (default: the server's page size)")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for a response before retrying (default: 60)")
+    parser.add_argument("--retries", type=int, default=5, help="number of times a failed request is retried (default: 5)")
+    parser.add_argument("--rate-limit", type=float, help="the most requests to make a second")
+    parser.add_argument("--journal", help="import journal file. each panel is inserted in its own transaction and recorded, so a repeated run skips the panels already imported")
+    parser.add_argument("--max-translations", type=int, help="the most rows of the hgnc translation table to hold in memory. by default the whole table is loaded")
+    parser.add_argument("--queue-size", type=int, default=64, help="the most panel colours waiting to be imported before the harvest waits (default: 64)")
+    parser.add_argument("--batch-size", type=int, default=50, help="the most panel colours imported in one transaction (default: 50)")
+    parser.add_argument("--run-report", help="time each phase, request and statement and write a json run report to this file")
+    args = parser.parse_args()
+
+    report = RunReport("pipeline.py", enabled=bool(args.run_report))
+    harvester = PanelAPP_API(workers=args.workers, timeout=(10, args.timeout), retries=args.retries, rate=args.rate_limit, api=args.api,
+                             page_size=args.page_size, report=report)
+    importer = insert_PanelApp(max_translations=args.max_translations, journal_path=args.journal, report=report)
+    try:
+        changes, pipe = run_pipeline(harvester, importer, args.queue_size, args.batch_size)
+    finally:
+        if importer.journal:
+            importer.journal.close()
+    print changes.report().splitlines()[0]
+    print pipe.summary()
+    if importer.journal:
+        print importer.journal.summary()
+    print importer.reconciliation.summary()
+    if args.run_report:
+        report.write(args.run_report)
+        print report.summary()
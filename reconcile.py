@@ -0,0 +1,137 @@
+'''
+Reconciliation of the genes in Moka against the genes in the PanelApp API result.
+
+The genes of every panel being checked are read from Moka with one query (batched if there are many panels),
+translated to PanelApp symbols with the HGNC translation index, and compared with the API symbols as sets.
+Each difference is recorded as a row of a single discrepancy report, which can be written as CSV or JSON.
+
+Either the panels inserted by an import, or every active panel in Moka, can be reconciled.
+'''
+
+import csv
+import json
+
+from panel_model import PanelVersion
+
+# the kinds of discrepancy
+MISSING = "missing from moka"
+EXTRA = "not in API"
+PANEL_NOT_IN_MOKA = "panel not in moka"
+PANEL_NOT_IN_API = "panel not in API"
+OLDER_VERSION = "older version in moka"
+NEWER_VERSION = "newer version in moka"
+
+# what to check for each kind of discrepancy
+HINTS = {
+    MISSING: "is there an ensembl ID for this gene?",
+    EXTRA: "is there an errant ensembl ID in the API? (look if the panelapp_ensemblid in moka for this gene is in the API). "
+           "if genes are also missing from moka it's probably that moka.panelapp_symbol != panelapp symbol",
+    PANEL_NOT_IN_MOKA: "the panel hasn't been imported",
+    PANEL_NOT_IN_API: "the panel is no longer in PanelApp",
+    OLDER_VERSION: "the panel has been updated in PanelApp since it was imported",
+    NEWER_VERSION: "moka has a later version than the API result - is the harvest out of date, or has the panel been rolled back in PanelApp?",
+}
+
+
+class Reconciliation():
+    '''Compares panels in Moka with the API result, collecting the discrepancies'''
+    # columns of the report
+    fields = ["panel_hash_colour", "panel", "ngspanel_id", "symbol", "discrepancy"]
+    # number of NGSPanelIDs in each query
+    batch_size = 1000
+
+    def __init__(self, queries, translations, genes):
+        # MokaQueries, HGNCTranslationIndex and the GeneTable holding the API genes
+        self.queries = queries
+        self.translations = translations
+        self.genes = genes
+        # a dictionary for each discrepancy, with the keys in fields
+        self.discrepancies = []
+        self.panels_checked = 0
+
+    def add(self, panel_hash_colour, panel, ngspanel_id, symbol, discrepancy):
+        self.discrepancies.append({"panel_hash_colour": panel_hash_colour, "panel": panel, "ngspanel_id": ngspanel_id,
+                                   "symbol": symbol, "discrepancy": discrepancy})
+
+    def compare(self, panel_hash_colour, panel, ngspanel_id, api_genes, hgncids, symbols_by_hgncid):
+        '''Compare the symbols of one panel in the API (an array of gene ids) with the HGNCIDs imported to Moka'''
+        api_symbols = set(symbol for symbol in self.genes.symbols_of(api_genes) if symbol)
+        db_symbols = set()
+        for HGNCID in hgncids:
+            db_symbols.update(symbols_by_hgncid.get(HGNCID, ()))
+        for symbol in sorted(api_symbols - db_symbols):
+            self.add(panel_hash_colour, panel, ngspanel_id, symbol, MISSING)
+        for symbol in sorted(db_symbols - api_symbols):
+            self.add(panel_hash_colour, panel, ngspanel_id, symbol, EXTRA)
+        self.panels_checked += 1
+
+    def check_changes(self, changes):
+        '''Check the genes of the panels inserted when a ChangeSet was applied'''
+        keys = [change.ngspanel_key for change in changes.panels]
+        hgncids = {}
+        for ngspanel_id, HGNCID in self.queries.fetchall_in("panel_gene_hgncids_by_panel", keys, self.batch_size) if keys else []:
+            hgncids.setdefault(ngspanel_id, set()).add(str(HGNCID))
+        symbols_by_hgncid = self.translations.symbols_by_hgncid(set().union(*hgncids.values()))
+        for change in changes.panels:
+            self.compare(change.panel_hash_colour, change.panel_name_colour, change.ngspanel_key, change.api_genes,
+                         hgncids.get(change.ngspanel_key, ()), symbols_by_hgncid)
+
+    def check_database(self, api_panels, item_category_NGS_panel):
+        '''Check every active panel in Moka against the API result.
+        api_panels is an iterable of PanelGenes, eg insert_PanelApp.read_api_result()'''
+        # the API panels, with the panelhash_colour converted to upper case as in the rest of the importer
+        api = {}
+        for panel in api_panels:
+            api[panel.panel_hash_colour.upper()] = panel
+
+        # NGSPanelID: [panelhash_colour, version, panel name, set of HGNCIDs]
+        db_panels = {}
+        for ngspanel_id, panel_hash_colour, version, panel_name, HGNCID in self.queries.fetchall("active_panel_genes", (item_category_NGS_panel,)):
+            if isinstance(panel_name, unicode):
+                panel_name = panel_name.encode("utf-8")
+            db_panel = db_panels.setdefault(ngspanel_id, [str(panel_hash_colour), str(version), panel_name, set()])
+            if HGNCID is not None:
+                db_panel[3].add(str(HGNCID))
+
+        symbols_by_hgncid = self.translations.symbols_by_hgncid(set().union(*[db_panel[3] for db_panel in db_panels.values()]))
+        in_moka = set()
+        for ngspanel_id, (panel_hash_colour, version, panel_name, hgncids) in sorted(db_panels.items()):
+            api_panel = api.get(panel_hash_colour.upper())
+            in_moka.add(panel_hash_colour.upper())
+            if api_panel is None:
+                self.add(panel_hash_colour, panel_name, ngspanel_id, "", PANEL_NOT_IN_API)
+                continue
+            # versions are compared by release number, as when importing
+            if PanelVersion(api_panel.version) > PanelVersion(version):
+                self.add(panel_hash_colour, panel_name, ngspanel_id, "", OLDER_VERSION)
+            elif PanelVersion(api_panel.version) < PanelVersion(version):
+                self.add(panel_hash_colour, panel_name, ngspanel_id, "", NEWER_VERSION)
+            self.compare(panel_hash_colour, panel_name, ngspanel_id, api_panel.genes, hgncids, symbols_by_hgncid)
+        for key in sorted(set(api) - in_moka):
+            panel = api[key]
+            self.add(panel.panel_hash_colour, panel.panel_name, "", "", PANEL_NOT_IN_MOKA)
+
+    def summary(self):
+        '''A count of each kind of discrepancy'''
+        counts = {}
+        for discrepancy in self.discrepancies:
+            counts[discrepancy["discrepancy"]] = counts.get(discrepancy["discrepancy"], 0) + 1
+        lines = ["%s panels reconciled, %s discrepancies" % (self.panels_checked, len(self.discrepancies))]
+        for kind in sorted(counts):
+            lines.append("%6s %s - %s" % (counts[kind], kind, HINTS[kind]))
+        return "\n".join(lines)
+
+    def write(self, path):
+        '''Write the discrepancies to a json file if path ends with .json, otherwise a csv file'''
+        if path.endswith(".json"):
+            with open(path, 'w') as output:
+                json.dump(self.discrepancies, output, indent=1, sort_keys=True)
+        else:
+            with open(path, 'wb') as output:
+                writer = csv.DictWriter(output, self.fields)
+                writer.writeheader()
+                writer.writerows(self.discrepancies)
+
+    def table(self):
+        '''The discrepancies as readable text'''
+        return "\n".join("%s\t%s\t%s\t%s" % (d["panel_hash_colour"], d["panel"], d["symbol"], d["discrepancy"]) for d in self.discrepancies)
@@ -0,0 +1,183 @@
+'''
+Timings for a run of ReadPanelApp.py or insert_to_moka.py, written as a machine readable run report.
+
+A RunReport records
+- the wall time of each phase of the run (eg fetching the panels, applying the changes to Moka)
+- a latency histogram for each kind of call: every HTTP request, the download of each response body ("http body"), and every
+  run of each Moka statement ("sql <statement name>")
+- counters, eg the bytes downloaded
+and is written as json with --run-report:
+
+{"format": "RunReport", "format_version": 1, "script": "ReadPanelApp.py", "seconds": 12.3,
+ "phases": [{"name": "fetch panels", "seconds": 11.2}, ...],
+ "histograms": {"http request": {"count": 350, "seconds": 40.1, "mean_ms": 114.6, "p50_ms": 100, "p95_ms": 200, "max_ms": 950.2,
+                                 "buckets": {"50": 12, "100": 201, ...}}, ...},
+ "counters": {"bytes downloaded": 5242880, ...}}
+
+Each bucket is the number of calls taking up to that many milliseconds (and more than the bucket before). The percentiles
+are the bucket the percentile falls in. A report which isn't enabled ignores everything it is given, so the code being
+timed doesn't need to check whether it is being timed.
+
+Profiler runs the whole script under cProfile, or pyinstrument if it is installed, and writes the hot paths to a file.
+Both only profile the main thread, so use one worker when profiling.
+'''
+
+import bisect
+import cProfile
+import json
+import pstats
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import pyinstrument
+except ImportError:
+    # pyinstrument is optional. cProfile is used if it isn't installed
+    pyinstrument = None
+
+# the upper bound of each histogram bucket in milliseconds. slower calls go in a final "more" bucket
+BUCKETS_MS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+
+class Histogram():
+    '''The number of calls in each latency bucket, and their total and longest time'''
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def percentile(self, fraction):
+        '''The upper bound in milliseconds of the bucket holding this fraction of the calls, or None for the final bucket'''
+        position = fraction * self.count
+        total = 0
+        for bucket, count in enumerate(self.counts):
+            total += count
+            if total >= position and count:
+                return BUCKETS_MS[bucket] if bucket < len(BUCKETS_MS) else None
+
+    def to_dict(self):
+        buckets = OrderedDict()
+        for bucket, count in enumerate(self.counts):
+            if count:
+                buckets[str(BUCKETS_MS[bucket]) if bucket < len(BUCKETS_MS) else "more"] = count
+        return OrderedDict([("count", self.count), ("seconds", round(self.seconds, 6)),
+                            ("mean_ms", round(self.seconds * 1000 / self.count, 3) if self.count else None),
+                            ("p50_ms", self.percentile(0.5)), ("p95_ms", self.percentile(0.95)),
+                            ("max_ms", round(self.max_seconds * 1000, 3)), ("buckets", buckets)])
+
+
+class RunReport():
+    '''Phase timings, latency histograms and counters for a run. Calls can be recorded from several threads'''
+    format_name = "RunReport"
+    format_version = 1
+
+    def __init__(self, script, enabled=True):
+        self.script = script
+        # when not enabled nothing is recorded
+        self.enabled = enabled
+        self.started = time.time()
+        # phase name: seconds, in the order the phases were first run
+        self.phases = OrderedDict()
+        # call name: Histogram
+        self.histograms = {}
+        # counter name: total
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        '''Time a block of code as a phase of the run. A phase run more than once is the total of each run'''
+        start = time.time()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                with self.lock:
+                    self.phases[name] = self.phases.get(name, 0.0) + time.time() - start
+
+    def record(self, name, seconds):
+        '''Add the time taken by one call to the histogram for name'''
+        if self.enabled:
+            with self.lock:
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram()
+                self.histograms[name].add(seconds)
+
+    def count(self, name, amount=1):
+        '''Add to a counter'''
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self):
+        return OrderedDict([("format", self.format_name), ("format_version", self.format_version), ("script", self.script),
+                            ("started", time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started))),
+                            ("seconds", round(time.time() - self.started, 6)),
+                            ("phases", [OrderedDict([("name", name), ("seconds", round(seconds, 6))]) for name, seconds in self.phases.items()]),
+                            ("histograms", OrderedDict((name, self.histograms[name].to_dict()) for name in sorted(self.histograms))),
+                            ("counters", OrderedDict((name, self.counters[name]) for name in sorted(self.counters)))])
+
+    def write(self, path):
+        '''Write the report to a json file'''
+        with open(path, 'w') as output:
+            json.dump(self.to_dict(), output, indent=1)
+            output.write("\n")
+
+    def summary(self):
+        '''The report as readable text'''
+        lines = ["%-36s %10s" % ("phase", "seconds")]
+        for name, seconds in self.phases.items():
+            lines.append("%-36s %10.3f" % (name, seconds))
+        lines.append("%-36s %10.3f" % ("total", time.time() - self.started))
+        lines.append("")
+        lines.append("%-36s %8s %10s %9s %9s %9s" % ("call", "count", "seconds", "mean ms", "p95 ms", "max ms"))
+        for name, histogram in sorted(self.histograms.items(), key=lambda item: -item[1].seconds):
+            p95 = histogram.percentile(0.95)
+            lines.append("%-36s %8d %10.3f %9.3f %9s %9.1f" % (name, histogram.count, histogram.seconds, histogram.seconds * 1000 / histogram.count,
+                                                              p95 if p95 is not None else ">%s" % BUCKETS_MS[-1], histogram.max_seconds * 1000))
+        for name in sorted(self.counters):
+            lines.append("%-36s %8d" % (name, self.counters[name]))
+        return "\n".join(lines)
+
+
+class Profiler():
+    '''Profiles the code run between start and stop, writing the hot paths to path.
+    cProfile writes a text summary of the functions taking the most time, with the raw statistics in path + ".prof".
+    pyinstrument writes its call tree as text'''
+
+    def __init__(self, path, tool="cprofile"):
+        if tool == "pyinstrument" and pyinstrument is None:
+            raise Exception("pyinstrument is not installed. use --profiler cprofile or pip install pyinstrument")
+        self.path = path
+        self.tool = tool
+        self.profiler = pyinstrument.Profiler() if tool == "pyinstrument" else cProfile.Profile()
+
+    def start(self):
+        if self.tool == "pyinstrument":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        '''Stop profiling and write the output'''
+        if self.tool == "pyinstrument":
+            self.profiler.stop()
+            with open(self.path, 'w') as output:
+                output.write(self.profiler.output_text())
+            return
+        self.profiler.disable()
+        self.profiler.dump_stats(self.path + ".prof")
+        with open(self.path, 'w') as output:
+            stats = pstats.Stats(self.profiler, stream=output)
+            stats.sort_stats("cumulative").print_stats(40)
+            stats.sort_stats("tottime").print_stats(40)
@@ -0,0 +1,265 @@
+'''
+A store of successive PanelApp harvests, and the change feed between any two of them.
+
+Each harvest is saved as a snapshot: a gzipped json file holding each distinct gene (symbol and ensembl ids) once and,
+for each panel colour, the panel name, version and the indexes of its genes. This is a fraction of the size of the
+PanelAppOut.jsonl file the snapshot was made from.
+
+Two snapshots are diffed panel by panel. Panel colours with the same version and genes are skipped, and for the others
+a line is written to a change feed (a JSON Lines file) saying whether the panel colour was added, removed or updated,
+the previous version, and the genes added, dropped, promoted (amber to green) or demoted (green to amber). Lines for
+added and updated panel colours also hold the full gene lists, in the same form as PanelAppOut.jsonl, so the change feed
+can be imported with insert_to_moka.py in place of a full harvest. Only the changed panels are then processed.
+
+{"format": "PanelAppChanges", "format_version": 1, "from": "20180828", "to": "20180904"}
+{"change": "updated", "panel_hash": "553f968cbb5a1616e5ed45cc", "colour": "Green", "version": "1.1", "previous_version": "1.0", "genes_added": ["TSC2"], ...}
+
+ReadPanelApp.py --snapshots <directory> adds each harvest to the store and writes the change feed since the previous harvest.
+Snapshots can also be added and diffed by running this module:
+    python snapshot_store.py <directory> add 20180828 20180828_PanelAppOut.jsonl
+    python snapshot_store.py <directory> diff 20180828 20180904 --output changes.jsonl
+'''
+
+import argparse
+import gzip
+import json
+import os
+import tempfile
+import time
+
+from panelapp_io import CHANGES_FORMAT_NAME, CHANGES_FORMAT_VERSION, PanelRecord, read_api_result
+
+# the colour a gene moves to when it is promoted
+PROMOTED_TO = "Green"
+
+
+class Snapshot():
+    '''The panels of one harvest. Genes are held once in a table and each panel colour holds the indexes of its genes'''
+    format_name = "PanelAppSnapshot"
+    format_version = 1
+
+    def __init__(self, name, genes, panels):
+        # the name of the snapshot, normally the date of the harvest eg 20180828
+        self.name = name
+        # (symbol, tuple of ensembl ids) of each distinct gene
+        self.genes = genes
+        # (panel_hash, colour): (panel_name, version, tuple of gene indexes)
+        self.panels = panels
+
+    @classmethod
+    def from_records(cls, name, records):
+        '''Make a snapshot from an iterable of PanelRecords'''
+        genes = []
+        # (symbol, ensembl ids): index
+        index = {}
+        panels = {}
+        for record in records:
+            gene_indexes = []
+            for symbol, ensembl_ids in zip(record.symbols, record.ensembl_ids):
+                key = (symbol, tuple(ensembl_ids))
+                if key not in index:
+                    index[key] = len(genes)
+                    genes.append(key)
+                gene_indexes.append(index[key])
+            panels[(record.panel_hash, record.colour)] = (record.panel_name, record.version, tuple(gene_indexes))
+        return cls(name, genes, panels)
+
+    def record(self, panel_hash, colour):
+        '''The PanelRecord of a panel colour'''
+        panel_name, version, gene_indexes = self.panels[(panel_hash, colour)]
+        return PanelRecord(panel_hash, panel_name, version, colour, [list(self.genes[gene][1]) for gene in gene_indexes],
+                           [self.genes[gene][0] for gene in gene_indexes])
+
+    def records(self):
+        '''Generator yielding the PanelRecord of each panel colour, in the order of PanelAppOut.jsonl'''
+        for panel_hash, colour in sorted(self.panels):
+            yield self.record(panel_hash, colour)
+
+    def to_dict(self):
+        return {"format": self.format_name, "format_version": self.format_version, "name": self.name,
+                "genes": [[symbol, list(ensembl_ids)] for symbol, ensembl_ids in self.genes],
+                "panels": [[panel_hash, colour, panel_name, version, list(gene_indexes)]
+                           for (panel_hash, colour), (panel_name, version, gene_indexes) in sorted(self.panels.items())]}
+
+    @classmethod
+    def from_dict(cls, content):
+        if content.get("format") != cls.format_name or content.get("format_version") != cls.format_version:
+            raise Exception("not a %s version %s" % (cls.format_name, cls.format_version))
+        # json returns unicode strings - convert to str to match the rest of the scripts
+        genes = [(str(symbol), tuple(str(ensembl_id) for ensembl_id in ensembl_ids)) for symbol, ensembl_ids in content["genes"]]
+        panels = {}
+        for panel_hash, colour, panel_name, version, gene_indexes in content["panels"]:
+            panels[(str(panel_hash), str(colour))] = (panel_name.encode("utf-8"), str(version), tuple(gene_indexes))
+        return cls(str(content["name"]), genes, panels)
+
+
+class SnapshotStore():
+    '''A directory of snapshots, one file for each harvest'''
+    suffix = ".snapshot.json.gz"
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + self.suffix)
+
+    def names(self):
+        '''The names of the snapshots in the store, oldest first'''
+        return sorted(filename[:-len(self.suffix)] for filename in os.listdir(self.directory) if filename.endswith(self.suffix))
+
+    def previous(self, name):
+        '''The name of the latest snapshot before name, or None if there isn't one'''
+        earlier = [other for other in self.names() if other < name]
+        return earlier[-1] if earlier else None
+
+    def add(self, name, records):
+        '''Save the PanelRecords of a harvest as a snapshot, replacing any snapshot with the same name. Returns the Snapshot'''
+        snapshot = Snapshot.from_records(name, records)
+        # write to a temporary file then rename it, so a snapshot is never left half written
+        handle, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as tmp_file:
+                with gzip.GzipFile(fileobj=tmp_file, mode='wb') as snapshot_file:
+                    json.dump(snapshot.to_dict(), snapshot_file, separators=(",", ":"))
+            os.rename(tmp_path, self.path(name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return snapshot
+
+    def load(self, name):
+        '''Read a snapshot'''
+        with gzip.open(self.path(name), 'rb') as snapshot_file:
+            return Snapshot.from_dict(json.load(snapshot_file))
+
+
+class ChangeFeed():
+    '''The changes from one snapshot to another, with a dictionary for each panel colour which was added, removed or updated'''
+
+    def __init__(self, old_name, new_name):
+        self.old_name = old_name
+        self.new_name = new_name
+        # dictionaries of the form of a line of the change feed, in the order of PanelAppOut.jsonl
+        self.entries = []
+        # panel hashes added and removed, and panel colours with a new version
+        self.panels_added = 0
+        self.panels_removed = 0
+        self.version_bumps = 0
+
+    def count(self, key):
+        '''The number of genes in the key list (eg genes_added) of all the entries'''
+        return sum(len(entry[key]) for entry in self.entries)
+
+    def write(self, path):
+        '''Write the change feed to a JSON Lines file'''
+        with open(path, 'w') as output:
+            output.write(json.dumps({"format": CHANGES_FORMAT_NAME, "format_version": CHANGES_FORMAT_VERSION,
+                                     "from": self.old_name, "to": self.new_name}, sort_keys=True) + "\n")
+            for entry in self.entries:
+                output.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    def summary(self):
+        return ("changes from %s to %s: %s panel colours changed - %s panels added, %s panels removed, %s version bumps. "
+                "genes: %s added, %s dropped, %s promoted, %s demoted" % (
+                    self.old_name, self.new_name, len(self.entries), self.panels_added, self.panels_removed, self.version_bumps,
+                    self.count("genes_added"), self.count("genes_dropped"), self.count("genes_promoted"), self.count("genes_demoted")))
+
+
+def diff(old, new):
+    '''Return the ChangeFeed from the old Snapshot to the new one'''
+    feed = ChangeFeed(old.name, new.name)
+
+    # each snapshot has its own gene table. give each old gene its index in the new table, or a negative index if it
+    # isn't in the new snapshot, so the genes of a panel in both snapshots can be compared as sets of integers
+    new_index = dict((key, gene) for gene, key in enumerate(new.genes))
+    old_to_new = [new_index.get(key, -1 - gene) for gene, key in enumerate(old.genes)]
+
+    def symbol(gene):
+        return new.genes[gene][0] if gene >= 0 else old.genes[-1 - gene][0]
+
+    # panel_hash: {colour: set of genes} in each snapshot, for the panels with a change
+    changed = {}
+    for key in set(old.panels) | set(new.panels):
+        old_panel = old.panels.get(key)
+        new_panel = new.panels.get(key)
+        old_genes = set(old_to_new[gene] for gene in old_panel[2]) if old_panel else None
+        new_genes = set(new_panel[2]) if new_panel else None
+        if old_panel and new_panel and old_panel[1] == new_panel[1] and old_genes == new_genes:
+            continue
+        panel_hash, colour = key
+        changed.setdefault(panel_hash, {})[colour] = (old_genes, new_genes)
+
+    # panel_hash: colours of the panel in each snapshot
+    old_colours_of = {}
+    for panel_hash, colour in old.panels:
+        old_colours_of.setdefault(panel_hash, []).append(colour)
+    new_colours_of = {}
+    for panel_hash, colour in new.panels:
+        new_colours_of.setdefault(panel_hash, []).append(colour)
+    feed.panels_added = len(set(new_colours_of) - set(old_colours_of))
+    feed.panels_removed = len(set(old_colours_of) - set(new_colours_of))
+
+    for panel_hash in sorted(changed):
+        # the colour of each gene in the panel in each snapshot, to tell a gene moving colour from one added or dropped
+        old_colours = {}
+        for colour in old_colours_of.get(panel_hash, ()):
+            for gene in old.panels[(panel_hash, colour)][2]:
+                old_colours[old_to_new[gene]] = colour
+        new_colours = {}
+        for colour in new_colours_of.get(panel_hash, ()):
+            for gene in new.panels[(panel_hash, colour)][2]:
+                new_colours[gene] = colour
+
+        for colour, (old_genes, new_genes) in sorted(changed[panel_hash].items()):
+            entering = (new_genes or set()) - (old_genes or set())
+            leaving = (old_genes or set()) - (new_genes or set())
+            moved = set(gene for gene in entering if gene in old_colours)
+            if new_genes is None:
+                entry = old.record(panel_hash, colour).to_dict()
+                entry.update({"change": "removed", "previous_version": entry["version"], "ensembl_ids": [], "symbols": []})
+            else:
+                entry = new.record(panel_hash, colour).to_dict()
+                entry["change"] = "added" if old_genes is None else "updated"
+                entry["previous_version"] = old.panels[(panel_hash, colour)][1] if old_genes is not None else None
+                if old_genes is not None and entry["previous_version"] != entry["version"]:
+                    feed.version_bumps += 1
+            entry["genes_added"] = sorted(symbol(gene) for gene in entering - moved)
+            # a gene leaving this colour for another is listed as promoted or demoted in the other colour
+            entry["genes_dropped"] = sorted(symbol(gene) for gene in leaving if gene not in new_colours)
+            entry["genes_promoted"] = sorted(symbol(gene) for gene in moved if colour == PROMOTED_TO)
+            entry["genes_demoted"] = sorted(symbol(gene) for gene in moved if colour != PROMOTED_TO)
+            feed.entries.append(entry)
+    return feed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save PanelApp harvests as snapshots and list the changes between them")
+    parser.add_argument("directory", help="the snapshot store")
+    subparsers = parser.add_subparsers(dest="command")
+    add_parser = subparsers.add_parser("add", help="add a harvest to the store")
+    add_parser.add_argument("name", help="name of the snapshot, eg the date of the harvest")
+    add_parser.add_argument("api_result", help="a PanelAppOut.jsonl file, or a PanelAppOut.txt file from the original output")
+    add_parser.add_argument("--api-symbols", help="the PanelAppOut_symbols.txt file to use with a PanelAppOut.txt file")
+    diff_parser = subparsers.add_parser("diff", help="list the changes between two snapshots")
+    diff_parser.add_argument("old")
+    diff_parser.add_argument("new")
+    diff_parser.add_argument("--output", help="write the change feed to this file")
+    subparsers.add_parser("list", help="list the snapshots in the store")
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.directory)
+    if args.command == "add":
+        snapshot = store.add(args.name, read_api_result(args.api_result, args.api_symbols))
+        print "added snapshot %s: %s panel colours, %s distinct genes" % (snapshot.name, len(snapshot.panels), len(snapshot.genes))
+    elif args.command == "diff":
+        start = time.time()
+        feed = diff(store.load(args.old), store.load(args.new))
+        print feed.summary()
+        print "diffed in %.3f seconds" % (time.time() - start)
+        if args.output:
+            feed.write(args.output)
+    else:
+        for name in store.names():
+            print name